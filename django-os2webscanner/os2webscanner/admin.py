@@ -22,12 +22,14 @@ from django.contrib.auth.models import User
 from django.utils.translation import ugettext_lazy as _
 
 from .models.authentication_model import Authentication
+from .models.contentmatches_model import ContentMatches
 from .models.conversionqueueitem_model import ConversionQueueItem
 from .models.domains.exchangedomain_model import ExchangeDomain
 from .models.domains.filedomain_model import FileDomain
 from .models.group_model import Group
 from .models.match_model import Match
 from .models.organization_model import Organization
+from .models.queueshare_model import QueueShare
 from .models.referrerurl_model import ReferrerUrl
 from .models.regexpattern_model import RegexPattern
 from .models.regexrule_model import RegexRule
@@ -42,7 +44,8 @@ from .models.domains.webdomain_model import WebDomain
 ar = admin.site.register
 classes = [Authentication, Organization, WebDomain, FileDomain, ExchangeDomain,
            RegexRule, Scanner, Scan, Match, Url, ConversionQueueItem, ReferrerUrl,
-           UrlLastModified, Group, Statistic, RegexPattern]
+           UrlLastModified, Group, Statistic, RegexPattern, QueueShare,
+           ContentMatches]
 list(map(ar, classes))
 
 
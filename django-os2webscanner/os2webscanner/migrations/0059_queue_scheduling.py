@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.20 on 2019-03-20 10:12
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('os2webscanner', '0058_auto_20190313_1244'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueueShare',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('type', models.CharField(max_length=256, verbose_name='Type')),
+                ('virtual_time', models.FloatField(default=0.0, verbose_name='Virtuel tid')),
+                ('scan', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='queue_shares', to='os2webscanner.Scan', verbose_name='Scan')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='conversionqueueitem',
+            name='priority',
+            field=models.IntegerField(default=0, verbose_name='Prioritet'),
+        ),
+        migrations.AddField(
+            model_name='conversionqueueitem',
+            name='virtual_time',
+            field=models.FloatField(default=0.0, verbose_name='Virtuel tid'),
+        ),
+        migrations.AddField(
+            model_name='scan',
+            name='queue_priority',
+            field=models.IntegerField(default=0, verbose_name='Kø-prioritet'),
+        ),
+        migrations.AddField(
+            model_name='scan',
+            name='queue_weight',
+            field=models.PositiveIntegerField(default=1, verbose_name='Kø-vægt'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='queueshare',
+            unique_together=set([('scan', 'type')]),
+        ),
+        migrations.AddIndex(
+            model_name='conversionqueueitem',
+            index=models.Index(fields=['type', 'status', '-priority', 'virtual_time'], name='os2webscanner_queue_order_idx'),
+        ),
+    ]
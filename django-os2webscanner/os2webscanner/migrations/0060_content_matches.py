@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.20 on 2019-03-27 09:41
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('os2webscanner', '0059_queue_scheduling'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContentMatches',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(max_length=64, verbose_name='Indholdets hash')),
+                ('rule_fingerprint', models.CharField(max_length=64, verbose_name='Reglernes fingeraftryk')),
+                ('matches', models.TextField(verbose_name='Matches')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Oprettet')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='url',
+            name='content_hash',
+            field=models.CharField(blank=True, max_length=64, null=True, verbose_name='Indholdets hash'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='contentmatches',
+            unique_together=set([('content_hash', 'rule_fingerprint')]),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.20 on 2019-03-28 10:12
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('os2webscanner', '0060_content_matches'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='url',
+            name='matches_complete',
+            field=models.BooleanField(default=True, verbose_name='Fuldstændige matches'),
+        ),
+    ]
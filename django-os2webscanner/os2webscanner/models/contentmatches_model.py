@@ -0,0 +1,61 @@
+# -*- coding: UTF-8 -*-
+# encoding: utf-8
+# The contents of this file are subject to the Mozilla Public License
+# Version 2.0 (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+#    http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS"basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License
+# for the specific language governing rights and limitations under the
+# License.
+#
+# OS2Webscanner was developed by Magenta in collaboration with OS2 the
+# Danish community of open source municipalities (http://www.os2web.dk/).
+#
+# The code is currently governed by OS2 the Danish community of open
+# source municipalities ( http://www.os2web.dk/ )
+
+import json
+
+from django.db import models
+
+
+class ContentMatches(models.Model):
+
+    """The matches found in a piece of content by a set of rules.
+
+    Identified by a hash of the content and a fingerprint of the rules, so
+    later scans with the same rules can copy the matches of content they
+    have seen before instead of converting and scanning it again.
+    """
+
+    content_hash = models.CharField(max_length=64,
+                                    verbose_name='Indholdets hash')
+    rule_fingerprint = models.CharField(max_length=64,
+                                        verbose_name='Reglernes fingeraftryk')
+    # The fields of the matches as a JSON list
+    matches = models.TextField(verbose_name='Matches')
+    created = models.DateTimeField(auto_now_add=True, verbose_name='Oprettet')
+
+    MATCH_FIELDS = ('matched_data', 'matched_rule', 'sensitivity',
+                    'match_context', 'page_no')
+
+    def get_matches(self):
+        """Return the fields of the matches as a list of dicts."""
+        return json.loads(self.matches)
+
+    def set_matches(self, matches):
+        """Set the matches from a list of dicts of their fields."""
+        self.matches = json.dumps([
+            {field: match[field] for field in self.MATCH_FIELDS}
+            for match in matches
+        ])
+
+    def __str__(self):
+        """Return the content hash and rule fingerprint."""
+        return "<%s %s>" % (self.content_hash, self.rule_fingerprint)
+
+    class Meta:
+        abstract = False
+        unique_together = ('content_hash', 'rule_fingerprint')
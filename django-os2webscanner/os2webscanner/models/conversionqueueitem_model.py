@@ -35,6 +35,12 @@ class ConversionQueueItem(models.Model):
         blank=True, null=True, verbose_name='Proces starttidspunkt'
     )
 
+    # The item's place in the queue: items are processed by descending
+    # priority, and by ascending virtual time within the same priority
+    priority = models.IntegerField(default=0, verbose_name='Prioritet')
+    virtual_time = models.FloatField(default=0.0,
+                                     verbose_name='Virtuel tid')
+
     @property
     def file_path(self):
         """Return the full path to the conversion queue item's file."""
@@ -55,3 +61,8 @@ class ConversionQueueItem(models.Model):
 
     class Meta:
         abstract = False
+        indexes = [
+            models.Index(fields=['type', 'status', '-priority',
+                                 'virtual_time'],
+                         name='os2webscanner_queue_order_idx'),
+        ]
@@ -0,0 +1,45 @@
+# -*- coding: UTF-8 -*-
+# encoding: utf-8
+# The contents of this file are subject to the Mozilla Public License
+# Version 2.0 (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+#    http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS"basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License
+# for the specific language governing rights and limitations under the
+# License.
+#
+# OS2Webscanner was developed by Magenta in collaboration with OS2 the
+# Danish community of open source municipalities (http://www.os2web.dk/).
+#
+# The code is currently governed by OS2 the Danish community of open
+# source municipalities ( http://www.os2web.dk/ )
+
+from django.db import models
+
+from .scans.scan_model import Scan
+
+
+class QueueShare(models.Model):
+
+    """A scan's share of the conversion queue for one type of items.
+
+    Holds the virtual time at which the scan's next queue item of the type
+    starts. Each item added advances it by the inverse of the scan's weight,
+    so scans with a higher weight get more of their items processed.
+    """
+
+    scan = models.ForeignKey(Scan, null=False, verbose_name='Scan',
+                             related_name='queue_shares')
+    type = models.CharField(max_length=256, verbose_name='Type')
+    virtual_time = models.FloatField(default=0.0,
+                                     verbose_name='Virtuel tid')
+
+    def __str__(self):
+        """Return the scan, type and virtual time."""
+        return "<%s %s %s>" % (self.scan_id, self.type, self.virtual_time)
+
+    class Meta:
+        abstract = False
+        unique_together = ('scan', 'type')
@@ -140,6 +140,14 @@ class Scan(models.Model):
                                                     verbose_name='Pause ' +
                                                                  'non-OCR conversions')
 
+    # Scheduling of the scan's conversion queue items. Items of scans with a
+    # higher priority are always processed first. Between scans of the same
+    # priority, the processors are shared in proportion to their weights.
+    queue_priority = models.IntegerField(default=0,
+                                         verbose_name='Kø-prioritet')
+    queue_weight = models.PositiveIntegerField(default=1,
+                                               verbose_name='Kø-vægt')
+
     def get_number_of_failed_conversions(self):
         """The number conversions that has failed during this scan."""
         from ..conversionqueueitem_model import ConversionQueueItem
@@ -31,6 +31,13 @@ class Url(models.Model):
     scan = models.ForeignKey(Scan, null=False, verbose_name='Scan',
                              related_name='urls')
     mime_type = models.CharField(max_length=256, verbose_name='Mime-type', null=True)
+    # Hash of the content, if its matches may be reused by later scans
+    content_hash = models.CharField(max_length=64, null=True, blank=True,
+                                    verbose_name='Indholdets hash')
+    # False if some of the content failed to be processed, so its matches
+    # must not be reused
+    matches_complete = models.BooleanField(default=True,
+                                           verbose_name='Fuldstændige matches')
 
     status_code = models.IntegerField(blank=True, null=True,
                                       verbose_name='Status code')
@@ -40,6 +47,11 @@ class Url(models.Model):
                                        related_name='%(app_label)s_%(class)s_linked_urls',
                                        verbose_name='Referrers')
 
+    def set_matches_incomplete(self):
+        """Record that some of the content failed to be processed."""
+        self.matches_complete = False
+        Url.objects.filter(pk=self.pk).update(matches_complete=False)
+
     def __unicode__(self):
         """Return the URL."""
         return self.url
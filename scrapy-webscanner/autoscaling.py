@@ -0,0 +1,76 @@
+# The contents of this file are subject to the Mozilla Public License
+# Version 2.0 (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+#    http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS"basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License
+# for the specific language governing rights and limitations under the
+# License.
+#
+# OS2Webscanner was developed by Magenta in collaboration with OS2 the
+# Danish community of open source municipalities (http://www.os2web.dk/).
+#
+# The code is currently governed by OS2 the Danish community of open
+# source municipalities ( http://www.os2web.dk/ )
+"""Estimates of the number of queue processors each type needs."""
+
+import math
+from collections import defaultdict
+
+# Number of seconds an item is assumed to take to process, until the
+# autoscaler has seen items of the type being processed
+DEFAULT_SECONDS_PER_ITEM = 1.0
+
+
+class ScalingPolicy(object):
+
+    """Decides the number of processors each type of queue should have.
+
+    Each type gets enough processors to get through its queue within
+    target_seconds, as estimated from the number of NEW items and the
+    number of seconds a processor spends per item.
+    """
+
+    def __init__(self, bounds, target_seconds):
+        """Initialize the policy.
+
+        bounds is a function returning the minimum and maximum number of
+        processors of a type.
+        """
+        self.bounds = bounds
+        self.target_seconds = target_seconds
+        self.seconds_per_item = defaultdict(
+            lambda: DEFAULT_SECONDS_PER_ITEM
+        )
+
+    def observe(self, ptype, started_items, now):
+        """Update the estimate of the seconds per item of the type.
+
+        started_items are (process id, process start time) pairs of the
+        type's items which processors have started and not finished.
+        """
+        if not started_items:
+            return
+        ages = [(now - start_time).total_seconds()
+                for pid, start_time in started_items]
+        busy_count = len(set(pid for pid, start_time in started_items))
+        # On average, the items being processed are halfway done, and a
+        # processor working on several items at once, like the OCR
+        # processor, gets through them that many times faster
+        item_seconds = 2 * sum(ages) / len(ages)
+        estimate = item_seconds * busy_count / len(ages)
+        self.seconds_per_item[ptype] = (
+            0.7 * self.seconds_per_item[ptype] + 0.3 * estimate
+        )
+
+    def wanted_processes(self, ptype, new_count, busy_count):
+        """Return the number of processors the type should have.
+
+        busy_count is the number of processors with items of the type
+        claimed, which are all needed until they are done with them.
+        """
+        work = new_count * self.seconds_per_item[ptype]
+        wanted = max(busy_count, math.ceil(work / self.target_seconds))
+        minimum, maximum = self.bounds(ptype)
+        return min(max(wanted, minimum), maximum)
@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+# The contents of this file are subject to the Mozilla Public License
+# Version 2.0 (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+#    http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS"basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License
+# for the specific language governing rights and limitations under the
+# License.
+#
+# OS2Webscanner was developed by Magenta in collaboration with OS2 the
+# Danish community of open source municipalities (http://www.os2web.dk/).
+#
+# The code is currently governed by OS2 the Danish community of open
+# source municipalities ( http://www.os2web.dk/ )
+
+"""Compile the name and street name dictionaries used by the rules.
+
+Run this at install time, and whenever the files in the data directory
+change, so that the queue processors can map the compiled tables directly.
+"""
+
+from utils import load_webscanner_settings, run_django_setup
+load_webscanner_settings()
+run_django_setup()
+
+from scanners.rules.name import NameRule
+from scanners.rules.address import AddressRule
+
+first_names, last_names = NameRule.load_dictionaries()
+street_names = AddressRule.load_dictionaries()
+
+print("Compiled {0} first names, {1} last names and {2} street names".format(
+    len(first_names), len(last_names), len(street_names)))
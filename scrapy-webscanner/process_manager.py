@@ -17,23 +17,30 @@
 
 """Start up and manage queue processors to ensure they stay running.
 
-Starts up multiple instances of each processor.
+Starts up multiple instances of each processor, and scales their number with
+the amount of work in their queues.
 Restarts processors if they die or if they get stuck processing a single
 item for too long.
 """
 
+import gc
 import os
 import shutil
 import sys
 import subprocess
 import time
+import traceback
 import signal
 import settings as scanner_settings
+from autoscaling import ScalingPolicy
+from collections import defaultdict
 
 import django
+import psutil
 from datetime import timedelta
 from django.utils import timezone
 from django.db import transaction, IntegrityError, DatabaseError
+from django.db.models import Count, Q
 from django import db
 from django.conf import settings as django_settings
 
@@ -59,10 +66,105 @@ if not os.path.exists(log_dir):
 processes_per_type = scanner_settings.NUMBER_OF_PROCESSES_PER_TYPE
 processing_timeout = timedelta(minutes=20)
 
-process_types = ('html', 'libreoffice', 'ocr', 'pdf', 'zip', 'text', 'csv', 'xml')
+process_types = ('html', 'libreoffice', 'ocr', 'pdf', 'zip', 'text', 'csv', 'xml',
+                 'office', 'archive')
+
+# Number of rounds of the main loop a type must have too many processors
+# before one of them is stopped
+SCALE_DOWN_ROUNDS = 6
+
+# Number of seconds a processor interrupted by the autoscaler gets to put its
+# items back in the queue and exit before it is terminated
+RETIRE_TIMEOUT = 60
 
 process_map = {}
 process_list = []
+# Processors asked to stop by the autoscaler, which haven't stopped yet
+retiring_list = []
+
+
+class ForkedProcess(object):
+
+    """A queue processor forked from the process manager.
+
+    Has the interface of the subprocess.Popen objects of processors started
+    as programs.
+    """
+
+    def __init__(self, process_args, log_fh):
+        """Fork a processor with the process_queue.py arguments given."""
+        sys.stdout.flush()
+        sys.stderr.flush()
+        # The processor must not use the process manager's connections
+        db.connections.close_all()
+        self.returncode = None
+        self.pid = os.fork()
+        if self.pid == 0:
+            run_forked_process(process_args, log_fh)
+
+    def poll(self):
+        """Return the exit code of the processor, or None if it runs."""
+        if self.returncode is None:
+            pid, status = os.waitpid(self.pid, os.WNOHANG)
+            if pid:
+                self._set_returncode(status)
+        return self.returncode
+
+    def wait(self):
+        """Wait for the processor to exit and return its exit code."""
+        if self.returncode is None:
+            pid, status = os.waitpid(self.pid, 0)
+            self._set_returncode(status)
+        return self.returncode
+
+    def send_signal(self, sig):
+        """Send the signal to the processor."""
+        if self.returncode is None:
+            os.kill(self.pid, sig)
+
+    def terminate(self):
+        """Stop the processor with SIGTERM."""
+        self.send_signal(signal.SIGTERM)
+
+    def _set_returncode(self, status):
+        if os.WIFSIGNALED(status):
+            self.returncode = -os.WTERMSIG(status)
+        else:
+            self.returncode = os.WEXITSTATUS(status)
+
+
+def run_forked_process(process_args, log_fh):
+    """Run a forked processor, never returning to the process manager."""
+    exit_code = 0
+    try:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        os.dup2(log_fh.fileno(), sys.stdout.fileno())
+        os.dup2(log_fh.fileno(), sys.stderr.fileno())
+
+        from process_queue import process_queue
+        process_queue(process_args[0], os.getpid(), *process_args[1:])
+    except BaseException:
+        traceback.print_exc()
+        exit_code = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(exit_code)
+
+
+def warm_up():
+    """Load what the processors need, for forked processors to share."""
+    from process_queue import process_queue  # noqa: imports all processors
+    from scanners.rules.address import AddressRule
+    from scanners.rules.name import NameRule
+
+    NameRule.load_dictionaries()
+    AddressRule.load_dictionaries()
+    # Keep the garbage collector from touching, and thus copying, the
+    # shared objects in the processors
+    if hasattr(gc, 'freeze'):
+        gc.collect()
+        gc.freeze()
 
 
 def stop_process(p):
@@ -82,6 +184,16 @@ def stop_process(p):
     # Remove pid from process map
     if pid in process_map:
         del process_map[pid]
+    # Put the queue items claimed by this process id, but never started,
+    # back in the queue
+    ConversionQueueItem.objects.filter(
+        status=ConversionQueueItem.PROCESSING,
+        process_id=pid,
+        process_start_time__isnull=True
+    ).update(
+        status=ConversionQueueItem.NEW,
+        process_id=None
+    )
     # Set any ongoing queue-items for this process id to failed
     ongoing_items = ConversionQueueItem.objects.filter(
         status=ConversionQueueItem.PROCESSING,
@@ -132,11 +244,15 @@ def start_process(p):
     log_file = os.path.join(log_dir, p['name'] + '.log')
     log_fh = open(log_file, 'a')
 
-    process_handle = subprocess.Popen(
-        p['program_args'],
-        stdout=log_fh,
-        stderr=log_fh
-    )
+    if scanner_settings.PREFORK_PROCESSORS:
+        # The arguments following process_queue.py
+        process_handle = ForkedProcess(p['program_args'][2:], log_fh)
+    else:
+        process_handle = subprocess.Popen(
+            p['program_args'],
+            stdout=log_fh,
+            stderr=log_fh
+        )
 
     pid = process_handle.pid
 
@@ -160,9 +276,130 @@ def restart_process(processdata):
     start_process(processdata)
 
 
+def add_process(ptype):
+    """Add a process of the type to the processes to run, and return it."""
+    names = set(p['name'] for p in process_list + retiring_list)
+    i = 0
+    while '%s%d' % (ptype, i) in names:
+        i += 1
+    name = '%s%d' % (ptype, i)
+    program = [
+        'python',
+        os.path.join(base_dir, 'scrapy-webscanner',
+                     'process_queue.py'),
+        ptype
+    ]
+    # Libreoffice takes the homedir name as second arg
+    if "libreoffice" == ptype:
+        program.append(name)
+    p = {'program_args': program, 'name': name, 'type': ptype}
+    process_map[name] = p
+    process_list.append(p)
+    return p
+
+
+def retire_process(p):
+    """Interrupt the process to make it stop.
+
+    SIGINT interrupts the process at once, also in the middle of an item,
+    and it puts the items it has claimed and not finished, including the
+    interrupted one, back in the queue. It is terminated if it hasn't
+    stopped within RETIRE_TIMEOUT.
+    """
+    print("Stopping process %s, which is not needed" % p['name'])
+    process_list.remove(p)
+    del process_map[p['name']]
+    p['retire_time'] = time.time()
+    p['process_handle'].send_signal(signal.SIGINT)
+    retiring_list.append(p)
+
+
+def check_retiring_processes():
+    """Clean up after the retiring processes which have stopped."""
+    for p in list(retiring_list):
+        if (p['process_handle'].poll() is not None or
+                time.time() - p['retire_time'] > RETIRE_TIMEOUT):
+            stop_process(p)
+            retiring_list.remove(p)
+
+
+class Autoscaler(object):
+
+    """Decides the number of processors of each type to run.
+
+    The number each type should have is decided by a ScalingPolicy.
+    Processors are added one at a time while the CPU and memory budget
+    allows it, and removed one at a time once a type has had too many for a
+    while.
+    """
+
+    def __init__(self):
+        self.policy = ScalingPolicy(self.bounds,
+                                    scanner_settings.AUTOSCALE_TARGET_SECONDS)
+        self.surplus_rounds = defaultdict(int)
+
+    @staticmethod
+    def bounds(ptype):
+        """Return the minimum and maximum number of processors of the type."""
+        return scanner_settings.PROCESSES_PER_TYPE_BOUNDS.get(
+            ptype, (processes_per_type, processes_per_type)
+        )
+
+    @staticmethod
+    def within_budget():
+        """Return whether there is room for another processor."""
+        return (
+            len(process_list) < scanner_settings.MAX_PROCESSES and
+            psutil.cpu_percent() < scanner_settings.MAX_CPU_PERCENT and
+            psutil.virtual_memory().available >=
+            scanner_settings.MIN_AVAILABLE_MEMORY_MB * 1024 * 1024
+        )
+
+    def scale(self):
+        """Start or stop a processor of each type which needs it."""
+        now = timezone.now()
+        new_counts = dict(ConversionQueueItem.objects.filter(
+            Q(type='ocr') | Q(url__scan__pause_non_ocr_conversions=False),
+            status=ConversionQueueItem.NEW
+        ).values_list('type').annotate(Count('pk')))
+        started_items = defaultdict(list)
+        busy_pids = defaultdict(set)
+        for ptype, pid, start_time in ConversionQueueItem.objects.filter(
+            status=ConversionQueueItem.PROCESSING
+        ).values_list('type', 'process_id', 'process_start_time'):
+            if start_time is not None:
+                started_items[ptype].append((pid, start_time))
+            busy_pids[ptype].add(pid)
+
+        changes = []
+        for ptype in process_types:
+            running = [p for p in process_list if p['type'] == ptype]
+            self.policy.observe(ptype, started_items[ptype], now)
+            wanted = self.policy.wanted_processes(
+                ptype, new_counts.get(ptype, 0), len(busy_pids[ptype])
+            )
+            changes.append((wanted - len(running), ptype, running))
+
+        # The types needing processors the most get them first
+        for change, ptype, running in sorted(changes, reverse=True):
+            if change > 0:
+                self.surplus_rounds[ptype] = 0
+                if self.within_budget():
+                    start_process(add_process(ptype))
+            elif change < 0:
+                self.surplus_rounds[ptype] += 1
+                idle = [p for p in running
+                        if p['pid'] not in busy_pids[ptype]]
+                if idle and self.surplus_rounds[ptype] >= SCALE_DOWN_ROUNDS:
+                    self.surplus_rounds[ptype] = 0
+                    retire_process(idle[-1])
+            else:
+                self.surplus_rounds[ptype] = 0
+
+
 def exit_handler(signum=None, frame=None):
     """Handle process manager exit signals by stopping all processes."""
-    for p in process_list:
+    for p in process_list + retiring_list:
         stop_process(p)
     sys.exit(1)
 
@@ -175,21 +412,19 @@ def main():
     # Delete all inactive scan's queue items to start with
     Scan.cleanup_finished_scans(timedelta(days=10000), log=True)
 
+    autoscaler = None
+    if scanner_settings.AUTOSCALE_PROCESSES:
+        autoscaler = Autoscaler()
+
     for ptype in process_types:
-        for i in range(processes_per_type):
-            name = '%s%d' % (ptype, i)
-            program = [
-                'python',
-                os.path.join(base_dir, 'scrapy-webscanner',
-                             'process_queue.py'),
-                ptype
-            ]
-            # Libreoffice takes the homedir name as second arg
-            if "libreoffice" == ptype:
-                program.append(name)
-            p = {'program_args': program, 'name': name}
-            process_map[name] = p
-            process_list.append(p)
+        count = processes_per_type
+        if autoscaler is not None:
+            count = autoscaler.bounds(ptype)[0]
+        for i in range(count):
+            add_process(ptype)
+
+    if scanner_settings.PREFORK_PROCESSORS:
+        warm_up()
 
     for p in process_list:
         start_process(p)
@@ -204,6 +439,7 @@ def main():
                     pdata['name']
                 )))
                 restart_process(pdata)
+        check_retiring_processes()
 
         stuck_processes = ConversionQueueItem.objects.filter(
             status=ConversionQueueItem.PROCESSING,
@@ -214,7 +450,10 @@ def main():
 
         for p in stuck_processes:
             pid = p.process_id
-            if pid in process_map:
+            if pid in process_map and process_map[pid] in retiring_list:
+                # Terminated by check_retiring_processes when it times out
+                continue
+            elif pid in process_map:
                 print("Process with pid %s is stuck, restarting" % pid)
                 stuck_process = process_map[pid]
                 restart_process(stuck_process)
@@ -240,6 +479,18 @@ def main():
                 # Clean up failed conversion temp dir
                 p.delete_tmp_dir()
 
+        # Put items claimed by processors which are gone, but never started,
+        # back in the queue
+        ConversionQueueItem.objects.filter(
+            status=ConversionQueueItem.PROCESSING,
+            process_start_time__isnull=True
+        ).exclude(
+            process_id__in=[pid for pid in process_map if isinstance(pid, int)]
+        ).update(
+            status=ConversionQueueItem.NEW,
+            process_id=None
+        )
+
         try:
             with transaction.atomic():
                 running_scans = Scan.objects.filter(
@@ -266,6 +517,9 @@ def main():
 
         Scan.pause_non_ocr_conversions_on_scans_with_too_many_ocr_items()
 
+        if autoscaler is not None:
+            autoscaler.scale()
+
         time.sleep(10)
 
 
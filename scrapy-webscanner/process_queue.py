@@ -30,21 +30,35 @@ sys.path.append(base_dir + "/webscanner_site")
 os.environ["DJANGO_SETTINGS_MODULE"] = "webscanner.settings"
 django.setup()
 
+import settings as scanner_settings
 from scanners.processors.processor import Processor
 
-pid = os.getpid()
 
-queued_processor = Processor.processor_by_type(sys.argv[1])
+def process_queue(processor_type, pid, *args):
+    """Process the queue of the given type until the processor must stop.
 
-setup_args = [pid]
-if len(sys.argv) > 2:
-    setup_args.extend(sys.argv[2:])
+    The extra arguments are passed to the processor's setup.
+    """
+    queued_processor = Processor.processor_by_type(processor_type)
+    if queued_processor is None:
+        return
 
-if queued_processor is not None:
-    queued_processor.setup_queue_processing(*setup_args)
+    if scanner_settings.LONG_LIVED_PROCESSORS:
+        queued_processor.documents_to_process = (
+            scanner_settings.PROCESSOR_MAX_ITEMS
+        )
+        queued_processor.max_rss = (
+            scanner_settings.PROCESSOR_MAX_RSS_MB * 1024 * 1024
+        )
+
+    queued_processor.setup_queue_processing(pid, *args)
     try:
         queued_processor.process_queue()
     except KeyboardInterrupt:
         pass
     finally:
         queued_processor.teardown_queue_processing()
+
+
+if __name__ == '__main__':
+    process_queue(sys.argv[1], os.getpid(), *sys.argv[2:])
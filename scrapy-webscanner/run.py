@@ -112,6 +112,9 @@ class StartScan(object):
         """Handle the spider being finished."""
         # TODO: Check reason for if it was finished, cancelled, or shutdown
         logging.debug('Spider is closing. Reason {0}'.format(reason))
+        if reason == 'finished':
+            # All of the scan's content has been processed
+            self.scanner.record_content_matches()
         self.store_stats()
         reactor.stop()
 
@@ -162,7 +165,16 @@ class StartScan(object):
         Keep it open if there are still queue items to be processed.
         """
         from os2webscanner.models.conversionqueueitem_model import ConversionQueueItem
+        from scanners.processors.processor import Processor
         logging.debug("Spider Idle...")
+        # Items processed in memory are queued if that fails, so they must
+        # be done before the queue is counted
+        if not Processor.inline_processing_done():
+            logging.info(
+                "Keeping spider alive: items are still processed in memory"
+            )
+            raise DontCloseSpider
+
         # Keep spider alive if there are still queue items to be processed
         remaining_queue_items = ConversionQueueItem.objects.filter(
             status__in=[ConversionQueueItem.NEW,
@@ -36,3 +36,8 @@ class MatchItem(DjangoItem):
 
     Note that this is not stored in the DB."""
     original_matched_data = Field()
+
+    """Pattern object of the regex rule pattern which the match was found by.
+
+    Note that this is not stored in the DB."""
+    matched_pattern = Field()
@@ -23,6 +23,8 @@ from .pdf import PDFProcessor
 from .csv_processor import CSVProcessor
 from .libreoffice import LibreOfficeProcessor
 from .xml import XmlProcessor
+from .office import OfficeProcessor
+from .generic_archive import GenericArchiveProcessor
 
 Processor.register_processor(TextProcessor.item_type, TextProcessor)
 Processor.register_processor(HTMLProcessor.item_type, HTMLProcessor)
@@ -32,5 +34,9 @@ Processor.register_processor(PDFProcessor.item_type, PDFProcessor)
 Processor.register_processor(CSVProcessor.item_type, CSVProcessor)
 Processor.register_processor(LibreOfficeProcessor.item_type, LibreOfficeProcessor)
 Processor.register_processor(XmlProcessor.item_type, XmlProcessor)
+Processor.register_processor(OfficeProcessor.item_type, OfficeProcessor)
+Processor.register_processor(GenericArchiveProcessor.item_type,
+                             GenericArchiveProcessor)
 
-__all__ = ["html", "libreoffice", "pdf", "ocr", "zip", "text", "csv_processor", "xml"]
+__all__ = ["html", "libreoffice", "pdf", "ocr", "zip", "text", "csv_processor", "xml",
+           "office", "generic_archive"]
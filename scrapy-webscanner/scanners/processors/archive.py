@@ -0,0 +1,329 @@
+# The contents of this file are subject to the Mozilla Public License
+# Version 2.0 (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+#    http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS"basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License
+# for the specific language governing rights and limitations under the
+# License.
+#
+# OS2Webscanner was developed by Magenta in collaboration with OS2 the
+# Danish community of open source municipalities (http://www.os2web.dk/).
+#
+# The code is currently governed by OS2 the Danish community of open
+# source municipalities ( http://www.os2web.dk/ )
+"""Base class of the processors for archives."""
+
+import io
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from os2webscanner.models.conversionqueueitem_model import ConversionQueueItem
+
+from .processor import Processor, datetime_print, guess_mime_type
+
+# Number of bytes read from the start of a member to sniff its type
+SNIFF_SIZE = 8192
+
+# Size of the chunks members are spilled to disk in
+CHUNK_SIZE = 64 * 1024
+
+# Number of bytes an archive may always expand to, however small it is
+MIN_EXTRACTED_BYTES = 16 * 1024 * 1024
+
+
+class ExtractionLimitError(Exception):
+
+    """Raised when an archive expands to more data than allowed."""
+
+
+class NotInlineError(Exception):
+
+    """Raised when a member of an archive can't be processed in memory."""
+
+
+class Extraction(object):
+
+    """The extraction of a queued archive, including its nested archives.
+
+    Counts the bytes extracted, so archive bombs are stopped however their
+    headers lie about the sizes of the members.
+    """
+
+    def __init__(self, url_object, tmp_dir, max_bytes):
+        """Initialize the extraction, allowing max_bytes to be extracted."""
+        self.url = url_object
+        self.tmp_dir = tmp_dir
+        self.remaining_bytes = max_bytes
+        self.spilled = 0
+
+    def read(self, f, size):
+        """Read at most size bytes from the member."""
+        data = f.read(size)
+        self.count(len(data))
+        return data
+
+    def copy(self, f, out):
+        """Copy the rest of the member to the output file."""
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            self.count(len(chunk))
+            out.write(chunk)
+
+    def count(self, size):
+        """Count size bytes as extracted."""
+        self.remaining_bytes -= size
+        if self.remaining_bytes < 0:
+            raise ExtractionLimitError(
+                "The archive expands to more than {0} times its size".format(
+                    settings.ARCHIVE_MAX_RATIO)
+            )
+
+    def spill_path(self, name):
+        """Return the path to spill the member to, in a directory of its own
+        so members with the same name don't collide."""
+        self.spilled += 1
+        directory = os.path.join(self.tmp_dir, str(self.spilled))
+        os.makedirs(directory)
+        return os.path.join(directory, os.path.basename(name) or 'member')
+
+    @contextmanager
+    def nested(self, processor, name, head, f):
+        """Spill the nested archive to disk, and return its path."""
+        path = self.spill_path(name)
+        try:
+            with open(path, 'wb') as out:
+                out.write(head)
+                self.copy(f, out)
+            yield path
+        finally:
+            shutil.rmtree(os.path.dirname(path))
+
+    def process(self, processor, name, data):
+        """Process the member in memory.
+
+        If that fails, the matches of the archive's url are incomplete, so
+        they are not reused by later scans.
+        """
+        try:
+            result = processor.process_inline(data, self.url)
+        except Exception as e:
+            datetime_print("Processing {0} in {1} failed: {2}".format(
+                name, self.url.url, e))
+            result = False
+        if not result:
+            self.url.set_matches_incomplete()
+
+    def spill(self, name, data, f):
+        """Spill the member to disk to be queued, data being its start."""
+        with open(self.spill_path(name), 'wb') as out:
+            out.write(data)
+            self.copy(f, out)
+
+
+class InlineExtraction(Extraction):
+
+    """The extraction of a spider item's archive in memory.
+
+    The members are collected instead of processed, so nothing is processed
+    unless all of them can be processed in memory.
+    """
+
+    def __init__(self, url_object, max_bytes):
+        """Initialize the extraction, allowing max_bytes to be extracted."""
+        super().__init__(url_object, None, max_bytes)
+        self.members = []
+
+    @contextmanager
+    def nested(self, processor, name, head, f):
+        """Read the nested archive into memory, and return a file object
+        of it."""
+        if not processor.reads_file_objects:
+            raise NotInlineError(
+                "{0} must be extracted on disk".format(name))
+        yield io.BytesIO(head + self.read(f, self.remaining_bytes + 1))
+
+    def process(self, processor, name, data):
+        """Collect the member to be processed."""
+        self.members.append((processor, name, data))
+
+    def spill(self, name, data, f):
+        raise NotInlineError("{0} must be converted on disk".format(name))
+
+
+class ArchiveProcessor(Processor):
+
+    """Processes archives by streaming their members.
+
+    The type of each member is sniffed from its name or its first bytes.
+    Members which can be processed in memory, like text, HTML, XML and CSV,
+    are processed as they are read. Archives in the archive are processed
+    the same way, down to ARCHIVE_MAX_DEPTH levels. Only members which must
+    be converted by other processors are spilled to disk and queued.
+
+    Subclasses implement members, and list the exceptions raised when their
+    archives are damaged in archive_errors. Archives whose members can be
+    read from file objects can be processed in memory.
+    """
+
+    archive_errors = ()
+    # Whether members reads archives from file objects as well as paths
+    reads_file_objects = False
+
+    def handle_spider_item(self, data, url_object):
+        """Add the item to the queue."""
+        return self.add_to_queue(data, url_object)
+
+    def handle_queue_item(self, item):
+        """Process the queue item's members and queue the rest."""
+        tmp_dir = item.tmp_dir
+        if not os.path.exists(tmp_dir):
+            os.makedirs(tmp_dir)
+
+        result = self.convert(item, tmp_dir)
+        if result:
+            if os.path.exists(item.file_path):
+                os.remove(item.file_path)
+            if os.listdir(tmp_dir):
+                self.add_processed_files(item, tmp_dir)
+        return result
+
+    def convert(self, item, tmp_dir):
+        """Process the members of the item's archive, spilling those which
+        must be converted to tmp_dir.
+
+        Returns False if the archive is damaged or expands to more than
+        ARCHIVE_MAX_RATIO times its size.
+        """
+        max_bytes = self.max_extracted_bytes(os.path.getsize(item.file_path))
+        extraction = Extraction(item.url, tmp_dir, max_bytes)
+        try:
+            self.extract(item.file_path, extraction, 1)
+        except ((ExtractionLimitError,) + self.archive_errors) as e:
+            datetime_print("Extracting {0} failed: {1}".format(
+                item.file_path, e))
+            return False
+        return True
+
+    @staticmethod
+    def max_extracted_bytes(size):
+        """Return the number of bytes an archive of size bytes may expand
+        to."""
+        return max(size * settings.ARCHIVE_MAX_RATIO, MIN_EXTRACTED_BYTES)
+
+    def process_inline(self, data, url_object):
+        """Extract the archive in memory and process its members.
+
+        Nothing is processed unless all the members, including those of
+        nested archives, can be processed in memory, so the archive can be
+        queued instead. If a member fails after others have been processed,
+        it and the rest are queued on their own, so the members already
+        processed aren't processed again.
+        """
+        members = self.inline_members(data, url_object)
+        if members is None:
+            return False
+        for index, (processor, name, member_data) in enumerate(members):
+            try:
+                result = processor.process_inline(member_data, url_object)
+            except Exception as e:
+                datetime_print("Processing {0} in {1} failed: {2}".format(
+                    name, url_object.url, e))
+                result = False
+            if not result:
+                if index == 0:
+                    return False
+                self.queue_members(members[index:], url_object)
+                break
+        return True
+
+    def inline_members(self, data, url_object):
+        """Return the processor, name and data of each member of the archive
+        data, or None if they can't all be processed in memory."""
+        max_bytes = min(settings.SPIDER_INLINE_MAX_BYTES,
+                        self.max_extracted_bytes(len(data)))
+        extraction = InlineExtraction(url_object, max_bytes)
+        try:
+            self.extract(io.BytesIO(data), extraction, 1)
+        except ((ExtractionLimitError, NotInlineError) +
+                self.archive_errors):
+            return None
+        return extraction.members
+
+    def queue_members(self, members, url_object):
+        """Write the members to disk and add them to the queue."""
+        tmp_dir = url_object.tmp_dir
+        if not os.path.exists(tmp_dir):
+            os.makedirs(tmp_dir)
+        # Each member gets a directory of its own, so members with the same
+        # name don't collide
+        members_dir = tempfile.mkdtemp(dir=tmp_dir)
+        for index, (processor, name, member_data) in enumerate(members):
+            directory = os.path.join(members_dir, str(index))
+            os.makedirs(directory)
+            file_path = os.path.join(directory,
+                                     os.path.basename(name) or 'member')
+            with open(file_path, 'wb') as f:
+                f.write(member_data)
+            self.get_queue_backend().add(ConversionQueueItem(
+                file=file_path,
+                type=processor.item_type,
+                url=url_object,
+                status=ConversionQueueItem.NEW,
+            ))
+
+    def members(self, source):
+        """Yield the name and a file object of each file in the archive at
+        the path source, or in the file object source if the processor
+        reads_file_objects."""
+        raise NotImplementedError
+
+    def extract(self, source, extraction, depth):
+        """Process the members of the archive at the path or in the file
+        object source, at the given depth of nesting."""
+        for name, f in self.members(source):
+            self.process_member(name, f, extraction, depth)
+
+    def process_member(self, name, f, extraction, depth):
+        """Process the member, or spill it to be queued, as the extraction
+        does."""
+        head = extraction.read(f, SNIFF_SIZE)
+        mime_type = guess_mime_type(name)
+        if mime_type is None:
+            mime_type = self.mime_magic.from_buffer(head)
+        processor_type = Processor.mimetype_to_processor_type(mime_type)
+        processor = Processor.processor_by_type(processor_type)
+        if (processor is None or
+                processor_type == 'ocr' and not extraction.url.scan.do_ocr):
+            return
+
+        if isinstance(processor, ArchiveProcessor):
+            if depth >= settings.ARCHIVE_MAX_DEPTH:
+                datetime_print("Skipping {0} in {1}: nested too deep".format(
+                    name, extraction.url.url))
+                return
+            try:
+                with extraction.nested(processor, name, head, f) as source:
+                    processor.extract(source, extraction, depth + 1)
+            except processor.archive_errors as e:
+                datetime_print("Extracting {0} in {1} failed: {2}".format(
+                    name, extraction.url.url, e))
+            return
+
+        # Members too large to process in memory are processed from disk
+        data = head + extraction.read(
+            f, settings.TEXT_WINDOW_THRESHOLD - len(head) + 1
+        )
+        if (len(data) <= settings.TEXT_WINDOW_THRESHOLD and
+                processor.can_process_inline(data, extraction.url)):
+            extraction.process(processor, name, data)
+            return
+
+        extraction.spill(name, data, f)
@@ -0,0 +1,201 @@
+# The contents of this file are subject to the Mozilla Public License
+# Version 2.0 (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+#    http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS"basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License
+# for the specific language governing rights and limitations under the
+# License.
+#
+# OS2Webscanner was developed by Magenta in collaboration with OS2 the
+# Danish community of open source municipalities (http://www.os2web.dk/).
+#
+# The code is currently governed by OS2 the Danish community of open
+# source municipalities ( http://www.os2web.dk/ )
+"""Content-addressed cache of the text extracted from files.
+
+Files with the same content, like copies of a document on a file share or
+an attachment sent to many mailboxes, then only have to be converted once.
+"""
+
+import contextlib
+import functools
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+
+from django.conf import settings
+
+try:
+    _content_hash = functools.partial(hashlib.blake2b, digest_size=20)
+except AttributeError:
+    # BLAKE2 needs Python 3.6
+    _content_hash = hashlib.sha256
+
+# Size of the chunks files are hashed in
+CHUNK_SIZE = 1024 * 1024
+
+# Minimum number of seconds between checks of the cache's size by any of
+# the processes sharing it
+EVICTION_INTERVAL = 60
+
+# Name of the file in the cache directory whose modification time is the
+# time of the last check of the cache's size
+EVICTION_STAMP = '.last_eviction'
+
+# Age in seconds after which a temporary file is taken to be left behind by
+# a process which died while writing an entry
+STALE_TEMPORARY_AGE = 3600
+
+# Fraction of the maximum size the cache is reduced to when it is too large
+EVICTION_TARGET = 0.9
+
+
+def content_key(data):
+    """Return the cache key of the bytes."""
+    return _content_hash(data).hexdigest()
+
+
+def file_content_key(file_path):
+    """Return the cache key of the content of the file."""
+    content_hash = _content_hash()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            content_hash.update(chunk)
+    return content_hash.hexdigest()
+
+
+class ConversionCache(object):
+
+    """An on-disk cache of extracted text, keyed by the kind of conversion
+    and a hash of the converted content.
+
+    The cache is shared by all processes using the same directory. Entries
+    are written atomically, and the least recently used entries are evicted
+    when the cache grows larger than max_bytes. Its size is checked when a
+    process starts using the cache and when entries are added, at most
+    once every EVICTION_INTERVAL seconds across all the processes.
+    """
+
+    def __init__(self, directory, max_bytes):
+        """Initialize the cache in the directory."""
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._evict_if_due()
+
+    def _path(self, kind, key):
+        return os.path.join(self.directory, kind, key[:2], key)
+
+    def get_text(self, kind, key):
+        """Return the cached text, or None if it isn't cached."""
+        path = self._path(kind, key)
+        try:
+            with open(path, encoding='utf-8') as f:
+                text = f.read()
+            # Mark the entry as recently used
+            os.utime(path, None)
+        except FileNotFoundError:
+            return None
+        return text
+
+    def put_text(self, kind, key, text):
+        """Cache the text."""
+        with self._open_entry(kind, key) as f:
+            f.write(text.encode('utf-8'))
+
+    def put_file(self, kind, key, file_path):
+        """Cache the text in the UTF-8 encoded file."""
+        with self._open_entry(kind, key) as f:
+            with open(file_path, 'rb') as text_file:
+                shutil.copyfileobj(text_file, f)
+
+    @contextlib.contextmanager
+    def _open_entry(self, kind, key):
+        """Open an entry for writing.
+
+        The entry is written to a temporary file, which replaces the entry
+        when it is complete, so readers never see partial entries.
+        """
+        path = self._path(kind, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        f = tempfile.NamedTemporaryFile(dir=os.path.dirname(path),
+                                        prefix='.', delete=False)
+        try:
+            with f:
+                yield f
+        except BaseException:
+            os.remove(f.name)
+            raise
+        os.replace(f.name, path)
+        self._evict_if_due()
+
+    def _evict_if_due(self):
+        """Evict entries unless a process has checked the cache's size in
+        the last EVICTION_INTERVAL seconds.
+
+        The time of the last check is kept as the modification time of a
+        stamp file in the cache directory, so it is shared by the processes.
+        """
+        stamp_path = os.path.join(self.directory, EVICTION_STAMP)
+        try:
+            if time.time() - os.stat(stamp_path).st_mtime < EVICTION_INTERVAL:
+                return
+        except FileNotFoundError:
+            os.makedirs(self.directory, exist_ok=True)
+        with open(stamp_path, 'a'):
+            os.utime(stamp_path, None)
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries if the cache is too big.
+
+        Temporary files left behind by processes which died while writing
+        an entry are removed too.
+        """
+        entries = []
+        total = 0
+        stale = time.time() - STALE_TEMPORARY_AGE
+        for root, dirnames, filenames in os.walk(self.directory):
+            for name in filenames:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if name.startswith('.'):
+                    # An entry being written, or the eviction stamp
+                    if name != EVICTION_STAMP and stat.st_mtime < stale:
+                        with contextlib.suppress(FileNotFoundError):
+                            os.remove(path)
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        if total <= self.max_bytes:
+            return
+
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self.max_bytes * EVICTION_TARGET:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+_conversion_cache = None
+
+
+def get_conversion_cache():
+    """Return the conversion cache, or None if it is disabled."""
+    global _conversion_cache
+    if not settings.CONVERSION_CACHE_MAX_BYTES:
+        return None
+    if _conversion_cache is None:
+        _conversion_cache = ConversionCache(settings.CONVERSION_CACHE_DIR,
+                                            settings.CONVERSION_CACHE_MAX_BYTES)
+    return _conversion_cache
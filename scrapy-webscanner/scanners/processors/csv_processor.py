@@ -18,7 +18,7 @@ import io
 from os2webscanner.models.match_model import Match
 from os2webscanner.models.sensitivity_level import Sensitivity
 
-from .processor import Processor
+from .processor import MatchSink, Processor
 from .text import TextProcessor
 
 import os
@@ -30,6 +30,7 @@ class CSVProcessor(Processor):
     """Processes CSV files."""
 
     item_type = "csv"
+    claim_batch_size = 10
     text_processor = TextProcessor()
 
     def handle_spider_item(self, data, url_object):
@@ -43,6 +44,25 @@ class CSVProcessor(Processor):
             os.remove(item.file_path)
         return result
 
+    def can_process_inline(self, data, url_object):
+        """CSVs are processed in memory unless they must be annotated."""
+        return not url_object.scan.output_spreadsheet_file
+
+    def process_inline(self, data, url_object):
+        """Process the CSV."""
+        return self.process(data, url_object)
+
+    def can_process_windows(self, url_object):
+        """Return whether the CSV can be processed as plain text in windows.
+
+        Annotated spreadsheets are written row by row, so they can't.
+        """
+        return not url_object.scan.output_spreadsheet_file
+
+    def process_windows(self, windows, url_object):
+        """Process the windows of a large CSV as plain text."""
+        return self.text_processor.process_windows(windows, url_object)
+
     def process(self, data, url_object):
         """Process the CSV, by executing rules and saving matches."""
         from ..scanner_types.scanner import Scanner
@@ -90,6 +110,8 @@ class CSVProcessor(Processor):
                                    dialect)
         first_row = True
         header_row = []
+        # Save the matches of the file in batches instead of one by one
+        sink = MatchSink()
         for row in reader:
             warnings_in_row = []
             if first_row:
@@ -111,7 +133,7 @@ class CSVProcessor(Processor):
                     # Save matches
                     match['url'] = url_object
                     match['scan'] = url_object.scan
-                    match.save()
+                    sink.add(match)
 
                     warnings_in_row.append((match['matched_rule'], i))
 
@@ -150,6 +172,7 @@ class CSVProcessor(Processor):
             ) for warning in warnings_in_row)
             row.append(annotation)
             rows.append(row)
+        sink.flush()
 
         # print "*** 4 ***"
         # Write to output file
@@ -0,0 +1,128 @@
+# The contents of this file are subject to the Mozilla Public License
+# Version 2.0 (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+#    http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS"basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License
+# for the specific language governing rights and limitations under the
+# License.
+#
+# OS2Webscanner was developed by Magenta in collaboration with OS2 the
+# Danish community of open source municipalities (http://www.os2web.dk/).
+#
+# The code is currently governed by OS2 the Danish community of open
+# source municipalities ( http://www.os2web.dk/ )
+"""Processor for tar files, compressed files and other archives."""
+
+import bz2
+import gzip
+import lzma
+import os
+import tarfile
+import zlib
+
+from .archive import ArchiveProcessor
+from .processor import Processor
+
+try:
+    import libarchive
+    from libarchive.exception import ArchiveError as LibarchiveError
+except ImportError:
+    libarchive = None
+    LibarchiveError = None
+
+# Openers of single compressed files by the magic bytes they start with
+COMPRESSED_FILE_OPENERS = [
+    (b'\x1f\x8b', gzip.open),
+    (b'BZh', bz2.open),
+    (b'\xfd7zXZ\x00', lzma.open),
+]
+
+# Mime-types of the archives which can only be read with libarchive
+LIBARCHIVE_MIME_TYPES = [
+    'application/x-7z-compressed',
+    'application/x-rar',
+    'application/x-rar-compressed',
+    'application/vnd.rar',
+    'application/vnd.ms-cab-compressed',
+]
+
+
+class UnsupportedArchiveError(Exception):
+
+    """Raised for archives of formats which can't be read."""
+
+
+class _EntryFile(object):
+
+    """A file object reading the data of a libarchive entry."""
+
+    def __init__(self, entry):
+        self.blocks = entry.get_blocks()
+        self.buffer = bytearray()
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            block = next(self.blocks, None)
+            if block is None:
+                break
+            self.buffer.extend(block)
+        if size < 0:
+            size = len(self.buffer)
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+
+class GenericArchiveProcessor(ArchiveProcessor):
+
+    """Processes tar files, gzip, bzip2 and xz compressed files and, if
+    libarchive is installed, 7-zip, RAR and cabinet archives.
+
+    Compressed tar files are read as a stream, and a compressed file which
+    isn't a tar file is processed as an archive of the one file.
+    """
+
+    item_type = "archive"
+    archive_errors = (tarfile.TarError, EOFError, OSError, lzma.LZMAError,
+                      zlib.error, UnsupportedArchiveError)
+    if LibarchiveError is not None:
+        archive_errors += (LibarchiveError,)
+
+    def members(self, file_path):
+        """Yield the name and a file object of each file in the archive."""
+        if tarfile.is_tarfile(file_path):
+            with tarfile.open(file_path, 'r|*') as archive:
+                for member in archive:
+                    if member.isfile():
+                        yield member.name, archive.extractfile(member)
+            return
+
+        with open(file_path, 'rb') as f:
+            magic_bytes = f.read(8)
+        for prefix, opener in COMPRESSED_FILE_OPENERS:
+            if magic_bytes.startswith(prefix):
+                # The compressed file is named like the file without the
+                # compression's extension, e.g. "data.txt.gz"
+                name = os.path.splitext(os.path.basename(file_path))[0]
+                with opener(file_path, 'rb') as f:
+                    yield name, f
+                return
+
+        if libarchive is None:
+            raise UnsupportedArchiveError(
+                "libarchive is needed to read {0}".format(file_path))
+        with libarchive.file_reader(file_path) as archive:
+            for entry in archive:
+                if entry.isfile:
+                    yield entry.pathname, _EntryFile(entry)
+
+
+Processor.register_processor(GenericArchiveProcessor.item_type,
+                             GenericArchiveProcessor)
+
+if libarchive is not None:
+    for mime_type in LIBARCHIVE_MIME_TYPES:
+        Processor.mimetypes_to_processors[mime_type] = \
+            GenericArchiveProcessor.item_type
@@ -40,6 +40,7 @@ class HTMLProcessor(Processor):
     """
 
     item_type = "html"
+    claim_batch_size = 10
     text_processor = TextProcessor()
 
     def handle_spider_item(self, data, url_object):
@@ -53,6 +54,14 @@ class HTMLProcessor(Processor):
             os.remove(item.file_path)
         return result
 
+    def can_process_inline(self, data, url_object):
+        """Markup is always processed in memory."""
+        return True
+
+    def process_inline(self, data, url_object):
+        """Process the markup."""
+        return self.process(data, url_object)
+
     def process(self, data, url_object):
         """Process HTML data.
 
@@ -16,7 +16,9 @@
 """LibreOffice related processors."""
 import mimetypes
 
-from .processor import Processor
+from .processor import Processor, datetime_print
+from .uno_client import (UnoConverter, uno_available, CONNECT_TIMEOUT,
+                         CONNECT_RETRY_DELAY)
 import os
 import os.path
 import subprocess
@@ -25,7 +27,7 @@ import hashlib
 import pathlib
 from django.conf import settings
 
-from time import sleep
+from time import sleep, time
 
 base_dir = settings.BASE_DIR
 var_dir = settings.VAR_DIR
@@ -40,6 +42,10 @@ class LibreOfficeProcessor(Processor):
 
     Allows setting of the "home" directory for the libreoffice program,
     so that multiple libreoffice conversions can be run simultaneously.
+
+    Documents are converted over a persistent UNO connection to the
+    processor's LibreOffice instance if PyUNO is available, and with unoconv
+    otherwise.
     """
 
     item_type = "libreoffice"
@@ -50,6 +56,7 @@ class LibreOfficeProcessor(Processor):
         self.home_dir = None
         self.instance = None
         self.instance_name = None
+        self.converter = None
 
     def _make_args(self, accept=True):
         assert self.instance_name
@@ -71,8 +78,21 @@ class LibreOfficeProcessor(Processor):
         self.instance = subprocess.Popen(self._make_args(accept=True))
         assert self.instance.poll() is None, """\
 couldn't create a LibreOffice process"""
+        if uno_available():
+            self.converter = UnoConverter("cnv_{0}".format(self.instance_name))
+
+    def ensure_instance_running(self):
+        """Restart the LibreOffice instance if it has stopped."""
+        if self.instance.poll() is not None:
+            datetime_print(
+                "LibreOffice instance {0} stopped, restarting".format(
+                    self.instance_name))
+            self.instance = subprocess.Popen(self._make_args(accept=True))
+            if self.converter is not None:
+                self.converter.disconnect()
 
     def teardown_queue_processing(self):
+        self.converter = None
         if self.instance:
             if self.instance.poll() is None:
                 # Tell the existing instance to stop listening on the pipe
@@ -139,7 +159,19 @@ couldn't create a LibreOffice process"""
                 tmp_dir,
                 os.path.basename(item.file_path).split(".")[0] + ".csv"
             )
+        else:
+            output_file = os.path.join(
+                tmp_dir,
+                os.path.splitext(os.path.basename(item.file_path))[0] +
+                ".html"
+            )
+
+        if self.converter is not None:
+            self.ensure_instance_running()
+            return self.converter.convert(item.file_path, output_file,
+                                          output_filter)
 
+        if output_filter == "csv":
             unoconv_args = [
                 project_dir + "/scrapy-webscanner/unoconv",
                 "--pipe", "cnv_{0}".format(self.instance_name), "--no-launch",
@@ -158,18 +190,19 @@ couldn't create a LibreOffice process"""
                 item.file_path
             ]
 
-        attempts = 0
-        while attempts < 4:
+        deadline = time() + CONNECT_TIMEOUT
+        delay = CONNECT_RETRY_DELAY
+        while True:
             return_code = subprocess.call(unoconv_args)
             # unoconv returns 113 if the connection failed; if that happens and
             # the instance is still running, then it's probably starting up, so
-            # try a few more times over the course of a minute
-            if return_code == 113 and self.instance.poll() is None:
-                sleep(15)
-                attempts += 1
+            # try again a few times, waiting longer each time
+            if (return_code == 113 and self.instance.poll() is None and
+                    time() + delay <= deadline):
+                sleep(delay)
+                delay *= 2
             else:
                 return return_code == 0
-        return False
 
 
 Processor.register_processor(LibreOfficeProcessor.item_type,
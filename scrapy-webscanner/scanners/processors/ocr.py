@@ -16,21 +16,45 @@
 """OCR Processors."""
 
 
+import collections
 import os
 import subprocess
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
 
 from .processor import Processor
 from .text import TextProcessor
 
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+# Languages to recognize text in
+OCR_LANGUAGES = "dan+eng"
+
 
 class OCRProcessor(Processor):
 
-    """A processor which uses tesseract OCR to process an image."""
+    """A processor which uses tesseract OCR to process an image.
+
+    If OCR_ENGINE is "tesserocr" and tesserocr is installed, the images are
+    recognized with tesseract API handles kept by the processor, so the
+    language models are only loaded once. The images of a claimed batch,
+    which are mostly pages of the same document, are then recognized in
+    parallel by OCR_THREADS threads, each with its own handle. Otherwise a
+    tesseract process is run for each image.
+    """
 
     item_type = "ocr"
+    cache_converted_text = True
     text_processor = TextProcessor()
 
+    executor = None
+
     def handle_spider_item(self, data, url_object):
         """Add the item to the queue."""
         return self.add_to_queue(data, url_object)
@@ -39,13 +63,116 @@ class OCRProcessor(Processor):
         """Convert the queue item."""
         return self.convert_queue_item(item)
 
+    def setup_queue_processing(self, pid, *args):
+        """Start the thread pool if the tesseract API is used."""
+        super().setup_queue_processing(pid, *args)
+        if settings.OCR_ENGINE == 'tesserocr' and tesserocr is not None:
+            self.apis = []
+            self.thread_api = threading.local()
+            self.executor = ThreadPoolExecutor(settings.OCR_THREADS)
+            self.claim_batch_size = settings.OCR_BATCH_SIZE
+
+    def teardown_queue_processing(self):
+        """Stop the thread pool and release the tesseract API handles."""
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+            for api in self.apis:
+                api.End()
+            self.apis = []
+        super().teardown_queue_processing()
+
+    def handle_queue_items(self, items):
+        """Recognize the images of the batch in the thread pool, and
+        process their text as they are recognized.
+
+        Only as many images as there are threads are recognized at a time,
+        so the items started are the ones being worked on. The text is
+        processed in this thread, so only tesseract, which releases the GIL,
+        runs in parallel.
+        """
+        if self.executor is None:
+            yield from super().handle_queue_items(items)
+            return
+
+        remaining = iter(items)
+        running = collections.deque()
+
+        def start_next():
+            item = next(remaining, None)
+            if item is not None:
+                self.start_queue_item(item)
+                running.append((item, self.executor.submit(self.recognize,
+                                                           item.file_path)))
+
+        for i in range(settings.OCR_THREADS):
+            start_next()
+        try:
+            while running:
+                item, future = running.popleft()
+                try:
+                    text = future.result()
+                    error = None
+                except RuntimeError as e:
+                    error = e
+                # Keep the threads busy while the text is processed
+                start_next()
+                if error is not None:
+                    logging.info("OCR failed for file {0}: {1}".format(
+                        item.file_path, error))
+                    result = False
+                else:
+                    logging.info("OCR succeeded for file {}".format(
+                        item.file_path))
+                    result = self.text_processor.process(text, item.url,
+                                                         item.page_no)
+                if os.path.exists(item.file_path):
+                    os.remove(item.file_path)
+                yield item, result
+        finally:
+            # Don't recognize the rest of the batch if processing stops
+            for item, future in running:
+                future.cancel()
+
+    def recognize(self, file_path):
+        """Return the text of the image, using this thread's API handle."""
+        key = self.content_key(file_path)
+        text = self.get_cached_text(key)
+        if text is not None:
+            return text
+
+        api = getattr(self.thread_api, 'api', None)
+        if api is None:
+            api = tesserocr.PyTessBaseAPI(lang=OCR_LANGUAGES,
+                                          psm=tesserocr.PSM.AUTO_OSD)
+            self.thread_api.api = api
+            self.apis.append(api)
+        try:
+            api.SetImageFile(file_path)
+            text = api.GetUTF8Text()
+        finally:
+            api.Clear()
+        self.put_cached_text(key, text)
+        return text
+
+    def process_cached_text(self, text, url_object, page_no=None):
+        """Process the cached text of an image."""
+        return self.text_processor.process(text, url_object, page_no)
+
     def convert(self, item, tmp_dir):
         """Convert the item and immediately run a Text processor on it."""
+        key = self.content_key(item.file_path)
+        text = self.get_cached_text(key)
+        if text is not None:
+            logging.info("Using the cached text of file {}".format(
+                item.file_path))
+            return self.process_cached_text(text, item.url, item.page_no)
+
         txt_file = os.path.join(tmp_dir, "file")
         logging.info("Starting OCR on file {}".format(item.file_path))
         return_code = subprocess.call([
             "tesseract", item.file_path, txt_file,
-            "-psm", "1", "-l", "dan+eng"
+            "-psm", "1", "-l", OCR_LANGUAGES
         ])
         if return_code != 0:
             logging.info("OCR failed for file {}".format(item.file_path))
@@ -53,6 +180,7 @@ class OCRProcessor(Processor):
 
         logging.info("OCR succeeded for file {}".format(item.file_path))
         txt_file += ".txt"
+        self.put_cached_file(key, txt_file)
         logging.info("Processing OCR generated file {0}".format(txt_file))
         self.text_processor.process_file(txt_file, item.url, item.page_no)
         if os.path.exists(txt_file):
@@ -0,0 +1,592 @@
+# The contents of this file are subject to the Mozilla Public License
+# Version 2.0 (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+#    http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS"basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License
+# for the specific language governing rights and limitations under the
+# License.
+#
+# OS2Webscanner was developed by Magenta in collaboration with OS2 the
+# Danish community of open source municipalities (http://www.os2web.dk/).
+#
+# The code is currently governed by OS2 the Danish community of open
+# source municipalities ( http://www.os2web.dk/ )
+"""Processor for OOXML and OpenDocument files."""
+
+import datetime
+import io
+import os
+import re
+import zipfile
+from functools import lru_cache
+from xml.etree import ElementTree
+
+from os2webscanner.models.conversionqueueitem_model import ConversionQueueItem
+
+from .processor import Processor, datetime_print
+from .text import TextProcessor
+
+WORD_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+SHEET_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+DRAWING_NS = '{http://schemas.openxmlformats.org/drawingml/2006/main}'
+TEXT_NS = '{urn:oasis:names:tc:opendocument:xmlns:text:1.0}'
+TABLE_NS = '{urn:oasis:names:tc:opendocument:xmlns:table:1.0}'
+
+# Separator written between the cells of a spreadsheet row
+CELL_SEPARATOR = ';'
+
+# Number of bytes of a document part parsed at a time
+PARSE_CHUNK_SIZE = 64 * 1024
+
+# Number formats of the built-in cell styles which show dates and times, as
+# they are shown in a Danish locale
+BUILTIN_DATE_FORMATS = {
+    14: 'dd-mm-yyyy', 15: 'd-mmm-yy', 16: 'd-mmm', 17: 'mmm-yy',
+    18: 'h:mm AM/PM', 19: 'h:mm:ss AM/PM', 20: 'hh:mm', 21: 'hh:mm:ss',
+    22: 'dd-mm-yyyy hh:mm', 45: 'mm:ss', 46: '[h]:mm:ss', 47: 'mm:ss.0',
+}
+
+MONTH_NAMES = ['januar', 'februar', 'marts', 'april', 'maj', 'juni', 'juli',
+               'august', 'september', 'oktober', 'november', 'december']
+WEEKDAY_NAMES = ['mandag', 'tirsdag', 'onsdag', 'torsdag', 'fredag',
+                 'lørdag', 'søndag']
+
+_date_field_regex = re.compile(r'(?i)(am/pm|a/p|y+|m+|d+|h+|s+)')
+
+
+class ExtractionError(Exception):
+
+    """Raised when the text of a document can't be extracted."""
+
+
+class _EventTarget(object):
+
+    """A parser target which builds the tree of a document part and records
+    the events iterparse would report.
+
+    Parts with a DOCTYPE are refused, as the entities declared in it can
+    expand to any size, and no OOXML or OpenDocument part has one.
+    """
+
+    def __init__(self, events):
+        self.builder = ElementTree.TreeBuilder()
+        self.wanted_events = events
+        self.events = []
+
+    def start(self, tag, attrs):
+        elem = self.builder.start(tag, attrs)
+        if 'start' in self.wanted_events:
+            self.events.append(('start', elem))
+
+    def end(self, tag):
+        elem = self.builder.end(tag)
+        if 'end' in self.wanted_events:
+            self.events.append(('end', elem))
+
+    def data(self, data):
+        self.builder.data(data)
+
+    def close(self):
+        return self.builder.close()
+
+    def doctype(self, name, pubid, system):
+        raise ExtractionError("Document parts with a DOCTYPE are not read")
+
+
+def _iterparse(source, events=('end',)):
+    """Parse the document part like ElementTree.iterparse, refusing parts
+    with a DOCTYPE."""
+    target = _EventTarget(events)
+    parser = ElementTree.XMLParser(target=target)
+    while True:
+        data = source.read(PARSE_CHUNK_SIZE)
+        if not data:
+            break
+        parser.feed(data)
+        yield from target.events
+        del target.events[:]
+    parser.close()
+    yield from target.events
+
+
+def _numbered_parts(archive, pattern):
+    """Return the names of the parts matching pattern, in numeric order.
+
+    The pattern must have a group matching the number of the part.
+    """
+    parts = []
+    for name in archive.namelist():
+        match = re.match(pattern, name)
+        if match:
+            parts.append((int(match.group(1)), name))
+    return [name for number, name in sorted(parts)]
+
+
+def _wordprocessing_text(source):
+    """Yield the text of a WordprocessingML part."""
+    for event, elem in _iterparse(source):
+        if elem.tag == WORD_NS + 't':
+            yield elem.text or ''
+        elif elem.tag == WORD_NS + 'tab':
+            yield '\t'
+        elif elem.tag in (WORD_NS + 'br', WORD_NS + 'cr'):
+            yield '\n'
+        elif elem.tag == WORD_NS + 'p':
+            yield '\n'
+            elem.clear()
+
+
+def _drawing_text(source):
+    """Yield the text of a PresentationML part."""
+    for event, elem in _iterparse(source):
+        if elem.tag == DRAWING_NS + 't':
+            yield elem.text or ''
+        elif elem.tag == DRAWING_NS + 'br':
+            yield '\n'
+        elif elem.tag == DRAWING_NS + 'p':
+            yield '\n'
+            elem.clear()
+
+
+def _string_item_text(elem):
+    """Return the text of a shared or inline string, without phonetics."""
+    texts = elem.findall(SHEET_NS + 't')
+    texts.extend(elem.findall(SHEET_NS + 'r/' + SHEET_NS + 't'))
+    return ''.join(t.text or '' for t in texts)
+
+
+def _shared_strings(source):
+    """Return the list of the shared strings of a workbook."""
+    strings = []
+    for event, elem in _iterparse(source):
+        if elem.tag == SHEET_NS + 'si':
+            strings.append(_string_item_text(elem))
+            elem.clear()
+    return strings
+
+
+def _workbook_epoch(source):
+    """Return the date of day 0 of the workbook's dates."""
+    for event, elem in _iterparse(source):
+        if elem.tag == SHEET_NS + 'workbookPr':
+            if elem.get('date1904') in ('1', 'true'):
+                return datetime.datetime(1904, 1, 1)
+            break
+    # Day 60 is the 29th of February 1900, which didn't exist, so this is
+    # right from the 1st of March 1900
+    return datetime.datetime(1899, 12, 30)
+
+
+def _cell_formats(source):
+    """Return the number format of each cell style of a workbook, or None
+    for the styles which show numbers as they are stored."""
+    codes = dict(BUILTIN_DATE_FORMATS)
+    formats = []
+    for event, elem in _iterparse(source):
+        if elem.tag == SHEET_NS + 'numFmt':
+            codes[int(elem.get('numFmtId'))] = elem.get('formatCode')
+        elif elem.tag == SHEET_NS + 'cellXfs':
+            for xf in elem.findall(SHEET_NS + 'xf'):
+                code = codes.get(int(xf.get('numFmtId', 0)))
+                if code is not None and code.lower() == 'general':
+                    code = None
+                formats.append(code)
+            elem.clear()
+    return formats
+
+
+@lru_cache(maxsize=256)
+def _format_parts(code):
+    """Return the first section of the number format code, the one for
+    positive numbers, as a tuple of (is_literal, text) pairs.
+
+    Raises ExtractionError for formats which can't be shown here.
+    """
+    parts = []
+
+    def add(is_literal, text):
+        if parts and parts[-1][0] == is_literal:
+            parts[-1] = (is_literal, parts[-1][1] + text)
+        else:
+            parts.append((is_literal, text))
+
+    i = 0
+    while i < len(code) and code[i] != ';':
+        char = code[i]
+        if char == '"':
+            end = code.find('"', i + 1)
+            if end < 0:
+                end = len(code)
+            add(True, code[i + 1:end])
+            i = end + 1
+        elif char == '\\':
+            add(True, code[i + 1:i + 2])
+            i += 2
+        elif char == '_':
+            # Space as wide as the next character
+            add(True, ' ')
+            i += 2
+        elif char == '*':
+            # The next character repeated to fill the cell
+            i += 2
+        elif char == '[':
+            end = code.find(']', i)
+            if end < 0:
+                end = len(code)
+            # Colours, conditions and locales don't change the text, but
+            # elapsed times do
+            if re.match(r'(?i)[hms]+$', code[i + 1:end]):
+                raise ExtractionError(
+                    "Unsupported number format {0}".format(code))
+            i = end + 1
+        else:
+            add(False, char)
+            i += 1
+    return tuple(parts)
+
+
+def _format_integer(number, parts):
+    """Show the number with a format of digit placeholders and literal
+    text, e.g. 000000-0000 for a CPR number stored as a number."""
+    rounded = int(abs(number) + 0.5)
+    digits = str(rounded) if rounded else ''
+    chars = [(is_literal, char) for is_literal, text in parts
+             for char in text]
+    placeholders = [i for i, (is_literal, char) in enumerate(chars)
+                    if not is_literal and char in '0#?']
+    # Thousands separators are left out
+    shown = ['' if not is_literal and char == ',' else char
+             for is_literal, char in chars]
+    for i in reversed(placeholders):
+        if digits:
+            shown[i] = digits[-1]
+            digits = digits[:-1]
+        else:
+            shown[i] = {'0': '0', '#': '', '?': ' '}[chars[i][1]]
+    if placeholders:
+        # Digits beyond the placeholders are shown before the first one
+        shown[placeholders[0]] = digits + shown[placeholders[0]]
+    sign = '-' if number < 0 and rounded else ''
+    return sign + ''.join(shown)
+
+
+def _date_field(field, moment, is_minutes, twelve_hour):
+    """Return the text of the field of a date format for the moment."""
+    kind = field[0].lower()
+    width = len(field)
+    if field.lower() == 'am/pm':
+        return 'AM' if moment.hour < 12 else 'PM'
+    if field.lower() == 'a/p':
+        return 'A' if moment.hour < 12 else 'P'
+    if kind == 'y':
+        if width > 2:
+            return '%04d' % moment.year
+        return '%02d' % (moment.year % 100)
+    if kind == 'm' and is_minutes:
+        return '%0*d' % (min(width, 2), moment.minute)
+    if kind == 'm':
+        if width <= 2:
+            return '%0*d' % (width, moment.month)
+        name = MONTH_NAMES[moment.month - 1]
+        if width == 3:
+            return name[:3]
+        return name[0] if width == 5 else name
+    if kind == 'd':
+        if width <= 2:
+            return '%0*d' % (width, moment.day)
+        name = WEEKDAY_NAMES[moment.weekday()]
+        return name[:3] if width == 3 else name
+    if kind == 'h':
+        hour = moment.hour
+        if twelve_hour:
+            hour = (hour - 1) % 12 + 1
+        return '%0*d' % (min(width, 2), hour)
+    return '%0*d' % (min(width, 2), moment.second)
+
+
+def _format_date(number, parts, epoch):
+    """Show the serial number of a date and time with a date format."""
+    moment = epoch + datetime.timedelta(seconds=round(number * 86400))
+    pieces = []
+    for is_literal, text in parts:
+        if is_literal:
+            pieces.append((False, text))
+            continue
+        for i, piece in enumerate(_date_field_regex.split(text)):
+            if piece:
+                pieces.append((i % 2 == 1, piece))
+    fields = [text for is_field, text in pieces if is_field]
+    twelve_hour = any(field.lower() in ('am/pm', 'a/p') for field in fields)
+
+    shown = []
+    field_index = 0
+    for is_field, text in pieces:
+        if not is_field:
+            shown.append(text)
+            continue
+        # m and mm are minutes after hours or before seconds, and months
+        # otherwise
+        previous = fields[field_index - 1] if field_index > 0 else ''
+        following = (fields[field_index + 1]
+                     if field_index + 1 < len(fields) else '')
+        is_minutes = len(text) <= 2 and (previous.lower().startswith('h') or
+                                         following.lower().startswith('s'))
+        shown.append(_date_field(text, moment, is_minutes, twelve_hour))
+        field_index += 1
+    return ''.join(shown)
+
+
+def _format_number(value, code, epoch):
+    """Return the text of the number value as shown with the number format.
+
+    Only dates, times and formats of digit placeholders, like zero padded
+    numbers, are shown as formatted, as they may be what makes the number a
+    CPR number or a date. Other numbers, and numbers which can't be shown
+    with the format, like dates out of range, are shown as they are stored.
+    """
+    parts = _format_parts(code)
+    code_text = ''.join(text for is_literal, text in parts
+                        if not is_literal).lower()
+    try:
+        number = float(value)
+        if re.search('[ymdhs]', code_text):
+            if number < 0:
+                return value
+            return _format_date(number, parts, epoch)
+        if (re.search('[0#?]', code_text) and
+                not re.search('[.e%/@]', code_text)):
+            return _format_integer(number, parts)
+    except (OverflowError, ValueError):
+        pass
+    return value
+
+
+def _worksheet_text(source, shared_strings, formats, epoch):
+    """Yield the text of a SpreadsheetML worksheet, a line per row.
+
+    Numbers are shown with the number formats of their cell styles, see
+    _format_number.
+    """
+    cells = []
+    for event, elem in _iterparse(source):
+        if elem.tag == SHEET_NS + 'c':
+            cell_type = elem.get('t')
+            if cell_type == 'inlineStr':
+                inline = elem.find(SHEET_NS + 'is')
+                value = ('' if inline is None else
+                         _string_item_text(inline))
+            else:
+                v = elem.find(SHEET_NS + 'v')
+                value = '' if v is None else v.text or ''
+                if cell_type == 's' and value:
+                    value = shared_strings[int(value)]
+                elif cell_type in (None, 'n') and value:
+                    style = int(elem.get('s', 0))
+                    if style < len(formats) and formats[style] is not None:
+                        value = _format_number(value, formats[style], epoch)
+            cells.append(value)
+            elem.clear()
+        elif elem.tag == SHEET_NS + 'row':
+            yield CELL_SEPARATOR.join(cells) + '\n'
+            cells = []
+            elem.clear()
+
+
+def _opendocument_paragraph_text(elem):
+    """Return the text of an OpenDocument paragraph or heading."""
+    parts = [elem.text or '']
+    for child in elem:
+        if child.tag == TEXT_NS + 's':
+            parts.append(' ' * int(child.get(TEXT_NS + 'c', 1)))
+        elif child.tag == TEXT_NS + 'tab':
+            parts.append('\t')
+        elif child.tag == TEXT_NS + 'line-break':
+            parts.append('\n')
+        elif child.tag in (TEXT_NS + 'p', TEXT_NS + 'h'):
+            # E.g. the text of a note
+            parts.append('\n' + _opendocument_paragraph_text(child) + '\n')
+        else:
+            parts.append(_opendocument_paragraph_text(child))
+        parts.append(child.tail or '')
+    return ''.join(parts)
+
+
+def _opendocument_text(source):
+    """Yield the text of an OpenDocument content.xml.
+
+    Table cells are separated like spreadsheet cells, with a line per row.
+    """
+    paragraph_tags = (TEXT_NS + 'p', TEXT_NS + 'h')
+    cell_tags = (TABLE_NS + 'table-cell', TABLE_NS + 'covered-table-cell')
+    paragraph_depth = 0
+    cell_depth = 0
+    for event, elem in _iterparse(source, events=('start', 'end')):
+        if elem.tag in paragraph_tags:
+            if event == 'start':
+                paragraph_depth += 1
+                continue
+            paragraph_depth -= 1
+            # Nested paragraphs, e.g. in notes, are part of the outer one
+            if paragraph_depth == 0:
+                yield _opendocument_paragraph_text(elem)
+                yield ' ' if cell_depth else '\n'
+                elem.clear()
+        elif elem.tag in cell_tags:
+            if event == 'start':
+                cell_depth += 1
+            else:
+                cell_depth -= 1
+                yield CELL_SEPARATOR
+                elem.clear()
+        elif elem.tag == TABLE_NS + 'table-row' and event == 'end':
+            yield '\n'
+            elem.clear()
+
+
+def is_spreadsheet(archive):
+    """Return whether the OOXML or OpenDocument archive is a spreadsheet."""
+    names = archive.namelist()
+    if 'xl/workbook.xml' in names:
+        return True
+    if 'mimetype' in names:
+        return b'spreadsheet' in archive.read('mimetype')
+    return False
+
+
+def extract_text(archive):
+    """Yield the text of the OOXML or OpenDocument archive in pieces.
+
+    Raises ExtractionError if the archive isn't a document of a known kind.
+    """
+    names = set(archive.namelist())
+    if 'word/document.xml' in names:
+        parts = ['word/document.xml']
+        parts.extend(_numbered_parts(archive, r'word/header(\d+)\.xml$'))
+        parts.extend(_numbered_parts(archive, r'word/footer(\d+)\.xml$'))
+        parts.extend(name for name in ('word/footnotes.xml',
+                                       'word/endnotes.xml')
+                     if name in names)
+        for part in parts:
+            with archive.open(part) as source:
+                yield from _wordprocessing_text(source)
+    elif 'xl/workbook.xml' in names:
+        shared_strings = []
+        if 'xl/sharedStrings.xml' in names:
+            with archive.open('xl/sharedStrings.xml') as source:
+                shared_strings = _shared_strings(source)
+        formats = []
+        if 'xl/styles.xml' in names:
+            with archive.open('xl/styles.xml') as source:
+                formats = _cell_formats(source)
+        with archive.open('xl/workbook.xml') as source:
+            epoch = _workbook_epoch(source)
+        for part in _numbered_parts(archive,
+                                    r'xl/worksheets/sheet(\d+)\.xml$'):
+            with archive.open(part) as source:
+                yield from _worksheet_text(source, shared_strings, formats,
+                                           epoch)
+    elif 'ppt/presentation.xml' in names:
+        parts = _numbered_parts(archive, r'ppt/slides/slide(\d+)\.xml$')
+        parts.extend(_numbered_parts(
+            archive, r'ppt/notesSlides/notesSlide(\d+)\.xml$'
+        ))
+        for part in parts:
+            with archive.open(part) as source:
+                yield from _drawing_text(source)
+    elif 'content.xml' in names:
+        with archive.open('content.xml') as source:
+            yield from _opendocument_text(source)
+    else:
+        raise ExtractionError("Unknown kind of document")
+
+
+class OfficeProcessor(Processor):
+
+    """Processes OOXML and OpenDocument files by extracting their text.
+
+    These formats are zip files of XML, so their text is read directly
+    instead of converting them with LibreOffice. Files which can't be read
+    this way, and spreadsheets which must be annotated, are passed on to
+    the LibreOffice processor.
+    """
+
+    item_type = "office"
+    cache_converted_text = True
+    text_processor = TextProcessor()
+
+    def handle_spider_item(self, data, url_object):
+        """Add the item to the queue."""
+        return self.add_to_queue(data, url_object)
+
+    def handle_queue_item(self, item):
+        """Extract the text of the queue item and process it."""
+        text_path = os.path.join(item.tmp_dir, 'text.txt')
+        key = None
+        if self.can_use_cached_text(item.url):
+            key = self.content_key(item.file_path)
+        cached_text = self.get_cached_text(key)
+        try:
+            if cached_text is not None:
+                if not os.path.exists(item.tmp_dir):
+                    os.makedirs(item.tmp_dir)
+                with io.open(text_path, 'w', encoding='utf-8') as f:
+                    f.write(cached_text)
+            else:
+                with zipfile.ZipFile(item.file_path) as archive:
+                    if (item.url.scan.output_spreadsheet_file and
+                            is_spreadsheet(archive)):
+                        return self.convert_with_libreoffice(item)
+                    if not os.path.exists(item.tmp_dir):
+                        os.makedirs(item.tmp_dir)
+                    with io.open(text_path, 'w', encoding='utf-8') as f:
+                        for text in extract_text(archive):
+                            f.write(text)
+                self.put_cached_file(key, text_path)
+        except (zipfile.BadZipFile, ElementTree.ParseError, ExtractionError,
+                KeyError, IndexError, ValueError, OverflowError,
+                RuntimeError) as e:
+            datetime_print("Extracting text from {0} failed: {1}".format(
+                item.file_path, e))
+            item.delete_tmp_dir()
+            return self.convert_with_libreoffice(item)
+
+        try:
+            return self.process_text_file(text_path, item.url)
+        finally:
+            item.delete_tmp_dir()
+            if os.path.exists(item.file_path):
+                os.remove(item.file_path)
+
+    def can_use_cached_text(self, url_object):
+        """The cached text is enough unless spreadsheets must be
+        annotated."""
+        return not url_object.scan.output_spreadsheet_file
+
+    def process_cached_text(self, text, url_object, page_no=None):
+        """Process the cached text of a document."""
+        return self.text_processor.process(text, url_object)
+
+    def process_text_file(self, text_path, url_object):
+        """Process the extracted text like a text file."""
+        text_processor = self.text_processor
+        if text_processor.should_process_windows(text_path, url_object):
+            return text_processor.process_file_windows(text_path, 'utf-8',
+                                                       url_object)
+        with io.open(text_path, 'r', encoding='utf-8') as f:
+            return text_processor.process(f.read(), url_object)
+
+    def convert_with_libreoffice(self, item):
+        """Pass the queue item's file on to the LibreOffice processor."""
+        new_item = ConversionQueueItem(
+            file=item.file_path,
+            type='libreoffice',
+            url=item.url,
+            status=ConversionQueueItem.NEW,
+        )
+        self.get_queue_backend().add(new_item)
+        return True
+
+
+Processor.register_processor(OfficeProcessor.item_type, OfficeProcessor)
@@ -15,27 +15,210 @@
 # source municipalities ( http://www.os2web.dk/ )
 """PDF Processors."""
 
+import io
+import json
 import shutil
 import os
 import regex
 
-from .processor import Processor
-from subprocess import Popen, PIPE, DEVNULL, call, TimeoutExpired
+from django.conf import settings
+
+from .processor import Processor, PDF_IMAGE_PREFIX, datetime_print
+from .text import TextProcessor
+from subprocess import (Popen, PIPE, DEVNULL, call, check_output,
+                        CalledProcessError, TimeoutExpired)
+
+try:
+    import pdftotext
+except ImportError:
+    pdftotext = None
+
+
+class PDFTextError(Exception):
+
+    """Raised when the text of a PDF can't be extracted."""
+
+
+def pdf_pages(source):
+    """Yield the text of each page of the PDF at the path source, or of the
+    PDF data if source is bytes.
+
+    Uses the pdftotext poppler binding if it is installed, and otherwise
+    the pdftotext command, which ends each page with a form feed.
+    Raises PDFTextError before yielding any pages if the text can't be
+    extracted.
+    """
+    if pdftotext is not None:
+        if isinstance(source, bytes):
+            f = io.BytesIO(source)
+        else:
+            f = open(source, 'rb')
+        with f:
+            try:
+                pdf = pdftotext.PDF(f)
+            except pdftotext.Error as e:
+                raise PDFTextError(str(e))
+            yield from pdf
+        return
+
+    if isinstance(source, bytes):
+        # pdftotext reads the PDF from its standard input
+        data, file_path = source, "-"
+    else:
+        data, file_path = None, source
+    try:
+        output = check_output(
+            ["pdftotext", "-enc", "UTF-8", file_path, "-"],
+            input=data, stderr=DEVNULL
+        )
+    except (CalledProcessError, OSError) as e:
+        raise PDFTextError(str(e))
+    pages = output.decode('utf-8', 'replace').split('\f')
+    if pages[-1] == '':
+        pages.pop()
+    yield from pages
+
+
+def _cached_pages(text):
+    """Return the list of the pages of cached text, or None if the text
+    isn't a JSON list of pages."""
+    try:
+        pages = json.loads(text)
+    except ValueError:
+        return None
+    if not isinstance(pages, list):
+        return None
+    return pages
 
 
 class PDFProcessor(Processor):
 
-    """Processor for PDF documents using pdftohtml."""
+    """Processor for PDF documents.
+
+    Extracts the text of each page and executes the rules on it, so the
+    matches get their page numbers. Images are only extracted for OCR when
+    the scan does OCR. If PDF_EXTRACT_TEXT is off, or the text can't be
+    extracted, the PDF is converted to HTML with pdftohtml instead.
+    """
 
     item_type = "pdf"
+    cache_converted_text = True
+    text_processor = TextProcessor()
 
     def handle_spider_item(self, data, url_object):
         """Add the item to the queue."""
         return self.add_to_queue(data, url_object)
 
     def handle_queue_item(self, item):
-        """Convert the queue item."""
-        return super().convert_queue_item(item)
+        """Process the queue item's text and queue its images."""
+        if not settings.PDF_EXTRACT_TEXT:
+            return super().convert_queue_item(item)
+
+        try:
+            self.process_pages(self.extract_pages(item.file_path), item.url)
+        except PDFTextError as e:
+            datetime_print("Extracting text from {0} failed: {1}".format(
+                item.file_path, e))
+            return super().convert_queue_item(item)
+
+        if item.url.scan.do_ocr and not self.extract_images(item):
+            # The matches of the text are saved, so the item is done, but
+            # those of the images are missing
+            datetime_print("Extracting images from {0} failed".format(
+                item.file_path))
+            item.url.set_matches_incomplete()
+        if os.path.exists(item.file_path):
+            os.remove(item.file_path)
+        return True
+
+    def can_process_inline(self, data, url_object):
+        """Small PDFs are processed in memory, unless their images must be
+        extracted for OCR."""
+        return settings.PDF_EXTRACT_TEXT and not url_object.scan.do_ocr
+
+    def process_inline(self, data, url_object):
+        """Process the text of the PDF data.
+
+        All the pages are extracted before the rules are executed, so if
+        the PDF fails partway through, nothing has been saved when it is
+        queued instead.
+        """
+        try:
+            pages = list(self.extract_pages(data))
+        except PDFTextError as e:
+            datetime_print("Extracting text from {0} failed: {1}".format(
+                url_object.url, e))
+            return False
+        self.process_pages(pages, url_object)
+        return True
+
+    def can_use_cached_text(self, url_object):
+        """The cached text is enough unless the PDF's images must be
+        extracted for OCR."""
+        return settings.PDF_EXTRACT_TEXT and not url_object.scan.do_ocr
+
+    def get_cached_text(self, key):
+        """Return the cached text of the pages of a PDF, a JSON list, or
+        None if it isn't cached."""
+        text = super().get_cached_text(key)
+        if text is not None and _cached_pages(text) is None:
+            return None
+        return text
+
+    def process_cached_text(self, text, url_object, page_no=None):
+        """Process the cached text of the pages of a PDF."""
+        self.process_pages(_cached_pages(text), url_object)
+        return True
+
+    def extract_pages(self, source):
+        """Return the text of each page of the PDF at the path or of the
+        bytes source, from the conversion cache if it is there.
+
+        Raises PDFTextError if the text can't be extracted.
+        """
+        key = self.content_key(source)
+        text = self.get_cached_text(key)
+        if text is not None:
+            return _cached_pages(text)
+
+        pages = pdf_pages(source)
+        if key is not None:
+            # The pages are cached as a JSON list, as the text of a page may
+            # contain any character
+            pages = list(pages)
+            self.put_cached_text(key, json.dumps(pages))
+        return pages
+
+    def process_pages(self, pages, url_object):
+        """Execute the rules on the text of the pages and save the matches
+        with their page numbers.
+
+        The rules are executed on the document as a whole, so rules whose
+        patterns are on different pages match, and their matches are
+        combined once per document.
+        """
+        from ..scanner_types.scanner import Scanner
+
+        scanner = Scanner.from_scan_id(url_object.scan.pk)
+        matches = scanner.execute_rules_pages(pages)
+        self.text_processor.save_matches(matches, url_object)
+
+    def extract_images(self, item):
+        """Extract the images of the item with pdfimages and queue them."""
+        tmp_dir = item.tmp_dir
+        if not os.path.exists(tmp_dir):
+            os.makedirs(tmp_dir)
+        # -p puts the page numbers in the names, see get_ocr_page_no
+        return_code = call([
+            "pdfimages", "-p", "-png", item.file_path,
+            os.path.join(tmp_dir, PDF_IMAGE_PREFIX)
+        ], stdout=DEVNULL, stderr=DEVNULL)
+        if return_code != 0:
+            item.delete_tmp_dir()
+            return False
+        if os.listdir(tmp_dir):
+            self.add_processed_files(item, tmp_dir)
+        return True
 
     def convert(self, item, tmp_dir):
         """Convert the item using pdftohtml."""
@@ -16,23 +16,39 @@
 """Processors."""
 
 
-import time
 import datetime
+import gc
 import os
 import mimetypes
 import sys
 import magic
 import codecs
-import random
+import io
 import subprocess
+import threading
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 
-from django.db import transaction, IntegrityError, DatabaseError
+import psutil
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+from django.db import transaction
 from django import db
-from django.utils import timezone
 from django.conf import settings
 
 from os2webscanner.models.conversionqueueitem_model import ConversionQueueItem
+from os2webscanner.models.match_model import Match
+
+from .conversion_cache import (content_key, file_content_key,
+                               get_conversion_cache)
+from .queue_backend import default_queue_backend
+
+from ..rules.cpr import CONTEXT_WIDTH
+from ..rules.regexrule import MAX_MATCH_LENGTH
 
 
 # Minimum width and height an image must have to be scanned
@@ -42,10 +58,52 @@ MIN_OCR_DIMENSION_BOTH = 7
 # scanned
 MIN_OCR_DIMENSION_EITHER = 64
 
+# Number of characters of text on either side of a window's own text, enough
+# for a match starting in the window and the context on both sides of it
+TEXT_WINDOW_OVERLAP = MAX_MATCH_LENGTH + 2 * CONTEXT_WIDTH
+
+# Maximum number of matches to buffer before saving them to the database
+MATCH_BATCH_SIZE = 500
+
+# Number of queue items between each garbage collection and check of the
+# memory usage of a queue processor
+MEMORY_CHECK_INTERVAL = 50
+
+
+# Mime types of the compressions mimetypes.guess_type reports as encodings
+COMPRESSION_MIME_TYPES = {
+    'gzip': 'application/gzip',
+    'bzip2': 'application/x-bzip2',
+    'xz': 'application/x-xz',
+}
+
+
+def guess_mime_type(file_name):
+    """Guess the mime type of a file from its name.
+
+    Like mimetypes.guess_type, except that compressed files like
+    "data.txt.gz" are of the type of their compression.
+    """
+    mime_type, encoding = mimetypes.guess_type(file_name)
+    if encoding is not None:
+        return COMPRESSION_MIME_TYPES.get(encoding)
+    return mime_type
+
+
+# Name prefix of the images extracted from PDFs by pdfimages
+PDF_IMAGE_PREFIX = 'pdfimage'
+
 
 def get_ocr_page_no(ocr_file_name):
     "Get page number from image file to be OCR'ed."
 
+    # pdfimage-ddd-ddd.png, as named by "pdfimages -p"
+    if ocr_file_name.startswith(PDF_IMAGE_PREFIX + '-'):
+        try:
+            return int(ocr_file_name.split('-')[1])
+        except (IndexError, ValueError):
+            return None
+
     # xyz*-d+_d+.png
     # HACK ALERT: This depends on the output from pdftohtml.
     try:
@@ -59,9 +117,17 @@ def get_ocr_page_no(ocr_file_name):
 def get_image_dimensions(file_path):
     """Return an image's dimensions as a tuple containing width and height.
 
-    Uses the "identify" command from ImageMagick to retrieve the information.
+    Reads the dimensions from the image header with Pillow if it is
+    installed and can read the image, and otherwise uses the "identify"
+    command from ImageMagick to retrieve the information.
     If there is a problem getting the information, returns None.
     """
+    if Image is not None:
+        try:
+            with Image.open(file_path) as image:
+                return image.size
+        except (IOError, ValueError, Image.DecompressionBombError):
+            pass
     try:
         dimensions = subprocess.check_output(["identify", "-format", "%wx%h",
                                               file_path])
@@ -77,6 +143,82 @@ def datetime_print(line_to_print):
     print('{0} : {1}'.format(datetime.datetime.now(), line_to_print))
 
 
+class MatchSink(object):
+
+    """Buffers the matches found in a document and saves them in bulk.
+
+    Matches are inserted with a single bulk_create in one transaction per
+    batch instead of one INSERT per match. Use as a context manager to save
+    the remaining matches when the document is done.
+    """
+
+    def __init__(self, batch_size=MATCH_BATCH_SIZE):
+        """Initialize an empty sink saving at most batch_size at a time."""
+        self.batch_size = batch_size
+        self._matches = []
+
+    def add(self, match):
+        """Add a MatchItem, saving the buffered matches if there are enough."""
+        self._matches.append(match.instance)
+        if len(self._matches) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Save all the buffered matches."""
+        if not self._matches:
+            return
+        with transaction.atomic():
+            Match.objects.bulk_create(self._matches)
+        self._matches = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+
+
+class InlinePool(object):
+
+    """A bounded pool of threads processing small spider items in the
+    spider process.
+
+    At most size items are processed at a time, and at most as many again
+    wait for a thread. Items beyond that are refused, so the spider can
+    queue them instead of piling up work in memory.
+    """
+
+    def __init__(self, size):
+        """Initialize the pool with size threads."""
+        self.executor = ThreadPoolExecutor(size)
+        self.slots = threading.BoundedSemaphore(2 * size)
+        self.lock = threading.Lock()
+        self.pending = 0
+
+    def submit(self, fn, *args):
+        """Run fn(*args) in the pool, returning False if the pool is full."""
+        if not self.slots.acquire(blocking=False):
+            return False
+        with self.lock:
+            self.pending += 1
+        self.executor.submit(fn, *args).add_done_callback(self._done)
+        return True
+
+    def _done(self, future):
+        with self.lock:
+            self.pending -= 1
+        self.slots.release()
+        if future.exception() is not None:
+            datetime_print("Processing spider item failed: {0}".format(
+                future.exception()))
+
+    def is_idle(self):
+        """Return whether no items are being processed or waiting."""
+        with self.lock:
+            return self.pending == 0
+
+
 class Processor(object):
 
     """Represents a Processor which can process spider and queue items.
@@ -92,8 +234,21 @@ class Processor(object):
     processors_by_type = {}
     processor_instances = {}
 
+    # Number of queue items to process before exiting, to be restarted by the
+    # process manager. None to process items until max_rss is exceeded.
     documents_to_process = 10
+    # Resident memory in bytes above which the processor exits, to be
+    # restarted by the process manager. None for no limit.
+    max_rss = None
+    # Number of queue items to claim at a time. Processors of types which
+    # are fast to process claim more, to save database round-trips.
+    claim_batch_size = 1
+    # Whether the text the processor extracts is kept in the conversion
+    # cache, so files with the same content are only converted once
+    cache_converted_text = False
     pid = None
+    queue_backend = None
+    inline_pool = None
 
     @classmethod
     def processor_by_type(cls, processor_type):
@@ -139,14 +294,34 @@ class Processor(object):
     def add_to_queue(self, data, url_object):
         """Add an item to the conversion queue.
 
-        The data will be saved to a temporary file and added to the
-        conversion queue for later processing.
+        Items whose text is in the conversion cache are processed
+        immediately. Items smaller than SPIDER_INLINE_MAX_BYTES which the
+        processor can process in memory are processed in the spider's inline
+        pool instead, unless it is full. Otherwise the data will be saved to
+        a temporary file and added to the conversion queue for later
+        processing.
         """
-        # Write data to a temporary file
-        # Get temporary directory
         if not isinstance(data, bytes):
             data = data.encode('utf-8')
 
+        if self.can_use_cached_text(url_object):
+            text = self.get_cached_text(self.content_key(data))
+            if text is not None:
+                datetime_print("Using the cached text of {0}".format(
+                    url_object.url))
+                return self.process_cached_text(text, url_object)
+
+        if (len(data) < settings.SPIDER_INLINE_MAX_BYTES and
+                self.can_process_inline(data, url_object) and
+                self.get_inline_pool().submit(self._process_inline, data,
+                                              url_object)):
+            return True
+        return self.write_to_queue(data, url_object)
+
+    def write_to_queue(self, data, url_object):
+        """Save the data to a temporary file and add it to the queue."""
+        # Write data to a temporary file
+        # Get temporary directory
         tmp_dir = url_object.tmp_dir
         if not os.path.exists(tmp_dir):
             os.makedirs(tmp_dir)
@@ -172,10 +347,70 @@ class Processor(object):
             url=url_object,
             status=ConversionQueueItem.NEW,
         )
-        new_item.save()
+        self.get_queue_backend().add(new_item)
 
         return True
 
+    def content_key(self, source):
+        """Return the conversion cache key of the bytes or of the file at
+        the path source, or None if the processor's text isn't cached."""
+        if not self.cache_converted_text or get_conversion_cache() is None:
+            return None
+        if isinstance(source, bytes):
+            return content_key(source)
+        return file_content_key(source)
+
+    def get_cached_text(self, key):
+        """Return the cached text of the content with the key, or None."""
+        if key is None:
+            return None
+        return get_conversion_cache().get_text(self.item_type, key)
+
+    def put_cached_text(self, key, text):
+        """Cache the text extracted from the content with the key."""
+        if key is not None:
+            get_conversion_cache().put_text(self.item_type, key, text)
+
+    def put_cached_file(self, key, file_path):
+        """Cache the text in the UTF-8 encoded file."""
+        if key is not None:
+            get_conversion_cache().put_file(self.item_type, key, file_path)
+
+    def can_use_cached_text(self, url_object):
+        """Return whether the cached text is all that is needed to process
+        an item of the url."""
+        return self.cache_converted_text
+
+    def process_cached_text(self, text, url_object, page_no=None):
+        """Process the cached text of an item, returning whether it
+        succeeded."""
+        raise NotImplementedError
+
+    def can_process_inline(self, data, url_object):
+        """Return whether the spider item can be processed in memory by
+        process_inline instead of being queued.
+
+        Processors which can convert small items quickly without files
+        override this.
+        """
+        return False
+
+    def process_inline(self, data, url_object):
+        """Process the spider item in memory, returning whether it was
+        processed."""
+        raise NotImplementedError
+
+    def _process_inline(self, data, url_object):
+        """Process the spider item in memory, queueing it if that fails."""
+        try:
+            result = self.process_inline(data, url_object)
+        except Exception as e:
+            datetime_print("Processing {0} in memory failed: {1}".format(
+                url_object.url, e))
+            result = False
+        if not result:
+            self.write_to_queue(data, url_object)
+
     def process_file(self, file_path, url, page_no=None):
         """Open the file associated with the item and process the file data.
 
@@ -187,6 +422,10 @@ class Processor(object):
                 if encoding == 'unknown-8bit':
                     encoding = 'iso-8859-1'
 
+                if self.should_process_windows(file_path, url):
+                    self.process_file_windows(file_path, encoding, url)
+                    return True
+
                 f = codecs.open(file_path, "r", encoding=encoding)
             else:
                 f = open(file_path, "rb")
@@ -223,6 +462,53 @@ class Processor(object):
         # TODO: Increment process file count.
         return True
 
+    def can_process_windows(self, url_object):
+        """Return whether the processor can process text in windows.
+
+        Processors which can must implement process_windows.
+        """
+        return False
+
+    def process_windows(self, windows, url_object):
+        """Process the overlapping windows of a large text.
+
+        windows are TextScans of the text as yielded by TextScan.windows.
+        """
+        raise NotImplementedError
+
+    def should_process_windows(self, file_path, url_object):
+        """Return whether to process the file in windows.
+
+        Files larger than TEXT_WINDOW_THRESHOLD bytes are processed in
+        windows, if the processor can, so they are never read into memory
+        as a whole.
+        """
+        return (self.can_process_windows(url_object) and
+                os.path.getsize(file_path) > settings.TEXT_WINDOW_THRESHOLD)
+
+    def process_file_windows(self, file_path, encoding, url):
+        """Open the text file and process it in windows.
+
+        Calls self.process_windows.
+        """
+        from ..rules.rule import TextScan
+        try:
+            with io.open(file_path, "r", encoding=encoding,
+                         newline='') as f:
+                windows = TextScan.windows(f, settings.TEXT_WINDOW_SIZE,
+                                           TEXT_WINDOW_OVERLAP)
+                return self.process_windows(windows, url)
+        except UnicodeDecodeError:
+            url.scan.log_occurrence(
+                    "UTF-8 decoding failed for {0}. Will try and open "
+                    "it with encoding iso-8859-1.".format(file_path)
+                    )
+            with io.open(file_path, "r", encoding='iso-8859-1',
+                         errors='replace', newline='') as f:
+                windows = TextScan.windows(f, settings.TEXT_WINDOW_SIZE,
+                                           TEXT_WINDOW_OVERLAP)
+                return self.process_windows(windows, url)
+
     def setup_queue_processing(self, pid, *args):
         """Setup the queue processor with additional arguments."""
         self.pid = pid
@@ -232,113 +518,156 @@ class Processor(object):
         self.pid = None
 
     def process_queue(self):
-        """Process items in the queue in an infinite loop.
+        """Process items in the queue until the processor should be restarted.
 
-        If there are no items to process, waits 1 second before trying
-        to get the next queue item.
+        That is, until documents_to_process items have been processed, or
+        the processor uses more than max_rss bytes of memory. If there are no
+        items to process, waits for items to be added to the queue.
         """
         datetime_print("Starting processing queue items of type %s, pid %s" % (
             self.item_type, self.pid
         ))
         sys.stdout.flush()
         executions = 0
+        last_memory_check = 0
 
-        while executions < self.documents_to_process:
+        while (self.documents_to_process is None or
+               executions < self.documents_to_process):
             # Prevent memory leak in standalone scripts
             if settings.DEBUG:
                 db.reset_queries()
-            item = self.get_next_queue_item()
-            if item is None:
-                time.sleep(2)
-            else:
-                result = self.handle_queue_item(item)
-                executions = executions + 1
-                if not result:
-                    item.status = ConversionQueueItem.FAILED
-                    lm = "CONVERSION ERROR: file <{0}>, type <{1}>, URL: {2}"
-                    lm2 = "CONVERSION ERROR: type <{0}>, URL: {1}"
-                    tb = traceback.format_exc()
+
+            if executions - last_memory_check >= MEMORY_CHECK_INTERVAL:
+                last_memory_check = executions
+                if self.memory_exceeded():
+                    break
+
+            count = self.claim_batch_size
+            if self.documents_to_process is not None:
+                count = min(count, self.documents_to_process - executions)
+            items = self.get_next_queue_items(count)
+            if not items:
+                self.get_queue_backend().wait(self.item_type)
+                continue
+
+            done = []
+            succeeded = []
+            try:
+                for item, result in self.handle_queue_items(items):
+                    executions = executions + 1
+                    if not result:
+                        item.status = ConversionQueueItem.FAILED
+                        lm = ("CONVERSION ERROR: file <{0}>, type <{1}>, "
+                              "URL: {2}")
+                        lm2 = "CONVERSION ERROR: type <{0}>, URL: {1}"
+                        tb = traceback.format_exc()
+                        try:
+                            item.url.scan.log_occurrence(
+                                    lm.format(item.file, item.type,
+                                              item.url.url)
+                                    )
+                        except:
+                            item.url.scan.log_occurrence(
+                                    lm2.format(item.type, item.url.url)
+                                    )
+
+                        # Try to find out if something went wrong
+                        if settings.DEBUG:
+                            item.url.scan.log_occurrence(tb)
+
+                        item.delete_tmp_dir()
+
+                    # Failures are recorded at once, and successes are
+                    # removed from the queue together when the batch is done
+                    if result:
+                        succeeded.append(item)
+                    else:
+                        self.get_queue_backend().finish([], [item])
+                    done.append(item)
+
                     try:
-                        item.url.scan.log_occurrence(
-                                lm.format(item.file, item.type, item.url.url)
-                                )
+                        datetime_print("(%s): %s" % (
+                                item.url.url,
+                                "success" if result else "fail"
+                                ))
                     except:
-                        item.url.scan.log_occurrence(
-                                lm2.format(item.type, item.url.url)
-                                )
+                        datetime_print("success" if result else "fail")
 
-                    # Try to find out if something went wrong
-                    if settings.DEBUG:
-                        item.url.scan.log_occurrence(tb)
+                    sys.stdout.flush()
+            finally:
+                # If an item raised, it failed, and the items which weren't
+                # started because of it are put back in the queue
+                rest = [item for item in items if item not in done]
+                failed = [item for item in rest
+                          if item.process_start_time is not None]
+                unprocessed = [item for item in rest
+                               if item.process_start_time is None]
+                if succeeded or failed or unprocessed:
+                    self.get_queue_backend().finish(succeeded, failed,
+                                                    unprocessed)
+
+    def start_queue_item(self, item):
+        """Record that processing of the claimed queue item starts."""
+        self.get_queue_backend().start(item)
+
+    def handle_queue_items(self, items):
+        """Handle a batch of claimed queue items, yielding each item with
+        its result as it is handled.
+
+        Handles the items one by one. Processors which can handle several
+        items at once override this, and must call start_queue_item for each
+        item when they start processing it.
+        """
+        for item in items:
+            self.start_queue_item(item)
+            yield item, self.handle_queue_item(item)
 
-                    item.save()
-                    item.delete_tmp_dir()
-                else:
-                    item.delete()
+    def memory_exceeded(self):
+        """Return whether the processor uses more than max_rss bytes.
 
-                try:
-                    datetime_print("(%s): %s" % (
-                            item.url.url,
-                            "success" if result else "fail"
-                            ))
-                except:
-                    datetime_print("success" if result else "fail")
-
-                sys.stdout.flush()
+        Collects garbage first, so only memory which is really in use
+        counts.
+        """
+        if self.max_rss is None:
+            return False
+        gc.collect()
+        rss = psutil.Process().memory_info().rss
+        if rss > self.max_rss:
+            datetime_print("Processor uses %d MB of memory, restarting" % (
+                rss // (1024 * 1024)
+            ))
+            sys.stdout.flush()
+            return True
+        return False
 
-    @transaction.atomic
-    def get_next_queue_item(self):
-        """Get the next item in the queue.
+    @classmethod
+    def get_queue_backend(cls):
+        """Return the conversion queue backend shared by all processors."""
+        if Processor.queue_backend is None:
+            Processor.queue_backend = default_queue_backend()
+        return Processor.queue_backend
 
-        Returns None if there is nothing in the queue.
-        """
-        result = None
+    @classmethod
+    def get_inline_pool(cls):
+        """Return the pool processing small spider items, shared by all
+        processors."""
+        if Processor.inline_pool is None:
+            Processor.inline_pool = InlinePool(settings.SPIDER_INLINE_THREADS)
+        return Processor.inline_pool
 
-        while result is None:
-            try:
-                with transaction.atomic():
-                    new_items_queryset = ConversionQueueItem.objects.filter(
-                        type=self.item_type,
-                        status=ConversionQueueItem.NEW
-                    )
+    @classmethod
+    def inline_processing_done(cls):
+        """Return whether all spider items processed inline are done."""
+        return (Processor.inline_pool is None or
+                Processor.inline_pool.is_idle())
 
-                    if self.item_type != "ocr":
-                        # If this is not an OCR processor, include only scans
-                        # where non-OCR conversions are not paused
-                        new_items_queryset = new_items_queryset.filter(
-                            url__scan__pause_non_ocr_conversions=False
-                        )
+    def get_next_queue_items(self, count=1):
+        """Get at most count of the next items in the queue.
 
-                    # Get scans with pending items of the wanted type
-                    scans = new_items_queryset.values('url__scan').distinct()
-
-                    # Pick a random scan
-                    random_scan_pk = random.choice(scans)['url__scan']
-
-                    # Get the first unprocessed item of the wanted type and
-                    # from a random scan
-                    result = new_items_queryset.filter(
-                        url__scan=random_scan_pk).select_for_update(
-                        nowait=True)[0]
-
-                    # Change status of the found item
-                    ltime = timezone.localtime(timezone.now())
-                    result.status = ConversionQueueItem.PROCESSING
-                    result.process_id = self.pid
-                    result.process_start_time = ltime
-                    result.save()
-            except (DatabaseError, IntegrityError) as e:
-                # Database transaction failed, we just try again
-                datetime_print('Error message {0}'.format(e))
-                datetime_print('Transaction failed while getting queue item of type {0}'.format(
-                    self.item_type)
-                )
-                result = None
-            except IndexError:
-                # Nothing in the queue, return None
-                result = None
-                break
-        return result
+        Returns an empty list if there is nothing in the queue.
+        """
+        return self.get_queue_backend().claim(self.item_type, self.pid,
+                                              count)
 
     def convert_queue_item(self, item):
         """Convert a queue item and add converted files to the queue.
@@ -376,7 +705,7 @@ class Processor(object):
             for fname in filenames:
                 try:
                     # Guess the mime type from the file name
-                    mime_type, encoding = mimetypes.guess_type(fname)
+                    mime_type = guess_mime_type(fname)
                     file_path = os.path.join(root, fname)
                     if mime_type is None:
                         # Guess the mime type from the file contents
@@ -417,7 +746,7 @@ class Processor(object):
                             new_item.page_no = get_ocr_page_no(fname)
 
                         found_items += 1
-                        new_item.save()
+                        self.get_queue_backend().add(new_item)
                     else:
                         os.remove(file_path)
 
@@ -458,6 +787,11 @@ class Processor(object):
         'text/csv': 'csv',
 
         'application/zip': 'zip',
+        'application/x-tar': 'archive',
+        'application/gzip': 'archive',
+        'application/x-gzip': 'archive',
+        'application/x-bzip2': 'archive',
+        'application/x-xz': 'archive',
 
         'application/pdf': 'pdf',
 
@@ -469,22 +803,22 @@ class Processor(object):
         opendocument + '.graphics': 'libreoffice',
         opendocument + '.graphics-template': 'libreoffice',
         opendocument + '.image': 'libreoffice',
-        opendocument + '.presentation': 'libreoffice',
-        opendocument + '.presentation-template': 'libreoffice',
-        opendocument + '.spreadsheet': 'libreoffice',
-        opendocument + '.spreadsheet-template': 'libreoffice',
-        opendocument + '.text': 'libreoffice',
-        opendocument + '.text-master': 'libreoffice',
-        opendocument + '.text-template': 'libreoffice',
+        opendocument + '.presentation': 'office',
+        opendocument + '.presentation-template': 'office',
+        opendocument + '.spreadsheet': 'office',
+        opendocument + '.spreadsheet-template': 'office',
+        opendocument + '.text': 'office',
+        opendocument + '.text-master': 'office',
+        opendocument + '.text-template': 'office',
         opendocument + '.text-web': 'libreoffice',
-        officedocument + '.presentationml.presentation': 'libreoffice',
-        officedocument + '.presentationml.slide': 'libreoffice',
-        officedocument + '.presentationml.slideshow': 'libreoffice',
-        officedocument + '.presentationml.template': 'libreoffice',
-        officedocument + '.spreadsheetml.sheet': 'libreoffice',
-        officedocument + '.spreadsheetml.template': 'libreoffice',
-        officedocument + '.wordprocessingml.document': 'libreoffice',
-        officedocument + '.wordprocessingml.template': 'libreoffice',
+        officedocument + '.presentationml.presentation': 'office',
+        officedocument + '.presentationml.slide': 'office',
+        officedocument + '.presentationml.slideshow': 'office',
+        officedocument + '.presentationml.template': 'office',
+        officedocument + '.spreadsheetml.sheet': 'office',
+        officedocument + '.spreadsheetml.template': 'office',
+        officedocument + '.wordprocessingml.document': 'office',
+        officedocument + '.wordprocessingml.template': 'office',
         'application/vnd.ms-excel': 'libreoffice',
         'application/vnd.ms-powerpoint': 'libreoffice',
 
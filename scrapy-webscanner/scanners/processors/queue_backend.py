@@ -0,0 +1,364 @@
+# The contents of this file are subject to the Mozilla Public License
+# Version 2.0 (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+#    http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS"basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License
+# for the specific language governing rights and limitations under the
+# License.
+#
+# OS2Webscanner was developed by Magenta in collaboration with OS2 the
+# Danish community of open source municipalities (http://www.os2web.dk/).
+#
+# The code is currently governed by OS2 the Danish community of open
+# source municipalities ( http://www.os2web.dk/ )
+"""Backends for the conversion queue.
+
+Processors add items to the conversion queue and claim items of their own
+type from it through a QueueBackend. On PostgreSQL, items are claimed with
+SKIP LOCKED, so concurrent processors never wait for or fail on each
+other's locks, and idle processors are woken by NOTIFY as soon as items of
+their type are added.
+
+Scans share the queue by start-time fair queueing. Each item is given a
+virtual start time when it is added, from its scan's QueueShare, and items
+are claimed in order of priority and virtual time. A scan with many items
+thus gets its items interleaved with those of other scans instead of
+starving them, and claiming is a single index scan.
+"""
+
+import heapq
+import itertools
+import logging
+import select
+import threading
+import time
+from collections import defaultdict
+
+from django.db import connection, transaction, IntegrityError, DatabaseError
+from django.db.models import Max
+from django.utils import timezone
+
+from os2webscanner.models.conversionqueueitem_model import ConversionQueueItem
+from os2webscanner.models.queueshare_model import QueueShare
+from os2webscanner.models.scans.scan_model import Scan
+from os2webscanner.models.url_model import Url
+
+# Maximum number of seconds an idle processor waits before looking at the
+# queue again, even if it was not notified
+QUEUE_WAIT_TIMEOUT = 2
+
+
+class QueueBackend(object):
+
+    """The conversion queue, which processors add and claim items through."""
+
+    def add(self, item):
+        """Save the new queue item and tell processors of its type."""
+        with transaction.atomic():
+            self.schedule(item)
+            item.save()
+        self.notify(item.type)
+
+    @staticmethod
+    def schedule(item):
+        """Set the priority and virtual start time of a new queue item.
+
+        The item starts when its scan's share of the queue does, but no
+        earlier than the first queued item of the same priority, so a scan
+        doesn't get to make up for the time it had nothing in the queue.
+        """
+        scan = item.url.scan
+        item.priority = scan.queue_priority
+        share, created = QueueShare.objects.select_for_update(
+        ).get_or_create(scan=scan, type=item.type)
+
+        current_time = ConversionQueueItem.objects.filter(
+            type=item.type,
+            status=ConversionQueueItem.NEW,
+            priority=item.priority
+        ).order_by('virtual_time').values_list(
+            'virtual_time', flat=True
+        ).first()
+        if current_time is None:
+            # Nothing is queued, so the scans served last are the furthest
+            # ahead
+            current_time = QueueShare.objects.filter(
+                type=item.type,
+                scan__queue_priority=item.priority
+            ).aggregate(Max('virtual_time'))['virtual_time__max']
+
+        item.virtual_time = max(share.virtual_time, current_time or 0.0)
+        share.virtual_time = item.virtual_time + 1.0 / max(
+            scan.queue_weight, 1
+        )
+        share.save()
+
+    def notify(self, item_type):
+        """Tell idle processors that there are new items of the type."""
+        pass
+
+    def claim(self, item_type, pid, count=1):
+        """Claim at most count of the next NEW items of the type.
+
+        The items are marked as PROCESSING by the process, without a
+        process start time until they are started. Returns an empty list if
+        there is nothing in the queue.
+        """
+        raise NotImplementedError
+
+    def start(self, item):
+        """Record that the process starts processing the claimed item.
+
+        Only started items can be stuck, and only they are failed if their
+        process is stopped; the rest of its items are put back in the queue.
+        """
+        item.process_start_time = timezone.localtime(timezone.now())
+        ConversionQueueItem.objects.filter(pk=item.pk).update(
+            process_start_time=item.process_start_time
+        )
+
+    @transaction.atomic
+    def finish(self, succeeded, failed, unprocessed=()):
+        """Report the results of processing claimed items.
+
+        Succeeded items are removed from the queue, failed items are marked
+        as FAILED, and unprocessed items are put back in the queue as NEW.
+        Each is done in a single query for all the items.
+        """
+        queue = ConversionQueueItem.objects
+        if unprocessed:
+            queue.filter(pk__in=[item.pk for item in unprocessed]).update(
+                status=ConversionQueueItem.NEW,
+                process_id=None,
+                process_start_time=None
+            )
+        if failed:
+            queue.filter(pk__in=[item.pk for item in failed]).update(
+                status=ConversionQueueItem.FAILED
+            )
+        if succeeded:
+            queue.filter(pk__in=[item.pk for item in succeeded]).delete()
+
+    def wait(self, item_type, timeout=QUEUE_WAIT_TIMEOUT):
+        """Wait at most timeout seconds for new items of the type."""
+        time.sleep(timeout)
+
+    @staticmethod
+    def claimable_items(item_type):
+        """Return a QuerySet of the items of the type which may be claimed.
+
+        The items are in the order in which they should be claimed.
+        """
+        new_items_queryset = ConversionQueueItem.objects.filter(
+            type=item_type,
+            status=ConversionQueueItem.NEW
+        )
+
+        if item_type != "ocr":
+            # If this is not an OCR processor, include only scans
+            # where non-OCR conversions are not paused
+            new_items_queryset = new_items_queryset.filter(
+                url__scan__pause_non_ocr_conversions=False
+            )
+        return new_items_queryset.order_by('-priority', 'virtual_time', 'pk')
+
+
+class PollingQueueBackend(QueueBackend):
+
+    """A queue backend for any database, which processors poll.
+
+    Claims the first items in the queue with a NOWAIT lock, retrying if
+    another processor holds the lock.
+    """
+
+    @transaction.atomic
+    def claim(self, item_type, pid, count=1):
+        result = None
+
+        while result is None:
+            try:
+                with transaction.atomic():
+                    # Get the first unprocessed items of the wanted type
+                    result = list(self.claimable_items(
+                        item_type).select_for_update(nowait=True)[:count])
+
+                    # Change status of the found items
+                    ConversionQueueItem.objects.filter(
+                        pk__in=[item.pk for item in result]
+                    ).update(
+                        status=ConversionQueueItem.PROCESSING,
+                        process_id=pid,
+                        process_start_time=None
+                    )
+                    for item in result:
+                        item.status = ConversionQueueItem.PROCESSING
+                        item.process_id = pid
+                        item.process_start_time = None
+            except (DatabaseError, IntegrityError) as e:
+                # Database transaction failed, we just try again
+                logging.warning('Error message {0}'.format(e))
+                logging.warning(
+                    'Transaction failed while getting queue item of '
+                    'type {0}'.format(item_type)
+                )
+                result = None
+        return result
+
+
+class PostgresQueueBackend(QueueBackend):
+
+    """A queue backend using SKIP LOCKED claims and LISTEN/NOTIFY."""
+
+    def __init__(self):
+        self._listening = defaultdict(set)
+
+    @staticmethod
+    def channel(item_type):
+        """Return the name of the notification channel for the type."""
+        return 'conversion_queue_{0}'.format(item_type)
+
+    def notify(self, item_type):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_notify(%s, '')",
+                           [self.channel(item_type)])
+
+    def claim(self, item_type, pid, count=1):
+        # Only lock the queue item rows, so processors claiming items from
+        # the same scan don't block on the scan's row
+        sql = """
+            UPDATE {queue} SET status = %s, process_id = %s,
+                process_start_time = NULL
+            WHERE id IN (
+                SELECT q.id FROM {queue} q
+                JOIN {url} u ON u.id = q.{url_id}
+                JOIN {scan} s ON s.id = u.{scan_id}
+                WHERE q.type = %s AND q.status = %s {paused}
+                ORDER BY q.priority DESC, q.virtual_time, q.id
+                LIMIT %s
+                FOR UPDATE OF q SKIP LOCKED
+            )
+            RETURNING id
+        """.format(
+            queue=ConversionQueueItem._meta.db_table,
+            url=Url._meta.db_table,
+            scan=Scan._meta.db_table,
+            url_id=ConversionQueueItem._meta.get_field('url').column,
+            scan_id=Url._meta.get_field('scan').column,
+            paused=("" if item_type == "ocr" else
+                    "AND NOT s.pause_non_ocr_conversions"),
+        )
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(sql, [ConversionQueueItem.PROCESSING, pid,
+                                 item_type, ConversionQueueItem.NEW, count])
+            ids = [row[0] for row in cursor.fetchall()]
+        if not ids:
+            return []
+        return list(ConversionQueueItem.objects.filter(
+            pk__in=ids).order_by('-priority', 'virtual_time', 'pk'))
+
+    def wait(self, item_type, timeout=QUEUE_WAIT_TIMEOUT):
+        connection.ensure_connection()
+        raw_connection = connection.connection
+        channel = self.channel(item_type)
+        # A new database connection doesn't know what we listened to
+        if channel not in self._listening[id(raw_connection)]:
+            with connection.cursor() as cursor:
+                cursor.execute('LISTEN {0}'.format(
+                    connection.ops.quote_name(channel)))
+            self._listening[id(raw_connection)].add(channel)
+
+        # Notifications may have arrived with the results of other queries
+        if not raw_connection.notifies:
+            if select.select([raw_connection], [], [], timeout)[0]:
+                raw_connection.poll()
+        del raw_connection.notifies[:]
+
+
+class LocalQueueBackend(QueueBackend):
+
+    """An in-process queue, keeping items in memory instead of the database.
+
+    For tests, and for running processors in threads of a single process.
+    The queue of each type is a heap, and the current virtual time is that
+    of the last item claimed.
+    """
+
+    def __init__(self):
+        self._items = defaultdict(list)
+        self._shares = defaultdict(float)
+        self._current_times = defaultdict(float)
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+
+    def add(self, item):
+        with self._condition:
+            self.schedule(item)
+            self._push(item)
+            self._condition.notify_all()
+
+    def schedule(self, item):
+        scan = item.url.scan
+        item.priority = scan.queue_priority
+        key = (scan.pk, item.type)
+        item.virtual_time = max(
+            self._shares[key],
+            self._current_times[item.type, item.priority]
+        )
+        self._shares[key] = item.virtual_time + 1.0 / max(
+            scan.queue_weight, 1
+        )
+
+    def _push(self, item):
+        heapq.heappush(self._items[item.type], (
+            -item.priority, item.virtual_time, next(self._counter), item
+        ))
+
+    def notify(self, item_type):
+        with self._condition:
+            self._condition.notify_all()
+
+    def claim(self, item_type, pid, count=1):
+        items = []
+        with self._condition:
+            queue = self._items[item_type]
+            while queue and len(items) < count:
+                item = heapq.heappop(queue)[-1]
+                key = (item_type, item.priority)
+                self._current_times[key] = max(self._current_times[key],
+                                               item.virtual_time)
+                items.append(item)
+        for item in items:
+            item.status = ConversionQueueItem.PROCESSING
+            item.process_id = pid
+            item.process_start_time = None
+        return items
+
+    def start(self, item):
+        item.process_start_time = timezone.localtime(timezone.now())
+
+    def finish(self, succeeded, failed, unprocessed=()):
+        for item in failed:
+            item.status = ConversionQueueItem.FAILED
+        with self._condition:
+            # Unprocessed items keep their place in the queue
+            for item in unprocessed:
+                item.status = ConversionQueueItem.NEW
+                item.process_id = None
+                item.process_start_time = None
+                self._push(item)
+            if unprocessed:
+                self._condition.notify_all()
+
+    def wait(self, item_type, timeout=QUEUE_WAIT_TIMEOUT):
+        with self._condition:
+            if not self._items[item_type]:
+                self._condition.wait(timeout)
+
+
+def default_queue_backend():
+    """Return the best queue backend for the database in use."""
+    if connection.vendor == 'postgresql':
+        return PostgresQueueBackend()
+    return PollingQueueBackend()
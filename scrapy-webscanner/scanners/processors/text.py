@@ -16,16 +16,20 @@
 """Text Processors."""
 from os2webscanner.utils import get_codec_and_string
 
-from .processor import Processor
+from .processor import MatchSink, Processor
 import os
 import logging
 
+# Maximum number of matches saved for each url
+MAX_SAVED_MATCHES = 10
+
 
 class TextProcessor(Processor):
 
     """Processes plain text."""
 
     item_type = "text"
+    claim_batch_size = 10
 
     def handle_spider_item(self, data, url_object):
         """Immediately process the spider item."""
@@ -38,6 +42,14 @@ class TextProcessor(Processor):
             os.remove(item.file_path)
         return result
 
+    def can_process_inline(self, data, url_object):
+        """Text is always processed in memory."""
+        return True
+
+    def process_inline(self, data, url_object):
+        """Process the text."""
+        return self.process(data, url_object)
+
     def process(self, data, url_object, page_no=None):
         """Process the text, by executing rules and saving matches."""
         try:
@@ -51,13 +63,31 @@ class TextProcessor(Processor):
 
         scanner = Scanner.from_scan_id(url_object.scan.pk)
         matches = scanner.execute_rules(data)
-        for match in matches[:10]:
-            match['url'] = url_object
-            match['scan'] = url_object.scan
-            if page_no:
-                match['page_no'] = page_no
-            match.save()
+        self.save_matches(matches, url_object, page_no)
+        return True
+
+    def can_process_windows(self, url_object):
+        """Plain text can always be processed in windows."""
         return True
 
+    def process_windows(self, windows, url_object, page_no=None):
+        """Process the windows of a large text like process does the text."""
+        from ..scanner_types.scanner import Scanner
+
+        scanner = Scanner.from_scan_id(url_object.scan.pk)
+        matches = scanner.execute_rules_windowed(windows)
+        self.save_matches(matches, url_object, page_no)
+        return True
+
+    def save_matches(self, matches, url_object, page_no=None):
+        """Save the first matches found at the url."""
+        with MatchSink() as sink:
+            for match in matches[:MAX_SAVED_MATCHES]:
+                match['url'] = url_object
+                match['scan'] = url_object.scan
+                if page_no:
+                    match['page_no'] = page_no
+                sink.add(match)
+
 
 Processor.register_processor(TextProcessor.item_type, TextProcessor)
@@ -0,0 +1,188 @@
+# The contents of this file are subject to the Mozilla Public License
+# Version 2.0 (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+#    http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS"basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License
+# for the specific language governing rights and limitations under the
+# License.
+#
+# OS2Webscanner was developed by Magenta in collaboration with OS2 the
+# Danish community of open source municipalities (http://www.os2web.dk/).
+#
+# The code is currently governed by OS2 the Danish community of open
+# source municipalities ( http://www.os2web.dk/ )
+"""Conversion of documents over a UNO connection to LibreOffice.
+
+PyUNO is only available to Pythons which can import the uno module of the
+LibreOffice installation. Where it isn't, uno_available() returns False and
+documents must be converted with unoconv instead.
+"""
+
+import logging
+import os
+import time
+
+try:
+    import uno
+    from com.sun.star.beans import PropertyValue
+    from com.sun.star.connection import NoConnectException
+except ImportError:
+    uno = None
+
+# Maximum number of seconds to spend connecting to LibreOffice, e.g. while
+# it starts up
+CONNECT_TIMEOUT = 60
+
+# Number of seconds to wait before the first reconnection attempt; doubled
+# after each failed attempt
+CONNECT_RETRY_DELAY = 0.25
+
+# Export filters for each output format and type of document, by the
+# service the document supports
+EXPORT_FILTERS = {
+    'html': [
+        ('com.sun.star.sheet.SpreadsheetDocument', 'HTML (StarCalc)'),
+        ('com.sun.star.presentation.PresentationDocument',
+         'impress_html_Export'),
+        ('com.sun.star.drawing.DrawingDocument', 'draw_html_Export'),
+        ('com.sun.star.text.TextDocument', 'HTML (StarWriter)'),
+    ],
+    'csv': [
+        ('com.sun.star.sheet.SpreadsheetDocument',
+         'Text - txt - csv (StarCalc)'),
+    ],
+}
+
+# Separator, text delimiter, character set and first line of CSV files:
+# semicolons, double quotes, system character set, line 1
+CSV_FILTER_OPTIONS = "59,34,0,1"
+
+
+def uno_available():
+    """Return whether documents can be converted over UNO."""
+    return uno is not None
+
+
+def _properties(**kwargs):
+    """Return a tuple of UNO PropertyValues with the given names and values."""
+    properties = []
+    for name, value in kwargs.items():
+        prop = PropertyValue()
+        prop.Name = name
+        prop.Value = value
+        properties.append(prop)
+    return tuple(properties)
+
+
+class UnoConverter(object):
+
+    """A client converting documents with a LibreOffice instance.
+
+    Holds a connection to the instance listening on the named pipe, checking
+    that it still works before each conversion and reconnecting if it
+    doesn't.
+    """
+
+    def __init__(self, pipe_name):
+        """Initialize the converter for the instance on the pipe."""
+        self.pipe_name = pipe_name
+        self.desktop = None
+
+    def connect(self, timeout=CONNECT_TIMEOUT):
+        """Connect to the instance, retrying until the timeout.
+
+        Returns whether the connection was made.
+        """
+        local_context = uno.getComponentContext()
+        resolver = local_context.ServiceManager.createInstanceWithContext(
+            "com.sun.star.bridge.UnoUrlResolver", local_context
+        )
+        url = "uno:pipe,name={0};urp;StarOffice.ComponentContext".format(
+            self.pipe_name
+        )
+        deadline = time.time() + timeout
+        delay = CONNECT_RETRY_DELAY
+        while True:
+            try:
+                context = resolver.resolve(url)
+                service_manager = context.ServiceManager
+                self.desktop = service_manager.createInstanceWithContext(
+                    "com.sun.star.frame.Desktop", context
+                )
+                return True
+            except NoConnectException:
+                # The instance may be starting up
+                if time.time() + delay > deadline:
+                    return False
+                time.sleep(delay)
+                delay *= 2
+
+    def is_connected(self):
+        """Return whether the connection to the instance works."""
+        if self.desktop is None:
+            return False
+        try:
+            self.desktop.getFrames()
+            return True
+        except Exception:
+            self.desktop = None
+            return False
+
+    def disconnect(self):
+        """Forget the connection to the instance."""
+        self.desktop = None
+
+    def convert(self, input_path, output_path, output_format):
+        """Convert the document at input_path to output_format ("html" or
+        "csv"), writing it to output_path.
+
+        Returns whether the conversion succeeded.
+        """
+        if not self.is_connected() and not self.connect():
+            logging.error("Unable to connect to LibreOffice on pipe %s",
+                          self.pipe_name)
+            return False
+
+        try:
+            document = self.desktop.loadComponentFromURL(
+                uno.systemPathToFileUrl(os.path.abspath(input_path)),
+                "_blank", 0, _properties(Hidden=True, ReadOnly=True)
+            )
+        except Exception as e:
+            logging.error("Unable to load %s: %s", input_path, e)
+            self.is_connected()
+            return False
+        if document is None:
+            return False
+
+        try:
+            filter_name = None
+            for service, name in EXPORT_FILTERS[output_format]:
+                if document.supportsService(service):
+                    filter_name = name
+                    break
+            if filter_name is None:
+                logging.error("No %s export filter for %s", output_format,
+                              input_path)
+                return False
+
+            store_properties = {'FilterName': filter_name, 'Overwrite': True}
+            if output_format == 'csv':
+                store_properties['FilterOptions'] = CSV_FILTER_OPTIONS
+            document.storeToURL(
+                uno.systemPathToFileUrl(os.path.abspath(output_path)),
+                _properties(**store_properties)
+            )
+            return True
+        except Exception as e:
+            logging.error("Unable to convert %s: %s", input_path, e)
+            # The instance may have crashed on the document
+            self.is_connected()
+            return False
+        finally:
+            try:
+                document.close(True)
+            except Exception:
+                pass
@@ -36,6 +36,7 @@ class XmlProcessor(HTMLProcessor):
     """
 
     item_type = "xml"
+    claim_batch_size = 10
     text_processor = TextProcessor()
 
     def handle_spider_item(self, data, url_object):
@@ -14,35 +14,45 @@
 # The code is currently governed by OS2 the Danish community of open
 # source municipalities ( http://www.os2web.dk/ )
 """Zip file processors."""
+import io
 import zipfile
+import zlib
 
+from django.conf import settings
+
+from .archive import ArchiveProcessor
 from .processor import Processor
 
 
-class ZipProcessor(Processor):
+class ZipProcessor(ArchiveProcessor):
 
-    """A processor which can handle zip-compressed files using unzip."""
+    """A processor which can handle zip-compressed files."""
 
     item_type = "zip"
-
-    def handle_spider_item(self, data, url_object):
-        """Add the item to the queue."""
-        return self.add_to_queue(data, url_object)
-
-    def handle_queue_item(self, item):
-        """Conver the queue item."""
-        return self.convert_queue_item(item)
-
-    def convert(self, item, tmp_dir):
-        """Extract the item using unzip."""
+    # Damaged zip files raise BadZipFile or zlib.error, and encrypted ones
+    # RuntimeError
+    archive_errors = (zipfile.BadZipFile, zlib.error, RuntimeError,
+                      NotImplementedError, EOFError)
+    reads_file_objects = True
+
+    def can_process_inline(self, data, url_object):
+        """Small zip files are extracted in memory if their contents are
+        small too."""
         try:
-            zip_item = zipfile.ZipFile(item.file_path)
-            zip_item.extractall(tmp_dir)
-            return True
-        except (RuntimeError, KeyError) as re:
-            print('Extracting zip file {} failed.'.format(item.file_path))
-            print('Error message {}'.format(re))
+            with zipfile.ZipFile(io.BytesIO(data)) as archive:
+                size = sum(info.file_size for info in archive.infolist())
+        except zipfile.BadZipFile:
             return False
+        return size < settings.SPIDER_INLINE_MAX_BYTES
+
+    def members(self, source):
+        """Yield the name and a file object of each file in the zip file."""
+        with zipfile.ZipFile(source) as archive:
+            for info in archive.infolist():
+                if info.filename.endswith('/'):
+                    continue
+                with archive.open(info) as f:
+                    yield info.filename, f
 
 
 Processor.register_processor(ZipProcessor.item_type, ZipProcessor)
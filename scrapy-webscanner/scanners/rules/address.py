@@ -21,7 +21,8 @@ import regex
 import os
 import codecs
 
-from .rule import Rule
+from .dictionary import load_table, source_digest
+from .rule import Rule, TextScan
 from os2webscanner.models.sensitivity_level import Sensitivity
 from ..items import MatchItem
 
@@ -42,6 +43,9 @@ _zip_city = "(?P<zip_code>{0}){1}(?P<city>{2})".format(
 _optional_comma = ",?"
 _optional_whitespace = "[^\\S\\n\\r]?"
 
+# Street names are looked up by this many leading characters
+STREET_NAME_PREFIX_LENGTH = 20
+
 full_address_regex = regex.compile(
     "\\b" + _street_address + _optional_comma + "(" + _optional_whitespace +
     _zip_city + ")?" + "\\b",
@@ -49,33 +53,6 @@ full_address_regex = regex.compile(
 )
 
 
-def match_full_address(text):
-    """Return possible address matches in the given text."""
-    matches = set()
-    it = full_address_regex.finditer(text, overlapped=False)
-    for m in it:
-        street_address = m.group("street_name")
-        house_number = m.group("house_number")
-        try:
-            zip_code = m.group("zip_code")
-        except IndexError:
-            zip_code = ''
-        try:
-            city = m.group("city")
-        except IndexError:
-            city = ''
-
-        if house_number is not None:
-            house_number = house_number.lstrip()
-        else:
-            house_number = ''
-        matched_text = m.group(0)
-        matches.add(
-            (street_address, house_number, zip_code, city, matched_text)
-        )
-    return matches
-
-
 def load_name_file(file_name):
     r"""Load a data file containing persons names in uppercase.
 
@@ -95,6 +72,12 @@ def load_name_file(file_name):
     return names
 
 
+def load_street_name_prefixes(file_name):
+    """Load the street names of a data file, cut to the length looked up."""
+    return [name[:STREET_NAME_PREFIX_LENGTH]
+            for name in load_name_file(file_name)]
+
+
 def load_whitelist(whitelist):
     """Load a list of names from a multi-line string, one name per line.
 
@@ -126,63 +109,88 @@ class AddressRule(Rule):
         The whitelist should contains a multi-line string, with one name per
         line.
         """
-        # Load first and last names from data files
-        self.street_names = load_name_file(
-            self._data_dir + '/' + self._street_name_file
-        )
-        # Convert to sets for efficient lookup
-        self.street_names = set(self.street_names)
+        self.street_names = self.load_dictionaries()
         self.whitelist = load_whitelist(whitelist)
         self.blacklist = load_whitelist(blacklist)
 
+    @classmethod
+    def load_dictionaries(cls):
+        """Return the shared table of street name prefixes.
+
+        The table is compiled from the data file if it doesn't exist yet.
+        """
+        return load_table(
+            cls._data_dir + '/street_names.tbl',
+            [cls._data_dir + '/' + cls._street_name_file],
+            load_street_name_prefixes,
+            # The table holds prefixes of this length
+            table_format=STREET_NAME_PREFIX_LENGTH
+        )
+
+    @classmethod
+    def dictionary_digest(cls):
+        """Return a hash of the data file the table is compiled from."""
+        return source_digest([cls._data_dir + '/' + cls._street_name_file])
+
     def execute(self, text):
-        """Execute the Name rule."""
+        """Execute the Address rule.
+
+        Each distinct address in the text is only normalised and looked up
+        once, however many times it occurs.
+        """
         matches = set()
-        unmatched_text = text
+        seen = set()
 
         # Check for whole addresses, i.e. at least street name + house
         # number.
-        addresses = match_full_address(text)
-        for address in addresses:
-            # Match each name against the list of first and last names
-            street_name = address[0].upper()
-            house_number = address[1].upper() if address[1] else ''
-            zip_code = address[2].upper() if address[2] else ''
-            city = address[3].upper()if address[3] else ''
+        it = TextScan.of(text).finditer(full_address_regex, overlapped=False)
+        for m in it:
+            # Store the original matching text
+            matched_text = m.group(0)
+            if matched_text in seen:
+                continue
+            seen.add(matched_text)
+
+            sensitivity = self._match_address(m)
+            if sensitivity is not None:
+                matches.add(
+                    MatchItem(matched_data=matched_text,
+                              sensitivity=sensitivity)
+                )
+        return matches
 
+    def _match_address(self, m):
+        """Return the sensitivity of the address match, or None if it's not
+        an address."""
+        street_name = m.group("street_name").upper()
+        house_number = (m.group("house_number") or '').lstrip().upper()
+        zip_code = (m.group("zip_code") or '').upper()
+        city = (m.group("city") or '').upper()
+
+        blacklisted = False
+        if self.whitelist or self.blacklist:
             street_address = "%s %s" % (street_name, house_number)
             full_address = "%s %s, %s %s" % (street_name, house_number,
                                              zip_code, city)
-
             if (
                 street_address in self.whitelist or
                 full_address in self.whitelist
             ):
-                continue
+                return None
             blacklisted = (street_name in self.blacklist or
                            street_address in self.blacklist or
                            full_address in self.blacklist)
-            street_match = street_name[:20] in self.street_names
-
-            if blacklisted or (street_match and house_number):
-                sensitivity = Sensitivity.HIGH
-            elif street_match:
-                # Real street name, but not blacklisted
-                sensitivity = Sensitivity.LOW
-            else:
-                if zip_code or city:
-                    # No real street name, but apparently an address
-                    sensitivity = Sensitivity.OK
-                else:
-                    continue
-
-            # Store the original matching text
-            matched_text = address[4]
-
-            # Update remaining, i.e. unmatched text
-            unmatched_text = unmatched_text.replace(matched_text, "", 1)
+        street_match = (
+            street_name[:STREET_NAME_PREFIX_LENGTH] in self.street_names
+        )
 
-            matches.add(
-                MatchItem(matched_data=matched_text, sensitivity=sensitivity)
-            )
-        return matches
+        if blacklisted or (street_match and house_number):
+            return Sensitivity.HIGH
+        elif street_match:
+            # Real street name, but not blacklisted
+            return Sensitivity.LOW
+        elif zip_code or city:
+            # No real street name, but apparently an address
+            return Sensitivity.OK
+        else:
+            return None
@@ -0,0 +1,88 @@
+# The contents of this file are subject to the Mozilla Public License
+# Version 2.0 (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+#    http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS"basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License
+# for the specific language governing rights and limitations under the
+# License.
+#
+# OS2Webscanner was developed by Magenta in collaboration with OS2 the
+# Danish community of open source municipalities (http://www.os2web.dk/).
+#
+# The code is currently governed by OS2 the Danish community of open
+# source municipalities ( http://www.os2web.dk/ )
+"""Aho-Corasick automata for finding many words in a text at once."""
+
+from collections import deque
+
+
+class Automaton(object):
+
+    """An automaton finding occurrences of any of a set of words.
+
+    Searching a text takes time linear in the length of the text plus the
+    number of occurrences, no matter how many words there are, instead of
+    one substring search per word.
+    """
+
+    def __init__(self, words):
+        """Build the automaton for the given words."""
+        self.words = frozenset(words)
+        # Each state has a dict of transitions, a fallback state, and the
+        # words ending in it, including those of its fallback states
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+
+        for word in self.words:
+            state = 0
+            for char in word:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                    self._goto[state][char] = next_state
+                state = next_state
+            self._output[state].append(word)
+
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._output[next_state] = (
+                    self._output[next_state] +
+                    self._output[self._fail[next_state]]
+                )
+
+    def finditer(self, text):
+        """Yield (start, word) for each occurrence of a word in the text."""
+        if self._output[0]:
+            # The empty word occurs everywhere
+            for start in range(len(text) + 1):
+                yield start, ''
+        state = 0
+        for end, char in enumerate(text, 1):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            for word in self._output[state]:
+                if word:
+                    yield end - len(word), word
+
+    def search(self, text):
+        """Return whether any of the words occur in the text."""
+        for _ in self.finditer(text):
+            return True
+        return False
+
+    def __len__(self):
+        return len(self.words)
@@ -0,0 +1,78 @@
+# The contents of this file are subject to the Mozilla Public License
+# Version 2.0 (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+#    http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS"basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License
+# for the specific language governing rights and limitations under the
+# License.
+#
+# OS2Webscanner was developed by Magenta in collaboration with OS2 the
+# Danish community of open source municipalities (http://www.os2web.dk/).
+#
+# The code is currently governed by OS2 the Danish community of open
+# source municipalities ( http://www.os2web.dk/ )
+"""Process-wide cache of the rules built for each scan."""
+
+from collections import OrderedDict
+from threading import Lock
+
+# Maximum number of scans to keep rules for in a single process
+RULE_SET_CACHE_SIZE = 16
+
+
+class RuleSetCache(object):
+
+    """An LRU cache of rule lists keyed by scan id and modification stamp.
+
+    Building the rules of a scan is expensive: the name and address rules
+    load their dictionaries and the regex rules compile their patterns.
+    Queue processors handle many items from the same scan, so the rules are
+    built once per scan and reused until the scan changes or finishes.
+    """
+
+    def __init__(self, max_size=RULE_SET_CACHE_SIZE):
+        """Initialize an empty cache holding at most max_size rule sets."""
+        self.max_size = max_size
+        self._rule_sets = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, scan_id, stamp):
+        """Return the cached rules for the scan, or None.
+
+        Rules built from an older stamp of the scan are discarded.
+        """
+        with self._lock:
+            entry = self._rule_sets.get(scan_id)
+            if entry is None:
+                return None
+            if entry[0] != stamp:
+                del self._rule_sets[scan_id]
+                return None
+            self._rule_sets.move_to_end(scan_id)
+            return entry[1]
+
+    def put(self, scan_id, stamp, rules):
+        """Store the rules for the scan, evicting the least recently used."""
+        with self._lock:
+            self._rule_sets[scan_id] = (stamp, rules)
+            self._rule_sets.move_to_end(scan_id)
+            while len(self._rule_sets) > self.max_size:
+                self._rule_sets.popitem(last=False)
+
+    def invalidate(self, scan_id):
+        """Forget the rules for the scan, e.g. because it has finished."""
+        with self._lock:
+            self._rule_sets.pop(scan_id, None)
+
+    def clear(self):
+        """Forget all cached rules."""
+        with self._lock:
+            self._rule_sets.clear()
+
+    def __len__(self):
+        return len(self._rule_sets)
+
+
+rule_set_cache = RuleSetCache()
@@ -15,10 +15,13 @@
 # source municipalities ( http://www.os2web.dk/ )
 """Rules for CPR scanning."""
 
+import re
 import regex
 from datetime import datetime
 
-from .rule import Rule
+import numpy as np
+
+from .rule import Rule, TextScan
 from os2webscanner.models.sensitivity_level import Sensitivity
 from ..items import MatchItem
 
@@ -170,43 +173,170 @@ def modulus11_check(cpr):
         return _is_modulus11(cpr)
 
 
+def is_valid_cpr(cpr, do_modulus11=True, ignore_irrelevant=True):
+    """Return whether the CPR number has a valid date and check digit.
+
+    The modulus-11 check is only performed if do_modulus11 is True.
+    """
+    valid_date = date_check(cpr, ignore_irrelevant)
+    if do_modulus11:
+        try:
+            valid_modulus11 = modulus11_check(cpr)
+        except ValueError:
+            valid_modulus11 = True
+    else:
+        valid_modulus11 = True
+    return valid_date and valid_modulus11
+
+
+# Validate the candidates of a text in one batch when there are this many
+BATCH_VALIDATION_THRESHOLD = 1000
+
+_batchable_cpr = re.compile(r"[0-9]{10}\Z")
+_modulus11_weights = np.array([4, 3, 2, 7, 6, 5, 4, 3, 2, 1])
+_days_in_month = np.array([0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+
+
+def validate_cprs(cprs, do_modulus11=True, ignore_irrelevant=True):
+    """Return a list telling whether each of the CPR numbers is valid.
+
+    Gives the same results as is_valid_cpr, but checks the dates, century
+    digits, exception dates and modulus-11 sums of all the numbers in a
+    few NumPy array operations. Numbers which are not ten ASCII digits are
+    checked one at a time.
+    """
+    valid = [None] * len(cprs)
+    batch = []
+    for i, cpr in enumerate(cprs):
+        if _batchable_cpr.match(cpr):
+            batch.append(i)
+        else:
+            valid[i] = is_valid_cpr(cpr, do_modulus11, ignore_irrelevant)
+    if not batch:
+        return valid
+
+    digits = np.frombuffer(
+        "".join(cprs[i] for i in batch).encode("ascii"), dtype=np.uint8
+    ).reshape(-1, 10).astype(np.int64) - ord("0")
+    day = digits[:, 0] * 10 + digits[:, 1]
+    month = digits[:, 2] * 10 + digits[:, 3]
+    year = digits[:, 4] * 10 + digits[:, 5]
+    year_check = digits[:, 6]
+
+    # Convert 2-digit year to 4-digit, as in _get_birth_date
+    year = year + np.select(
+        [year_check <= 3,
+         year_check == 4,
+         year_check <= 8,
+         year_check == 9],
+        [1900,
+         np.where(year > 36, 1900, 2000),
+         np.where(year > 57, 1800, 2000),
+         np.where(year > 37, 1900, 2000)]
+    )
+
+    is_leap_year = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+    valid_month = (month >= 1) & (month <= 12)
+    days_in_month = _days_in_month[np.where(valid_month, month, 0)] + (
+        (month == 2) & is_leap_year)
+    valid_birth_date = valid_month & (day >= 1) & (day <= days_in_month)
+
+    result = valid_birth_date
+    if ignore_irrelevant:
+        result = result & (year <= YEAR_TODAY + 2) & (year >= 1900)
+    if do_modulus11:
+        is_exception_date = (day == 1) & (month == 1) & (
+            (year == 1965) | (year == 1966))
+        is_modulus11 = digits.dot(_modulus11_weights) % 11 == 0
+        result = result & valid_birth_date & (
+            is_exception_date | is_modulus11)
+
+    for i, is_valid in zip(batch, result.tolist()):
+        valid[i] = is_valid
+    return valid
+
+
+# Number of characters of text to include on each side of a match
+CONTEXT_WIDTH = 50
+
+# Replacement for CPR numbers in match contexts
+CPR_MASK = "XXXXXX-XXXX"
+
+
+def mask_contexts(text, spans, hits, width=CONTEXT_WIDTH, mask=CPR_MASK):
+    """Yield the context of each hit with all the spans in it masked.
+
+    spans are the (start, end) spans of all matches in the text, and hits
+    are the spans to return contexts for, both in order of position and
+    without overlaps. Spans lying completely inside a context are replaced
+    by mask, and the visible part of spans cut off by the edge of a
+    context is replaced by X's. As the contexts are built in order, the
+    text is only swept once.
+    """
+    first = 0
+    for low, high in hits:
+        start = max(0, low - width)
+        end = high + width
+        while first < len(spans) and spans[first][1] <= start:
+            first += 1
+
+        parts = []
+        position = start
+        i = first
+        while i < len(spans) and spans[i][0] < end:
+            span_start, span_end = spans[i]
+            visible_start = max(span_start, start)
+            visible_end = min(span_end, end, len(text))
+            parts.append(text[position:visible_start])
+            if visible_start == span_start and visible_end == span_end:
+                parts.append(mask)
+            else:
+                parts.append("X" * (visible_end - visible_start))
+            position = visible_end
+            i += 1
+        parts.append(text[position:end])
+        yield "".join(parts)
+
+
 def match_cprs(text, do_modulus11=True, ignore_irrelevant=True,
                mask_digits=True, whitelist=[]):
     """Return MatchItem objects for each CPR matched in the given text.
 
     If mask_digits is False, then the matches will contain full CPR numbers.
+    The text may be given as a TextScan shared with other rules.
     """
-    it = cpr_regex.finditer(text)
-    matches = set()
-    for m in it:
+    text_scan = TextScan.of(text)
+    text = text_scan.text
+    # Mask all CPR numbers in contexts, including those not owned by the scan
+    spans = [m.span() for m in text_scan.finditer_all(cpr_regex)]
+    candidates = []
+    for m in text_scan.finditer(cpr_regex):
         cpr = m.group(1).replace(' ', '') + m.group(2)
         if cpr in whitelist:
             continue
-        valid_date = date_check(cpr, ignore_irrelevant)
-        if do_modulus11:
-            try:
-                valid_modulus11 = modulus11_check(cpr)
-            except ValueError:
-                valid_modulus11 = True
-        else:
-            valid_modulus11 = True
+        candidates.append((cpr, m))
+
+    cprs = [cpr for cpr, m in candidates]
+    if len(cprs) >= BATCH_VALIDATION_THRESHOLD:
+        valid = validate_cprs(cprs, do_modulus11, ignore_irrelevant)
+    else:
+        valid = [is_valid_cpr(cpr, do_modulus11, ignore_irrelevant)
+                 for cpr in cprs]
+    candidates = [c for c, is_valid in zip(candidates, valid) if is_valid]
+
+    # Calculate contexts
+    contexts = mask_contexts(text, spans, [m.span() for cpr, m in candidates])
+
+    matches = set()
+    for (cpr, m), match_context in zip(candidates, contexts):
         original_cpr = m.group(0)
         if mask_digits:
             # Mask last 6 digits
             cpr = cpr[0:4] + "XXXXXX"
-        # Calculate context.
-        low, high = m.span()
-        if low < 50:
-            # Sanity
-            low = 50
-        match_context = text[low - 50:high + 50]
-        match_context = regex.sub(cpr_regex, "XXXXXX-XXXX", match_context)
-
-        if valid_date and valid_modulus11:
-            matches.add(MatchItem(
-                matched_data=cpr,
-                sensitivity=Sensitivity.HIGH,
-                match_context=match_context,
-                original_matched_data=original_cpr,
-            ))
+        matches.add(MatchItem(
+            matched_data=cpr,
+            sensitivity=Sensitivity.HIGH,
+            match_context=match_context,
+            original_matched_data=original_cpr,
+        ))
     return matches
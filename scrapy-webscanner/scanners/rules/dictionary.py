@@ -0,0 +1,198 @@
+# The contents of this file are subject to the Mozilla Public License
+# Version 2.0 (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+#    http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS"basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License
+# for the specific language governing rights and limitations under the
+# License.
+#
+# OS2Webscanner was developed by Magenta in collaboration with OS2 the
+# Danish community of open source municipalities (http://www.os2web.dk/).
+#
+# The code is currently governed by OS2 the Danish community of open
+# source municipalities ( http://www.os2web.dk/ )
+"""Precompiled, memory-mapped name dictionaries shared between processes.
+
+The name and street name lists are compiled into a hash table file once,
+normally at install time. Every process maps the file read-only, so the
+pages are shared between all queue processors instead of each of them
+building its own sets of several hundred thousand strings.
+
+The file consists of a header, which records the format of the strings, an
+array of slots holding offsets into the string area (or EMPTY), and the
+string area itself, in which each string is stored as its UTF-8 encoded
+length followed by its bytes. Strings are placed by open addressing on
+their CRC-32, which is stable between processes.
+"""
+
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import zlib
+from threading import Lock
+
+MAGIC = b'OS2DICT\x02'
+EMPTY = 0xFFFFFFFF
+
+_header = struct.Struct('<8sIII')
+_slot = struct.Struct('<I')
+_length = struct.Struct('<H')
+
+_tables = {}
+_digests = {}
+_tables_lock = Lock()
+
+
+def build_table(names, table_path, table_format=0):
+    """Compile the names into a table file at the given path.
+
+    table_format identifies how the names were derived from their sources,
+    e.g. the length of the prefixes stored, so tables built differently
+    are rebuilt instead of being read with the wrong meaning.
+
+    The file is written under a temporary name and moved into place, so
+    processes loading the table concurrently never see a partial file.
+    """
+    encoded = sorted(set(name.encode('utf-8') for name in names))
+    slot_count = 1
+    while slot_count < 2 * len(encoded):
+        slot_count *= 2
+    mask = slot_count - 1
+
+    slots = [EMPTY] * slot_count
+    strings = bytearray()
+    for key in encoded:
+        slot = zlib.crc32(key) & mask
+        while slots[slot] != EMPTY:
+            slot = (slot + 1) & mask
+        slots[slot] = len(strings)
+        strings += _length.pack(len(key))
+        strings += key
+
+    tmp_path = '{0}.{1}.tmp'.format(table_path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        f.write(_header.pack(MAGIC, table_format, len(encoded),
+                             slot_count))
+        f.write(struct.pack('<{0}I'.format(slot_count), *slots))
+        f.write(strings)
+    os.replace(tmp_path, table_path)
+
+
+class NameTable(object):
+
+    """A read-only set of strings backed by a memory-mapped table file."""
+
+    def __init__(self, table_path, table_format=0):
+        """Map the table file at the given path, which must be of the
+        given format."""
+        with open(table_path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, stored_format, self._count, slot_count = _header.unpack_from(
+            self._map)
+        if magic != MAGIC or stored_format != table_format:
+            raise ValueError("Not a name table of format {0}: {1}".format(
+                table_format, table_path))
+        self._mask = slot_count - 1
+        self._slots_start = _header.size
+        self._strings_start = _header.size + slot_count * _slot.size
+
+    def __contains__(self, name):
+        """Return whether the name is in the table."""
+        key = name.encode('utf-8')
+        slot = zlib.crc32(key) & self._mask
+        while True:
+            offset, = _slot.unpack_from(
+                self._map, self._slots_start + slot * _slot.size)
+            if offset == EMPTY:
+                return False
+            start = self._strings_start + offset
+            length, = _length.unpack_from(self._map, start)
+            start += _length.size
+            if length == len(key) and self._map[start:start + length] == key:
+                return True
+            slot = (slot + 1) & self._mask
+
+    def __len__(self):
+        return self._count
+
+
+class TableUnion(object):
+
+    """A read-only set of strings which are in any of the given tables."""
+
+    def __init__(self, *tables):
+        self.tables = tables
+
+    def __contains__(self, name):
+        return any(name in table for table in self.tables)
+
+
+def _is_stale(table_path, source_paths, table_format):
+    """Return whether the table is missing, older than its sources or of
+    another version or format."""
+    try:
+        table_mtime = os.path.getmtime(table_path)
+        with open(table_path, 'rb') as f:
+            header = f.read(_header.size)
+    except OSError:
+        return True
+    if len(header) < _header.size:
+        return True
+    magic, stored_format, count, slot_count = _header.unpack(header)
+    if magic != MAGIC or stored_format != table_format:
+        return True
+    return any(os.path.getmtime(p) > table_mtime for p in source_paths)
+
+
+def source_digest(source_paths):
+    """Return a hash of the contents of the source files.
+
+    The hash is only computed once per process while the files are
+    unchanged.
+    """
+    key = tuple((path, os.path.getmtime(path)) for path in source_paths)
+    with _tables_lock:
+        digest = _digests.get(key)
+        if digest is None:
+            source_hash = hashlib.sha256()
+            for path in source_paths:
+                with open(path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(64 * 1024), b''):
+                        source_hash.update(chunk)
+            digest = _digests[key] = source_hash.hexdigest()
+        return digest
+
+
+def load_table(table_path, source_paths, load_names, table_format=0):
+    """Return the table at table_path, compiling it from sources if needed.
+
+    load_names is called with each source path and must return the names in
+    it, and table_format identifies how it derives them, see build_table.
+    The table is only opened once per process. If the table can't be
+    written, falls back to an in-memory set of the names.
+    """
+    with _tables_lock:
+        table = _tables.get(table_path)
+        if table is not None:
+            return table
+
+        if _is_stale(table_path, source_paths, table_format):
+            names = []
+            for source_path in source_paths:
+                names.extend(load_names(source_path))
+            try:
+                build_table(names, table_path, table_format)
+            except OSError as e:
+                logging.warning(
+                    "Unable to write name table {0}: {1}".format(
+                        table_path, e))
+                table = frozenset(names)
+
+        if table is None:
+            table = NameTable(table_path, table_format)
+        _tables[table_path] = table
+        return table
@@ -21,7 +21,9 @@ import regex
 import os
 import codecs
 
-from .rule import Rule
+from .ahocorasick import Automaton
+from .dictionary import load_table, source_digest, TableUnion
+from .rule import Rule, TextScan
 from os2webscanner.models.sensitivity_level import Sensitivity
 from ..items import MatchItem
 
@@ -33,27 +35,8 @@ full_name_regex = regex.compile(
     "\\b(?P<first>" + _name + ")" +
     "(?P<middle>(" + _whitespace + _name + "){0,3})" +
     "(?P<last>" + _whitespace + _name + "){1}\\b", regex.UNICODE)
-
-
-def match_full_name(text):
-    """Return possible name matches in the given text."""
-    matches = set()
-    it = full_name_regex.finditer(text, overlapped=False)
-    for m in it:
-        first = m.group("first")
-        try:
-            middle = m.group("middle")
-        except IndexError:
-            middle = ''
-        if middle != '':
-            middle_split = tuple(
-                regex.split('\s+', middle.lstrip(), regex.UNICODE))
-        else:
-            middle_split = ()
-        last = m.group("last").lstrip()
-        matched_text = m.group(0)
-        matches.add((first, middle_split, last, matched_text))
-    return matches
+name_regex = regex.compile(_name)
+_token_regex = regex.compile("\\S+")
 
 
 def load_name_file(file_name):
@@ -72,7 +55,7 @@ def load_name_file(file_name):
     names = []
     for line in codecs.open(file_name, "r", "latin-1"):
         # Skip beginning lines which are not in uppercase
-        if len(line) > 0 and not line[1].isupper():
+        if len(line) < 2 or not line[1].isupper():
             continue
         names.append(str(line[:line.index('\t')]))
     return names
@@ -112,113 +95,133 @@ class NameRule(Rule):
         The whitelist should contains a multi-line string, with one name per
         line.
         """
-        # Load first and last names from data files
-        self.last_names = load_name_file(
-            self._data_dir + '/' + self._last_name_file)
-        self.first_names = []
-        for f in self._first_name_files:
-            self.first_names.extend(load_name_file(self._data_dir + '/' + f))
-
-        # Convert to sets for efficient lookup
-        self.last_names = set(self.last_names)
-        self.first_names = set(self.first_names)
-        self.all_names = self.last_names.union(self.first_names)
+        self.first_names, self.last_names = self.load_dictionaries()
+        self.all_names = TableUnion(self.first_names, self.last_names)
         self.whitelist = load_whitelist(whitelist)
         self.blacklist = load_whitelist(blacklist)
+        self.blacklist_automaton = Automaton(self.blacklist)
+
+    @classmethod
+    def load_dictionaries(cls):
+        """Return the shared tables of first names and last names.
+
+        The tables are compiled from the data files if they don't exist yet.
+        """
+        first_names = load_table(
+            cls._data_dir + '/first_names.tbl',
+            [cls._data_dir + '/' + f for f in cls._first_name_files],
+            load_name_file
+        )
+        last_names = load_table(
+            cls._data_dir + '/last_names.tbl',
+            [cls._data_dir + '/' + cls._last_name_file],
+            load_name_file
+        )
+        return first_names, last_names
+
+    @classmethod
+    def dictionary_digest(cls):
+        """Return a hash of the data files the tables are compiled from."""
+        return source_digest(
+            [cls._data_dir + '/' + f
+             for f in cls._first_name_files + [cls._last_name_file]]
+        )
 
     def execute(self, text):
-        """Execute the Name rule."""
+        """Execute the Name rule.
+
+        The text is scanned once for full names, and the spans of the
+        accepted ones are recorded, so the following scan for standalone
+        names skips them without copying the text.
+        """
         matches = set()
-        unmatched_text = text
-        # Determine if a name matches one of the lists
-        match = lambda n, list: n.upper() in self.blacklist or (
-            n.upper() in list and not n.upper() in self.whitelist
-        )
+        text = TextScan.of(text)
+        # Spans of the text consumed by full name matches, in order
+        consumed = []
+        # Full names seen, and the span of the accepted part of each
+        decisions = {}
 
         # First, check for whole names, i.e. at least Firstname + Lastname
-        names = match_full_name(text)
-        for name in names:
-            # Match each name against the list of first and last names
-            first_name = name[0]
-            middle_names = [n for n in name[1]]
-            last_name = name[2] if name[2] else ""
-
-            # Store the original matching text
-            matched_text = name[3]
-
-            first_match = match(first_name, self.first_names)
-            last_match = match(last_name, self.last_names)
-            middle_match = any(
-                [match(n, self.all_names) for n in middle_names]
-            )
-            # But what if the name is Word Firstname Lastname?
-            while middle_match and not first_match:
-                old_name = first_name
-                first_name = middle_names.pop(0)
-                first_match = match(first_name, self.first_names)
-                middle_match = any(
-                    [match(n, self.all_names) for n in middle_names]
-                )
-                matched_text = matched_text.lstrip(old_name)
-                matched_text = matched_text.lstrip()
-            # Or Firstname Lastname Word?
-            while middle_match and not last_match:
-                old_name = last_name
-                last_name = middle_names.pop()
-                last_match = match(last_name, self.last_names)
-                middle_match = any(
-                    [match(n, self.all_names) for n in middle_names]
-                )
-                matched_text = matched_text.rstrip(old_name)
-                matched_text = matched_text.rstrip()
-
-            if middle_names:
-                full_name = "%s %s %s" % (
-                    first_name, " ".join(middle_names), last_name
-                )
-            else:
-                full_name = "%s %s" % (first_name, last_name)
-
-            if full_name in self.whitelist:
-                continue
-
-            # Check if name is blacklisted.
-            # The name is blacklisted if there exists a string in the
-            # blacklist which is contained as a substring of the name.
-            is_match = lambda str: str in full_name.upper()
-            is_blacklisted = any(map(is_match, self.blacklist))
-            # Name match is always high sensitivity
-            # and occurs only when first and last name are in the name lists
-            # Set sensitivity according to how many of the names were found
-            # in the names lists
-            if (first_match and last_match) or is_blacklisted:
-                sensitivity = Sensitivity.HIGH
-            elif first_match or last_match or middle_match:
-                sensitivity = Sensitivity.LOW
-            else:
-                #sensitivity = Sensitivity.OK
-                continue
-
-            # Update remaining, i.e. unmatched text
-            unmatched_text = unmatched_text.replace(matched_text, "", 1)
-
-            matches.add(
-                MatchItem(matched_data=matched_text, sensitivity=sensitivity)
-            )
+        for m in text.finditer(full_name_regex, overlapped=False):
+            key = m.group(0)
+            if key not in decisions:
+                decisions[key] = self._match_full_name(key, matches)
+            span = decisions[key]
+            if span is not None:
+                consumed.append((m.start() + span[0], m.start() + span[1]))
+
         # Full name match done. Now check if there's any standalone names in
-        # the remaining, i.e. so far unmatched string.
-        name_regex = regex.compile(_name)
-        it = name_regex.finditer(unmatched_text, overlapped=False)
-        for m in it:
-            matched = m.group(0)
-            if match(matched.upper(), self.all_names):
-                # Check blacklist - only exact matches
-                if matched.upper() in self.blacklist:
-                    sensitivity = Sensitivity.HIGH
-                else:
-                    sensitivity = Sensitivity.HIGH
-                matches.add(
-                    MatchItem(matched_data=matched,
-                              sensitivity=Sensitivity.LOW)
-                )
+        # the remaining, i.e. so far unmatched, parts of the text.
+        start = text.owned_start
+        for end, next_start in consumed + [(text.owned_end, None)]:
+            it = name_regex.finditer(text.text, start, end, overlapped=False)
+            for m in it:
+                matched = m.group(0)
+                if self._is_listed(matched, self.all_names):
+                    matches.add(
+                        MatchItem(matched_data=matched,
+                                  sensitivity=Sensitivity.LOW)
+                    )
+            start = next_start
         return matches
+
+    def _is_listed(self, name, names):
+        """Return whether the name is blacklisted or a non-whitelisted name."""
+        name = name.upper()
+        return name in self.blacklist or (
+            name in names and name not in self.whitelist
+        )
+
+    def _match_full_name(self, matched_text, matches):
+        """Match a full name against the names lists.
+
+        If the name is a match, adds it to matches and returns the span of
+        the part of matched_text which was matched. Otherwise returns None.
+        """
+        tokens = [t.span() for t in _token_regex.finditer(matched_text)]
+        names = [matched_text[start:end] for start, end in tokens]
+        first, last = 0, len(names) - 1
+
+        # Match each name against the list of first and last names
+        first_match = self._is_listed(names[first], self.first_names)
+        last_match = self._is_listed(names[last], self.last_names)
+        middle_match = any(self._is_listed(n, self.all_names)
+                           for n in names[first + 1:last])
+        # But what if the name is Word Firstname Lastname?
+        while middle_match and not first_match:
+            first += 1
+            first_match = self._is_listed(names[first], self.first_names)
+            middle_match = any(self._is_listed(n, self.all_names)
+                               for n in names[first + 1:last])
+        # Or Firstname Lastname Word?
+        while middle_match and not last_match:
+            last -= 1
+            last_match = self._is_listed(names[last], self.last_names)
+            middle_match = any(self._is_listed(n, self.all_names)
+                               for n in names[first + 1:last])
+
+        full_name = " ".join(names[first:last + 1])
+        if full_name in self.whitelist:
+            return None
+
+        # Check if name is blacklisted.
+        # The name is blacklisted if there exists a string in the
+        # blacklist which is contained as a substring of the name.
+        is_blacklisted = self.blacklist_automaton.search(full_name.upper())
+        # Name match is always high sensitivity
+        # and occurs only when first and last name are in the name lists
+        # Set sensitivity according to how many of the names were found
+        # in the names lists
+        if (first_match and last_match) or is_blacklisted:
+            sensitivity = Sensitivity.HIGH
+        elif first_match or last_match or middle_match:
+            sensitivity = Sensitivity.LOW
+        else:
+            return None
+
+        span = (tokens[first][0], tokens[last][1])
+        matches.add(
+            MatchItem(matched_data=matched_text[span[0]:span[1]],
+                      sensitivity=sensitivity)
+        )
+        return span
@@ -16,14 +16,48 @@
 """Regular expression-based rules."""
 
 import logging
-import re
+from functools import lru_cache
 
 import regex
 
 from .cpr import CPRRule
-from .rule import Rule
+from .rule import Rule, TextScan
 from ..items import MatchItem
 
+# Maximum number of compiled patterns to keep in a single process
+PATTERN_CACHE_SIZE = 256
+
+# Matches longer than this are stored as their first group instead, or cut
+# off at this length if their pattern has no groups
+MAX_MATCH_LENGTH = 1024
+
+
+# Numbered backreferences, \1 to \99 or \g<1>, which aren't preceded by an
+# escaped backslash
+_backreference_regex = regex.compile(
+    r'(?<!\\)((?:\\\\)*)\\(?:([1-9][0-9]?)|g<([0-9]+)>)'
+)
+
+
+@lru_cache(maxsize=PATTERN_CACHE_SIZE)
+def compile_pattern(pattern_string, flags=0):
+    """Return the compiled pattern, compiling it only once per process."""
+    return regex.compile(pattern_string, flags)
+
+
+def shift_backreferences(pattern_string, offset):
+    """Return the pattern with its numbered backreferences shifted by offset.
+
+    Used when the pattern is put after other patterns' groups.
+    """
+    if offset == 0:
+        return pattern_string
+
+    def shift(m):
+        number = int(m.group(2) or m.group(3)) + offset
+        return '{0}\\g<{1}>'.format(m.group(1), number)
+    return _backreference_regex.sub(shift, pattern_string)
+
 
 class RegexRule(Rule):
     """Represents a rule which matches using a regular expression."""
@@ -43,6 +77,9 @@ class RegexRule(Rule):
         self.ignore_irrelevant = ignore_irrelevant
         self.do_modulus11 = do_modulus11
         self.regex_str = ''
+        # The patterns of the alternatives in self.regex by the number of the
+        # group around each alternative
+        self.compound_patterns = {}
 
         if not self._is_cpr_only():
             logging.info('------- Regex patters ---------')
@@ -50,7 +87,7 @@ class RegexRule(Rule):
                 logging.info(_psuedoRule.pattern_string)
             logging.info('-----------------------------\n')
             self.regex_str = self.compund_rules()
-            self.regex = regex.compile(self.regex_str, regex.DOTALL)
+            self.regex = compile_pattern(self.regex_str, regex.DOTALL)
 
         # bind the 'do_modulus11' and 'ignore_irrelevant' variables to the cpr_enabled property so that they're always
         # false if it is false
@@ -58,6 +95,10 @@ class RegexRule(Rule):
             self.do_modulus11 = cpr_enabled
             self.ignore_irrelevant = cpr_enabled
 
+        if cpr_enabled:
+            self.cpr_rule = CPRRule(self.do_modulus11, self.ignore_irrelevant,
+                                    whitelist=None)
+
     def __str__(self):
         """
         Returns a string object representation of this object
@@ -70,8 +111,13 @@ class RegexRule(Rule):
 
     def compund_rules(self):
         """
-        This method compounds all the regex patterns in the rule set into one regex rule that is OR'ed
-        e.g. A ruleSet of {pattern1, pattern2, pattern3} becomes (pattern1 | pattern2 | pattern3)
+        This method compounds all the regex patterns in the rule set into one
+        regex rule that is OR'ed, e.g. a ruleSet of {pattern1, pattern2,
+        pattern3} becomes (?:(pattern1)|(pattern2)|(pattern3))
+        Each alternative is put in a group of its own, so the group which
+        matched tells which pattern a match came from, and the numbered
+        backreferences of each pattern are shifted past the groups before
+        it.
         :return: RegexRule representing the compound rule
         """
 
@@ -79,9 +125,16 @@ class RegexRule(Rule):
         if len(rule_set) == 1:
             return rule_set.pop().pattern_string
         if len(rule_set) > 1:
-            compound_rule = '('
+            compound_rule = '(?:'
+            group_count = 0
             for _ in self.regex_patterns:
-                compound_rule += rule_set.pop().pattern_string
+                pattern = rule_set.pop()
+                # The group around the alternative
+                group_count += 1
+                self.compound_patterns[group_count] = pattern
+                compound_rule += '({0})'.format(shift_backreferences(
+                    pattern.pattern_string, group_count))
+                group_count += compile_pattern(pattern.pattern_string).groups
                 if len(rule_set) <= 0:
                     compound_rule += ')'
                 else:
@@ -94,26 +147,44 @@ class RegexRule(Rule):
     def execute(self, text):
         """Execute the rule on the text."""
         matches = set()
+        text = TextScan.of(text)
 
         if self._is_cpr_only():
-            cpr_rule = CPRRule(self.do_modulus11, self.ignore_irrelevant, whitelist=None)
-            temp_matches = cpr_rule.execute(text)
+            temp_matches = self.cpr_rule.execute(text)
             matches.update(temp_matches)
         else:
-            re_matches = self.regex.finditer(text)
+            re_matches = text.finditer(self.regex)
             if self.cpr_enabled:
-                cpr_rule = CPRRule(self.do_modulus11, self.ignore_irrelevant, whitelist=None)
-                matches.update(cpr_rule.execute(text))
+                matches.update(self.cpr_rule.execute(text))
 
             for match in re_matches:
+                pattern, first_group = self._matched_pattern(match)
                 matched_data = match.group(0)
-                if len(matched_data) > 1024:
-                    # TODO: Get rid of magic number
-                    matched_data = match.group(1)
+                if len(matched_data) > MAX_MATCH_LENGTH:
+                    if first_group is None:
+                        matched_data = matched_data[:MAX_MATCH_LENGTH]
+                    else:
+                        matched_data = match.group(first_group)
                 matches.add(MatchItem(matched_data=matched_data,
-                                      sensitivity=self.sensitivity))
+                                      sensitivity=self.sensitivity,
+                                      matched_pattern=pattern))
         return matches
 
+    def _matched_pattern(self, match):
+        """Return the pattern object whose alternative produced the match,
+        and the number of the pattern's first group in the match, or None
+        if the pattern has no groups.
+
+        The group around the alternative is the last group of the match to
+        close, so it is the match's lastindex.
+        """
+        if not self.compound_patterns:
+            return self.regex_patterns[0], 1 if self.regex.groups else None
+        pattern = self.compound_patterns[match.lastindex]
+        if compile_pattern(pattern.pattern_string).groups:
+            return pattern, match.lastindex + 1
+        return pattern, None
+
     def is_all_match(self, matches):
         """
         Checks if each rule is matched with the provided list of matches
@@ -123,32 +194,26 @@ class RegexRule(Rule):
         if not isinstance(matches, set):
             return False
 
-        cpr_match = False
+        cpr_pattern = compile_pattern(self.cpr_pattern)
+        cpr_match = any(
+            'original_matched_data' in match and
+            cpr_pattern.match(match['original_matched_data'])
+            for match in matches
+        )
 
-        # If it turns out that we're only doing a cpr scan then scan for the first match and return true
+        # If it turns out that we're only doing a cpr scan then any cpr match will do
         if self._is_cpr_only():
-            for match in matches:
-                if re.match(self.cpr_pattern, match['original_matched_data']):
-                    return True
+            return cpr_match
+
+        # Each match knows which pattern it came from
+        matched_patterns = set(match['matched_pattern'] for match in matches
+                               if 'matched_pattern' in match)
+        all_patterns_matched = matched_patterns.issuperset(
+            self.regex_patterns)
+        if not self.cpr_enabled:
+            return all_patterns_matched
         else:
-            regex_patterns = set(self.regex_patterns)
-
-            # for rule in self.regex_patterns:
-            for pattern in self.regex_patterns:
-                for match in matches:
-                    if re.match(pattern.pattern_string, match['matched_data']) and regex_patterns:
-                        regex_patterns.pop()
-                        continue
-                    if self.cpr_enabled and not cpr_match and 'original_matched_data' in match:
-                        if re.match(self.cpr_pattern, match['original_matched_data']):
-                            cpr_match = True
-
-                if not regex_patterns:
-                    break
-            if not self.cpr_enabled:
-                return not regex_patterns
-            else:
-                return not regex_patterns and cpr_match
+            return all_patterns_matched and cpr_match
 
     def _is_cpr_only(self):
         """Just a method to decide if we are only doing a CPR scan."""
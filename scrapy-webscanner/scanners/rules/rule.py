@@ -29,3 +29,110 @@ class Rule:
         Return a list of MatchItem's.
         """
         raise NotImplementedError
+
+
+class TextScan(object):
+
+    """Text which rules are executed on, and the pattern scans of it.
+
+    Rules search the text through finditer, which remembers the matches of
+    each pattern. This is memoization, not a single pass for all rules:
+    rules using the same pattern, e.g. every CPR-enabled rule, share the
+    pass of that pattern over the text and each only validate the matches
+    found, while rules with different patterns, like the name, address and
+    regex rules, still each scan the text separately.
+
+    Different patterns are deliberately not combined into one alternation:
+    an alternation only gives one match at each position, so finding the
+    same matches as the separate patterns takes an overlapping search and
+    matching each pattern again wherever it stops, which is several times
+    slower than the separate scans.
+
+    A TextScan may be a window of a larger text, see windows. The window
+    only owns the matches starting in its owned region, the text around it
+    being there for context and for matches crossing the region's end.
+    """
+
+    def __init__(self, text, owned_start=0, owned_end=None):
+        """Initialize the scan of the given text.
+
+        The owned region defaults to the whole text.
+        """
+        self.text = text
+        self.owned_start = owned_start
+        self.owned_end = len(text) if owned_end is None else owned_end
+        self._found = {}
+
+    @classmethod
+    def of(cls, text):
+        """Return the text as a TextScan, wrapping it if it's a string."""
+        if isinstance(text, cls):
+            return text
+        return cls(text)
+
+    @classmethod
+    def windows(cls, f, window_size, overlap):
+        """Yield TextScans of overlapping windows of the text in file f.
+
+        Each window owns about window_size characters, and includes overlap
+        characters of the text on either side of them. Owned regions end at
+        line breaks where possible, so words are never split between them.
+        Only three windows' worth of text is held in memory at a time.
+        """
+        def segments():
+            rest = ''
+            while True:
+                chunk = f.read(window_size)
+                if not chunk:
+                    if rest:
+                        yield rest
+                    return
+                chunk = rest + chunk
+                cut = chunk.rfind('\n') + 1
+                if cut <= 0:
+                    cut = len(chunk)
+                rest = chunk[cut:]
+                yield chunk[:cut]
+
+        before = ''
+        it = segments()
+        segment = next(it, None)
+        while segment is not None:
+            after = next(it, None)
+            ahead = ''
+            if after is not None:
+                ahead = after[:overlap]
+            yield cls(before + segment + ahead,
+                      len(before), len(before) + len(segment))
+            before = (before + segment)[-overlap:] if overlap else ''
+            segment = after
+
+    @property
+    def owned_text(self):
+        """The text of the owned region."""
+        return self.text[self.owned_start:self.owned_end]
+
+    def finditer_all(self, pattern, **kwargs):
+        """Return a list of all the matches of the compiled pattern.
+
+        Unlike finditer, this includes matches outside the owned region.
+        Keyword arguments are passed on to the pattern's finditer method.
+        """
+        key = (type(pattern), pattern.pattern, pattern.flags,
+               tuple(sorted(kwargs.items())))
+        found = self._found.get(key)
+        if found is None:
+            found = list(pattern.finditer(self.text, **kwargs))
+            self._found[key] = found
+        return found
+
+    def finditer(self, pattern, **kwargs):
+        """Return a list of the matches of the pattern in the owned region.
+
+        Keyword arguments are passed on to the pattern's finditer method.
+        """
+        found = self.finditer_all(pattern, **kwargs)
+        if self.owned_start == 0 and self.owned_end == len(self.text):
+            return found
+        return [m for m in found
+                if self.owned_start <= m.start() < self.owned_end]
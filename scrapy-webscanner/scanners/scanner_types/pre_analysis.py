@@ -1,4 +1,5 @@
 import time
+import importlib.util
 import magic
 import mimetypes
 import logging
@@ -199,19 +200,30 @@ types['Zip'] = _type_dict('Container', 'Archive',
                            'vnd.google-earth.kmz',
                            'vnd.ms-officetheme'],
                           True, 'zip.py')
-types['xz'] = _type_dict('Container', 'Archive', ['xz'], True, None)
-types['gzip'] = _type_dict('Container', 'Archive', ['gzip'], True, None)
+# 7-zip, RAR and cabinet archives can only be read with libarchive
+if importlib.util.find_spec('libarchive') is not None:
+    libarchive_supported = 'generic_archive.py'
+else:
+    libarchive_supported = None
+
+types['xz'] = _type_dict('Container', 'Archive', ['xz'], True,
+                         'generic_archive.py')
+types['gzip'] = _type_dict('Container', 'Archive', ['gzip'], True,
+                           'generic_archive.py')
 types['7-zip'] = _type_dict('Container', 'Archive',
-                            ['x-7z-compressed'], True, None)
-types['bzip'] = _type_dict('Container', 'Archive', ['bzip2'], True, None)
+                            ['x-7z-compressed'], True, libarchive_supported)
+types['bzip'] = _type_dict('Container', 'Archive', ['bzip2'], True,
+                           'generic_archive.py')
 types['Microsoft Cabinet'] = _type_dict('Container', 'Archive',
-                                        ['x-cab'], True, None)
-types['Tar'] = _type_dict('Container', 'Archive', ['x-tar'], True, None)
+                                        ['x-cab'], True, libarchive_supported)
+types['Tar'] = _type_dict('Container', 'Archive', ['x-tar'], True,
+                          'generic_archive.py')
 types['Par archive'] = _type_dict('Container', 'Archive', None, True, None)
 types['current ar archive'] = _type_dict('Container', 'Archive', None, True,
                                          None)
 types['RAR archive'] = _type_dict('Container', 'Archive',
-                                  ['application/rar'], True, None)
+                                  ['application/rar'], True,
+                                  libarchive_supported)
 types['XZ'] = _type_dict('Container', 'Archive', None, True, None)
 types['zlib'] = _type_dict('Container', 'Archive', None, True, None)
 types['VirtualBox'] = _type_dict('Container', 'Virtual Machine', None, False,
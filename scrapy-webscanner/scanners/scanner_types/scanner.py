@@ -15,14 +15,33 @@
 # source municipalities ( http://www.os2web.dk/ )
 
 """Contains a WebScanner."""
+import datetime
+import hashlib
+import json
 import logging
 
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
 from ..rules.name import NameRule
 from ..rules.address import AddressRule
 from ..rules.regexrule import RegexRule
 from ..rules.cpr import CPRRule
+from ..rules.cache import rule_set_cache
+from ..rules.rule import TextScan
+
+from ..items import MatchItem
+from ..processors.conversion_cache import content_key
+from ..processors.processor import MatchSink, Processor
 
-from ..processors.processor import Processor
+# Number of urls whose matches are recorded at a time
+RECORD_BATCH_SIZE = 1000
+
+# Version of the code converting content and finding matches in it, part of
+# the rule fingerprint. Bump it when a change makes the scanner find other
+# matches in the same content, so matches recorded before aren't reused.
+MATCHES_VERSION = 1
 
 
 class Scanner(object):
@@ -39,7 +58,8 @@ dictionary."""
         from os2webscanner.models.scans.scan_model import Scan
         self.scan_object = Scan.objects.get(pk=scan_id)
 
-        self.rules = self._load_rules()
+        self.rules = self._get_rules()
+        self._rule_fingerprint = None
         self.valid_domains = self.scan_object.get_valid_domains
 
     @staticmethod
@@ -49,6 +69,33 @@ Creates a new Scanner, the settings of which will be loaded from the given \
 scan ID."""
         return Scanner(dict(id=scan_id))
 
+    def _get_rules(self):
+        """Return the rules for the scan, reusing them if already built."""
+        from os2webscanner.models.scans.scan_model import Scan
+        scan_id = self.scan_object.pk
+        if self.scan_object.status in (Scan.DONE, Scan.FAILED):
+            # The scan has finished, so its rules won't be needed again
+            rule_set_cache.invalidate(scan_id)
+            return self._load_rules()
+
+        stamp = self._rule_stamp()
+        rules = rule_set_cache.get(scan_id, stamp)
+        if rules is None:
+            rules = self._load_rules()
+            rule_set_cache.put(scan_id, stamp, rules)
+        return rules
+
+    def _rule_stamp(self):
+        """Return the settings of the scan which its rules are built from.
+
+        Regex rules are attached to the scan when it is created, so only the
+        scan's own fields can change while it is running.
+        """
+        scan = self.scan_object
+        return (scan.do_name_scan, scan.do_address_scan,
+                scan.whitelisted_names, scan.blacklisted_names,
+                scan.whitelisted_addresses, scan.blacklisted_addresses)
+
     def _load_rules(self):
         """Load rules based on WebScanner settings."""
         rules = []
@@ -76,6 +123,145 @@ scan ID."""
             )
         return rules
 
+    def rule_fingerprint(self):
+        """Return a fingerprint of everything the matches depend on.
+
+        Content scanned with the same fingerprint gives the same matches,
+        so they can be reused by later scans.
+        """
+        if self._rule_fingerprint is None:
+            regex_rules = []
+            for rule in self.scan_object.regex_rules.all():
+                regex_rules.append((
+                    rule.name, rule.sensitivity, rule.cpr_enabled,
+                    rule.ignore_irrelevant, rule.do_modulus11,
+                    sorted(p.pattern_string for p in rule.patterns.all())
+                ))
+            # The name and street name tables may be rebuilt from other
+            # data files
+            dictionaries = []
+            if self.scan_object.do_name_scan:
+                dictionaries.append(NameRule.dictionary_digest())
+            if self.scan_object.do_address_scan:
+                dictionaries.append(AddressRule.dictionary_digest())
+            description = json.dumps([MATCHES_VERSION,
+                                      self._rule_stamp(),
+                                      self.scan_object.do_ocr,
+                                      sorted(regex_rules),
+                                      dictionaries])
+            self._rule_fingerprint = hashlib.sha256(
+                description.encode('utf-8')
+            ).hexdigest()
+        return self._rule_fingerprint
+
+    def can_reuse_matches(self):
+        """Return whether matches of content may be reused across scans.
+
+        Scans annotating spreadsheets need their files converted anyway.
+        """
+        return (settings.REUSE_CONTENT_MATCHES and
+                not self.scan_object.output_spreadsheet_file)
+
+    @staticmethod
+    def content_matches_cutoff():
+        """Return the time recorded matches must be created after to be
+        reused."""
+        return timezone.now() - datetime.timedelta(
+            days=settings.CONTENT_MATCHES_MAX_AGE_DAYS
+        )
+
+    def reuse_matches(self, content_hash, url_object):
+        """Copy the matches found in the same content by an earlier scan.
+
+        Returns True if there were earlier matches to copy.
+        """
+        from os2webscanner.models.contentmatches_model import ContentMatches
+        try:
+            content_matches = ContentMatches.objects.get(
+                content_hash=content_hash,
+                rule_fingerprint=self.rule_fingerprint(),
+                created__gte=self.content_matches_cutoff()
+            )
+        except ContentMatches.DoesNotExist:
+            return False
+
+        logging.info("Reusing the matches of {}".format(url_object.url))
+        with MatchSink() as sink:
+            for fields in content_matches.get_matches():
+                sink.add(MatchItem(url=url_object, scan=url_object.scan,
+                                   **fields))
+        return True
+
+    def record_content_matches(self):
+        """Record the matches of the scan's content for later scans.
+
+        Only urls whose processing didn't fail are recorded, as their
+        matches may be incomplete, and content which is already recorded
+        is skipped. Records too old to be reused are deleted, so their
+        content is recorded again.
+        """
+        from os2webscanner.models.contentmatches_model import ContentMatches
+        from os2webscanner.models.conversionqueueitem_model import (
+            ConversionQueueItem
+        )
+        from os2webscanner.models.match_model import Match
+        from os2webscanner.models.url_model import Url
+        if not self.can_reuse_matches():
+            return
+        ContentMatches.objects.filter(
+            created__lt=self.content_matches_cutoff()
+        ).delete()
+        fingerprint = self.rule_fingerprint()
+        url_hashes = list(Url.objects.filter(
+            scan=self.scan_object, content_hash__isnull=False,
+            matches_complete=True
+        ).exclude(
+            conversionqueueitem__status=ConversionQueueItem.FAILED
+        ).values_list('pk', 'content_hash').order_by('pk'))
+
+        for start in range(0, len(url_hashes), RECORD_BATCH_SIZE):
+            hash_by_url = dict(url_hashes[start:start + RECORD_BATCH_SIZE])
+            known = set(ContentMatches.objects.filter(
+                rule_fingerprint=fingerprint,
+                content_hash__in=set(hash_by_url.values())
+            ).values_list('content_hash', flat=True))
+
+            # Copies of the same content are only recorded once
+            url_by_hash = {}
+            for url_id, content_hash in sorted(hash_by_url.items()):
+                if content_hash not in known:
+                    url_by_hash.setdefault(content_hash, url_id)
+            matches_by_hash = {content_hash: []
+                               for content_hash in url_by_hash}
+            for match in Match.objects.filter(
+                    url__in=url_by_hash.values()
+            ).values('url', *ContentMatches.MATCH_FIELDS).order_by('pk'):
+                matches_by_hash[hash_by_url[match['url']]].append(match)
+
+            records = []
+            for content_hash, matches in matches_by_hash.items():
+                record = ContentMatches(content_hash=content_hash,
+                                        rule_fingerprint=fingerprint)
+                record.set_matches(matches)
+                records.append(record)
+            self._save_content_matches(records)
+
+    @staticmethod
+    def _save_content_matches(records):
+        """Save the ContentMatches, skipping any saved in the meantime."""
+        from os2webscanner.models.contentmatches_model import ContentMatches
+        try:
+            with transaction.atomic():
+                ContentMatches.objects.bulk_create(records)
+        except IntegrityError:
+            # Another scan recorded some of the same content concurrently
+            for record in records:
+                try:
+                    with transaction.atomic():
+                        record.save()
+                except IntegrityError:
+                    pass
+
     def get_exclusion_rules(self):
         """Return a list of exclusion rules associated with the WebScanner."""
         exclusion_rules = []
@@ -102,26 +288,119 @@ scan ID."""
         immediately or add it to a conversion queue.
         Returns True if the data was processed successfully or if the item
         was queued to be processed.
+
+        If the same content was scanned with the same rules before, its
+        matches are copied instead.
         """
         processor_type = Processor.mimetype_to_processor_type(
             url_object.mime_type
         )
         processor = Processor.processor_by_type(processor_type)
         if processor is not None:
+            content_hash = None
+            if self.can_reuse_matches():
+                content_hash = content_key(
+                    data.encode('utf-8') if isinstance(data, str) else data
+                )
+                if self.reuse_matches(content_hash, url_object):
+                    return True
             logging.info("{} is handled by processor of type {}".format(
                 url_object.url, processor_type))
-            return processor.handle_spider_item(data, url_object)
+            result = processor.handle_spider_item(data, url_object)
+            if result and content_hash:
+                # Record the matches of the content when the scan is done
+                url_object.content_hash = content_hash
+                url_object.save(update_fields=['content_hash'])
+            return result
 
     def execute_rules(self, text):
         """Execute the scanner's rules on the given text.
 
+        The rules share a single TextScan of the text, so each pattern used
+        by several rules, like the CPR pattern, is only run once. Rules with
+        different patterns still scan the text separately, see TextScan.
         Returns a list of matches.
         """
-        matches = []
+        return self._combine_matches(self._find_matches(TextScan(text)))
+
+    def execute_rules_windowed(self, windows):
+        """Execute the scanner's rules on the windows of a larger text.
+
+        windows are TextScans as yielded by TextScan.windows. The matches of
+        all the windows are collected before they are combined, so a rule
+        whose patterns are found in different windows matches the text. A
+        name or address found in several windows is only reported for the
+        first of them, as the name and address rules report each distinct
+        full name and address in a text once.
+        Returns a list of matches.
+        """
+        matches_by_rule = None
+        # The matched data of each rule's matches in the windows so far
+        seen_by_rule = [set() for _ in self.rules]
+        for text_scan in windows:
+            found_by_rule = self._find_matches(text_scan)
+            self._drop_repeated_matches(found_by_rule, seen_by_rule)
+            matches_by_rule = self._merge_matches(matches_by_rule,
+                                                  found_by_rule)
+        if matches_by_rule is None:
+            return []
+        return self._combine_matches(matches_by_rule)
+
+    def execute_rules_pages(self, pages):
+        """Execute the scanner's rules on the text of each page of a
+        document.
+
+        Like execute_rules_windowed, the matches of all the pages are
+        collected before they are combined, so a rule whose patterns are
+        found on different pages matches the document. Each match gets the
+        number of the page it was found on.
+        Returns a list of matches.
+        """
+        matches_by_rule = None
+        for page_no, text in enumerate(pages, 1):
+            page_matches = self._find_matches(TextScan(text))
+            for found in page_matches:
+                for match in found:
+                    match['page_no'] = page_no
+            matches_by_rule = self._merge_matches(matches_by_rule,
+                                                  page_matches)
+        if matches_by_rule is None:
+            return []
+        return self._combine_matches(matches_by_rule)
+
+    @staticmethod
+    def _merge_matches(matches_by_rule, found_by_rule):
+        """Add the matches of each rule in found_by_rule to its matches in
+        matches_by_rule, which may be None, and return the result."""
+        if matches_by_rule is None:
+            return found_by_rule
+        for matches, found in zip(matches_by_rule, found_by_rule):
+            matches.update(found)
+        return matches_by_rule
+
+    def _drop_repeated_matches(self, found_by_rule, seen_by_rule):
+        """Remove the matches of the name and address rules in found_by_rule
+        whose matched data is in the rule's set in seen_by_rule, and add the
+        matched data of the rest to it."""
+        for rule, found, seen in zip(self.rules, found_by_rule, seen_by_rule):
+            if not isinstance(rule, (NameRule, AddressRule)):
+                continue
+            found.difference_update(
+                [match for match in found if match['matched_data'] in seen])
+            seen.update(match['matched_data'] for match in found)
+
+    def _find_matches(self, text_scan):
+        """Return the set of matches of each of the rules in the TextScan."""
+        matches_by_rule = []
         for rule in self.rules:
             print('-------Rule to be executed {0}-------'.format(rule))
-            rule_matches = rule.execute(text)
+            matches_by_rule.append(rule.execute(text_scan))
+        return matches_by_rule
 
+    def _combine_matches(self, matches_by_rule):
+        """Return the matches to report given the matches of each rule."""
+        matches = []
+        for rule, rule_matches in zip(self.rules, matches_by_rule):
             if isinstance(rule, CPRRule):
                 for match in rule_matches:
                     match['matched_rule'] = rule.name
@@ -17,7 +17,6 @@
 import chardet
 import logging
 import magic
-import mimetypes
 import re
 import regex
 
@@ -25,7 +24,7 @@ from magic import MagicException
 
 from .base_spider import BaseScannerSpider
 
-from ..processors.processor import Processor
+from ..processors.processor import Processor, guess_mime_type
 
 from os2webscanner.utils import capitalize_first, get_codec_and_string, secure_save
 from os2webscanner.models.url_model import Url
@@ -113,7 +112,7 @@ class ScannerSpider(BaseScannerSpider):
         if content_type:
             mime_type = parse_content_type(content_type)
         else:
-            mime_type, encoding = mimetypes.guess_type(response.url)
+            mime_type = guess_mime_type(response.url)
             if not mime_type:
                 try:
                     mime_type = self.magic.from_buffer(response.body)
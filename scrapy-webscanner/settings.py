@@ -17,8 +17,58 @@
 
 # Scrapy settings file can be found in scanner/settings.py
 
+import os
+
 # Number of consuming processors that should be running.
 NUMBER_OF_PROCESSES_PER_TYPE = 2
 
+# Scale the number of processors of each type with the amount of work in its
+# queue, instead of running NUMBER_OF_PROCESSES_PER_TYPE of each.
+AUTOSCALE_PROCESSES = True
+
+# Minimum and maximum number of processors of each type when autoscaling.
+PROCESSES_PER_TYPE_BOUNDS = {
+    'html': (1, 4),
+    'libreoffice': (1, 6),
+    'ocr': (1, 8),
+    'pdf': (1, 4),
+    'zip': (1, 2),
+    'text': (1, 4),
+    'csv': (0, 2),
+    'xml': (0, 2),
+    'office': (1, 4),
+    'archive': (0, 2),
+}
+
+# Number of seconds of work the queue of each type should hold at most per
+# running processor when autoscaling.
+AUTOSCALE_TARGET_SECONDS = 60
+
+# The overall budget for autoscaling. No processors are started if there
+# are MAX_PROCESSES already, if the CPU usage is above MAX_CPU_PERCENT, or if
+# less than MIN_AVAILABLE_MEMORY_MB of memory is available.
+MAX_PROCESSES = 2 * (os.cpu_count() or 1)
+MAX_CPU_PERCENT = 90
+MIN_AVAILABLE_MEMORY_MB = 1024
+
+# Keep queue processors running until they are recycled, instead of
+# restarting them after every few items. This saves setting up Django,
+# libmagic, the rules and, for LibreOffice, a new soffice instance.
+LONG_LIVED_PROCESSORS = True
+
+# Number of items a long-lived processor handles before it is restarted.
+# None to only restart it on memory usage.
+PROCESSOR_MAX_ITEMS = 5000
+
+# Resident memory in megabytes above which a long-lived processor is
+# restarted.
+PROCESSOR_MAX_RSS_MB = 1024
+
 # # Number of email downloader threads that should be running.
 # NUMBER_OF_EMAIL_THREADS = 4
+
+# Fork queue processors from the process manager instead of starting each of
+# them as a new program. The process manager sets up Django, imports the
+# processors and loads the rule dictionaries first, and the processors share
+# that memory with it until they change it.
+PREFORK_PROCESSORS = False
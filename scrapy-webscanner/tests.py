@@ -18,10 +18,19 @@
 """Unit tests for the scanner."""
 
 # Include the Django app
+import datetime
+import io
 import os
 import sys
+import gzip
+import json
 import shutil
+import tarfile
 import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
 
 base_dir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
 sys.path.append(base_dir + "/webscanner_site")
@@ -36,12 +45,17 @@ import linkchecker
 
 import unittest
 
+import autoscaling
 from scanners.scanner_types.scanner import Scanner
 
-from scanners.rules import cpr, name, regexrule
+from scanners.rules import (address, ahocorasick, cache, cpr, dictionary,
+                            name, regexrule)
+from scanners.rules.rule import TextScan
 
 from scanners.spiders import scanner_spider
-from scanners.processors import pdf, libreoffice, html, zip
+from scanners.processors import (pdf, libreoffice, html, zip, office, ocr,
+                                 generic_archive, processor, queue_backend,
+                                 conversion_cache)
 
 from os2webscanner.models.conversionqueueitem_model import ConversionQueueItem
 from os2webscanner.models.url_model import Url
@@ -53,6 +67,7 @@ from os2webscanner.models.domains.webdomain_model import WebDomain
 
 from os2webscanner.models.regexrule_model import RegexRule
 from os2webscanner.models.organization_model import Organization
+from os2webscanner.models.sensitivity_level import Sensitivity
 
 
 from scanners.scanner_types.pre_analysis import PreDataScanner
@@ -154,6 +169,55 @@ class NameTest(unittest.TestCase):
             self.assertFalse(any(m == invalid_name for m in matches),
                              invalid_name + " is valid")
 
+    def test_repeated_names(self):
+        """Test that repeated full names are not matched again as single
+        names."""
+        matches = name.NameRule().execute("Jens Jensen og Jens Jensen")
+        self.assertEqual([m['matched_data'] for m in matches],
+                         ['Jens Jensen'])
+
+    def test_blacklist(self):
+        """Test that names containing a blacklisted string are HIGH."""
+        rule = name.NameRule(blacklist="XYZ\nQWERTY")
+        matches = rule.execute("Foo Qwerty-Bar")
+        self.assertEqual([m['sensitivity'] for m in matches],
+                         [Sensitivity.HIGH])
+
+
+class AddressTest(unittest.TestCase):
+
+    """Test the address rule."""
+
+    def test_matching(self):
+        """Test address matching with a whitelist and a blacklist."""
+        text = """
+            Nørregade 10, 8000 Aarhus
+            Vestergade 4b
+            Fooqwertyvej 2
+            Nørregade 10, 8000 Aarhus
+            """
+        rule = address.AddressRule(whitelist="VESTERGADE 4B",
+                                   blacklist="FOOQWERTYVEJ")
+        matches = sorted((m['matched_data'], m['sensitivity'])
+                         for m in rule.execute(text))
+        self.assertEqual(matches, [
+            ('Fooqwertyvej 2', Sensitivity.HIGH),
+            ('Nørregade 10, 8000 Aarhus', Sensitivity.HIGH),
+        ])
+
+
+class AhoCorasickTest(unittest.TestCase):
+
+    """Test the Aho-Corasick automaton."""
+
+    def test_finditer(self):
+        automaton = ahocorasick.Automaton(['he', 'she', 'his', 'hers'])
+        self.assertEqual(sorted(automaton.finditer("ushers")),
+                         [(1, 'she'), (2, 'he'), (2, 'hers')])
+        self.assertTrue(automaton.search("this"))
+        self.assertFalse(automaton.search("hi"))
+        self.assertFalse(ahocorasick.Automaton([]).search("hi"))
+
 
 class CPRTest(unittest.TestCase):
 
@@ -216,6 +280,353 @@ class CPRTest(unittest.TestCase):
         self.assertTrue(cpr.modulus11_check("0101650123"))
         self.assertTrue(cpr.modulus11_check("0101660123"))
 
+    def test_batch_validation(self):
+        # Check that batch validation agrees with validating one at a time
+        cprs = ['2110625629', '2110625628', '0101650123', '0101660123',
+                '2902004000', '2902014000', '2902584000', '0080135510',
+                '3104621234', '2006385322', '0801355102', '4110625629',
+                '2110620155']
+        for do_modulus11 in (True, False):
+            for ignore_irrelevant in (True, False):
+                self.assertEqual(
+                    cpr.validate_cprs(cprs, do_modulus11, ignore_irrelevant),
+                    [cpr.is_valid_cpr(c, do_modulus11, ignore_irrelevant)
+                     for c in cprs])
+
+    def test_match_context(self):
+        # Check that CPR numbers in contexts are masked, also when they are
+        # cut off by the edge of the context
+        text = "2110620155 og 2110625629"
+        matches = cpr.match_cprs(text, mask_digits=False,
+                                 ignore_irrelevant=False)
+        contexts = sorted(m['match_context'] for m in matches)
+        self.assertEqual(contexts, ["XXXXXX-XXXX og XXXXXX-XXXX"] * 2)
+        contexts = list(cpr.mask_contexts(
+            text, [(0, 10), (14, 24)], [(0, 10)], width=6))
+        self.assertEqual(contexts, ["XXXXXX-XXXX og XX"])
+
+
+class TextScanTest(unittest.TestCase):
+
+    """Test sharing pattern scans between rules."""
+
+    def test_shared_cpr_scan(self):
+        text_scan = TextScan("211062-5629 og 2006359917")
+        found = text_scan.finditer(cpr.cpr_regex)
+        self.assertEqual(len(found), 2)
+        self.assertIs(text_scan.finditer(cpr.cpr_regex), found)
+
+        self.assertEqual(
+            len(cpr.CPRRule(False, False).execute(text_scan)),
+            len(cpr.CPRRule(False, False).execute(text_scan.text))
+        )
+
+    def test_windows(self):
+        text = "".join("Linje {0}: 211062-5629 og 2006359917\n".format(i)
+                       for i in range(200))
+        windows = list(TextScan.windows(io.StringIO(text), 500, 100))
+        self.assertGreater(len(windows), 1)
+        self.assertEqual("".join(w.owned_text for w in windows), text)
+
+        rule = cpr.CPRRule(False, False)
+        whole = rule.execute(text)
+        windowed = [m for w in windows for m in rule.execute(w)]
+        self.assertEqual(len(windowed), 400)
+        self.assertEqual(
+            sorted(m['match_context'] for m in windowed),
+            sorted(m['match_context'] for m in whole)
+        )
+
+    def test_repeated_names_in_windows(self):
+        from unittest.mock import patch
+        text = "Jens Hansen bor her.\n" * 200
+        scanner = Scanner.__new__(Scanner)
+        scanner.rules = [name.NameRule()]
+        windows = list(TextScan.windows(io.StringIO(text), 500, 100))
+        self.assertGreater(len(windows), 1)
+        # Get the matches of each rule without combining them
+        with patch.object(Scanner, '_combine_matches',
+                          lambda self, matches_by_rule: matches_by_rule):
+            whole = scanner.execute_rules(text)
+            windowed = scanner.execute_rules_windowed(windows)
+        self.assertEqual(
+            sorted(m['matched_data'] for m in windowed[0]),
+            sorted(m['matched_data'] for m in whole[0])
+        )
+
+
+class RuleSetCacheTest(unittest.TestCase):
+
+    """Test the per-process cache of rules built for scans."""
+
+    def test_stamp_change_discards_rules(self):
+        rule_cache = cache.RuleSetCache()
+        rule_cache.put(1, ('a',), ['rule'])
+        self.assertEqual(rule_cache.get(1, ('a',)), ['rule'])
+        self.assertIsNone(rule_cache.get(1, ('b',)))
+        self.assertEqual(len(rule_cache), 0)
+
+    def test_least_recently_used_is_evicted(self):
+        rule_cache = cache.RuleSetCache(max_size=2)
+        rule_cache.put(1, (), ['one'])
+        rule_cache.put(2, (), ['two'])
+        rule_cache.get(1, ())
+        rule_cache.put(3, (), ['three'])
+        self.assertIsNone(rule_cache.get(2, ()))
+        self.assertEqual(rule_cache.get(1, ()), ['one'])
+
+        rule_cache.invalidate(1)
+        self.assertIsNone(rule_cache.get(1, ()))
+
+
+class NameTableTest(unittest.TestCase):
+
+    """Test the compiled name dictionaries."""
+
+    def test_lookup(self):
+        names = ['JENSEN', 'HANSEN', 'SØRENSEN', 'Ø']
+        with tempfile.TemporaryDirectory() as temp_dir:
+            table_path = os.path.join(temp_dir, 'names.tbl')
+            dictionary.build_table(names, table_path)
+            table = dictionary.NameTable(table_path)
+
+            self.assertEqual(len(table), len(names))
+            for n in names:
+                self.assertIn(n, table)
+            self.assertNotIn('JENSE', table)
+            self.assertNotIn('', table)
+
+    def test_rebuild_other_format(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            source_path = os.path.join(temp_dir, 'names.txt')
+            with open(source_path, 'w') as f:
+                f.write('JENSEN\n')
+            table_path = os.path.join(temp_dir, 'names.tbl')
+            dictionary.build_table(['JENSEN'], table_path)
+            # The table is newer than its source, but of another format
+            self.assertTrue(dictionary._is_stale(table_path, [source_path],
+                                                 table_format=3))
+            self.assertFalse(dictionary._is_stale(table_path, [source_path],
+                                                  table_format=0))
+            self.assertRaises(ValueError, dictionary.NameTable, table_path, 3)
+
+    def test_source_digest(self):
+        with tempfile.NamedTemporaryFile(suffix='.txt') as f:
+            f.write(b'JENS\t1\n')
+            f.flush()
+            digest = dictionary.source_digest([f.name])
+            os.utime(f.name, (0, 0))
+            f.write(b'HANS\t1\n')
+            f.flush()
+            os.utime(f.name, (1, 1))
+            self.assertNotEqual(dictionary.source_digest([f.name]), digest)
+
+
+class LocalQueueBackendTest(unittest.TestCase):
+
+    """Test the in-process conversion queue."""
+
+    def setUp(self):
+        self.scan = Scan(pk=1)
+
+    def queue_item(self, file_name, item_type='text', scan=None):
+        url = Url(url='http://example.com/' + file_name,
+                  scan=scan or self.scan)
+        return ConversionQueueItem(type=item_type, file=file_name, url=url)
+
+    def test_add_and_claim(self):
+        backend = queue_backend.LocalQueueBackend()
+        self.assertEqual(backend.claim('text', 1), [])
+        first = self.queue_item('a.txt')
+        second = self.queue_item('b.txt')
+        backend.add(first)
+        backend.add(second)
+        backend.add(self.queue_item('c.html', 'html'))
+
+        item, = backend.claim('text', 1)
+        self.assertIs(item, first)
+        self.assertEqual(item.status, ConversionQueueItem.PROCESSING)
+        self.assertEqual(item.process_id, 1)
+        self.assertEqual(backend.claim('text', 2), [second])
+        self.assertEqual(backend.claim('text', 1), [])
+
+    def test_claim_batch(self):
+        backend = queue_backend.LocalQueueBackend()
+        items = [self.queue_item('%d.txt' % i) for i in range(5)]
+        for item in items:
+            backend.add(item)
+
+        batch = backend.claim('text', 1, count=3)
+        self.assertEqual(batch, items[:3])
+        backend.finish([batch[0]], [batch[1]], [batch[2]])
+        self.assertEqual(batch[1].status, ConversionQueueItem.FAILED)
+        # The unprocessed item is claimed again before the rest
+        self.assertEqual(batch[2].status, ConversionQueueItem.NEW)
+        self.assertEqual(backend.claim('text', 2, count=10),
+                         [items[2]] + items[3:])
+
+    def test_fair_share(self):
+        backend = queue_backend.LocalQueueBackend()
+        big_scan = self.scan
+        small_scan = Scan(pk=2, queue_weight=2)
+        urgent_scan = Scan(pk=3, queue_priority=1)
+        for i in range(100):
+            backend.add(self.queue_item('big%d.txt' % i))
+        backend.claim('text', 1, count=10)
+
+        small = [self.queue_item('small%d.txt' % i, scan=small_scan)
+                 for i in range(4)]
+        for item in small:
+            backend.add(item)
+        # The small scan doesn't wait for the big one, and gets two items
+        # processed for each of the big scan's because of its weight
+        batch = backend.claim('text', 1, count=6)
+        self.assertEqual([item for item in batch if item in small], small)
+        self.assertEqual(len([item for item in batch
+                              if item.url.scan is big_scan]), 2)
+
+        urgent = self.queue_item('urgent.txt', scan=urgent_scan)
+        backend.add(urgent)
+        self.assertEqual(backend.claim('text', 1), [urgent])
+
+    def test_wait_is_woken_by_add(self):
+        backend = queue_backend.LocalQueueBackend()
+        item = self.queue_item('a.txt')
+        threading.Timer(0.1, backend.add, [item]).start()
+        start = time.time()
+        backend.wait('text', timeout=10)
+        self.assertLess(time.time() - start, 5)
+        self.assertEqual(backend.claim('text', 1), [item])
+
+
+class ProcessQueueTest(unittest.TestCase):
+
+    """Test recycling of long-lived queue processors."""
+
+    def setUp(self):
+        self.backend = queue_backend.LocalQueueBackend()
+        self.old_backend = processor.Processor.queue_backend
+        processor.Processor.queue_backend = self.backend
+        self.processor = html.HTMLProcessor()
+        self.processor.handle_queue_item = lambda item: True
+
+    def tearDown(self):
+        processor.Processor.queue_backend = self.old_backend
+
+    def test_recycle_on_memory_usage(self):
+        scan = Scan(pk=1)
+        for i in range(processor.MEMORY_CHECK_INTERVAL + 10):
+            url = Url(url='http://example.com/%d.html' % i, scan=scan)
+            self.backend.add(ConversionQueueItem(type='html', url=url,
+                                                 file='%d.html' % i))
+        self.processor.documents_to_process = None
+        self.processor.max_rss = 1
+        self.processor.process_queue()
+        self.assertEqual(len(self.backend.claim('html', 1, count=100)), 10)
+
+    def test_item_which_raises_fails(self):
+        scan = Scan(pk=1)
+        items = []
+        for i in range(3):
+            url = Url(url='http://example.com/%d.html' % i, scan=scan)
+            items.append(ConversionQueueItem(type='html', url=url,
+                                             file='%d.html' % i))
+            self.backend.add(items[-1])
+
+        def handle_queue_item(item):
+            if item is items[1]:
+                raise RuntimeError("Processing failed")
+            return True
+        self.processor.handle_queue_item = handle_queue_item
+        self.processor.claim_batch_size = 3
+        with self.assertRaises(RuntimeError):
+            self.processor.process_queue()
+
+        # The item which raised failed, so it isn't claimed again, and only
+        # the item which wasn't started is put back in the queue
+        self.assertEqual(items[1].status, ConversionQueueItem.FAILED)
+        self.assertEqual(items[2].status, ConversionQueueItem.NEW)
+        self.assertIsNone(items[2].process_start_time)
+        self.assertEqual(self.backend.claim('html', 1, count=3), [items[2]])
+
+
+class ScalingPolicyTest(unittest.TestCase):
+
+    """Test the estimate of the number of processors each type needs."""
+
+    def setUp(self):
+        self.policy = autoscaling.ScalingPolicy(lambda ptype: (1, 4), 60)
+        self.now = datetime.datetime(2019, 3, 27, 12, 0, 0)
+
+    def started(self, pid, seconds_ago):
+        return pid, self.now - datetime.timedelta(seconds=seconds_ago)
+
+    def test_batch_of_one_processor(self):
+        # A processor which has claimed a batch of ten items, and started
+        # the first of them, is a single busy processor
+        self.policy.observe('text', [self.started(1, 1)], self.now)
+        self.assertEqual(self.policy.wanted_processes('text', 0, 1), 1)
+
+    def test_seconds_per_item(self):
+        for i in range(20):
+            self.policy.observe('pdf', [self.started(1, 5),
+                                        self.started(2, 15)], self.now)
+        self.assertAlmostEqual(self.policy.seconds_per_item['pdf'], 20, 1)
+        # 30 items of 20 seconds take 10 minutes of work
+        self.assertEqual(self.policy.wanted_processes('pdf', 30, 2), 4)
+
+    def test_items_in_parallel(self):
+        # An OCR processor recognizing four images at a time gets through
+        # them four times faster
+        for i in range(20):
+            self.policy.observe('ocr', [self.started(1, 4)] * 4, self.now)
+        self.assertAlmostEqual(self.policy.seconds_per_item['ocr'], 2, 1)
+
+    def test_scale_down(self):
+        for i in range(20):
+            self.policy.observe('html', [self.started(1, 2)], self.now)
+        self.assertEqual(self.policy.wanted_processes('html', 1000, 1), 4)
+        # Once the queue is empty, only the busy processors are needed
+        self.assertEqual(self.policy.wanted_processes('html', 0, 1), 1)
+        self.assertEqual(self.policy.wanted_processes('html', 0, 0), 1)
+
+
+class OCRTest(unittest.TestCase):
+
+    """Test recognizing a batch of images in parallel."""
+
+    class TextProcessor(object):
+
+        def __init__(self):
+            self.texts = []
+
+        def process(self, data, url_object, page_no=None):
+            self.texts.append((data, page_no))
+            return True
+
+    def recognize(self, file_path):
+        if file_path.endswith('bad.png'):
+            raise RuntimeError("Unable to read image")
+        return os.path.basename(file_path)
+
+    def test_handle_queue_items(self):
+        processor = ocr.OCRProcessor()
+        processor.text_processor = self.TextProcessor()
+        processor.recognize = self.recognize
+        processor.executor = ThreadPoolExecutor(2)
+        url = Url(url='http://example.com/doc.pdf', scan=Scan(pk=1))
+        items = [ConversionQueueItem(type='ocr', url=url, page_no=i + 1,
+                                     file='/nonexistent/%s.png' % image)
+                 for i, image in enumerate(['a', 'bad', 'c'])]
+        try:
+            results = list(processor.handle_queue_items(items))
+        finally:
+            processor.executor.shutdown()
+        self.assertEqual([result for item, result in results],
+                         [True, False, True])
+        self.assertEqual(processor.text_processor.texts,
+                         [('a.png', 1), ('c.png', 3)])
+
 
 class PDF2HTMLTest(unittest.TestCase):
 
@@ -253,6 +664,51 @@ class PDF2HTMLTest(unittest.TestCase):
         self.assertEqual(result, True)
 
 
+class PDFTextTest(unittest.TestCase):
+
+    test_dir = base_dir + '/scrapy-webscanner/tests/data/pdf/'
+
+    def test_pdf_pages(self):
+        pages = list(pdf.pdf_pages(
+            self.test_dir + 'Midler-til-frivilligt-arbejde.pdf'
+        ))
+        self.assertGreater(len(pages), 0)
+        self.assertTrue(any(page.strip() for page in pages))
+
+    def test_pdf_pages_invalid_file(self):
+        with tempfile.NamedTemporaryFile(suffix='.pdf') as f:
+            f.write(b'Not a PDF')
+            f.flush()
+            with self.assertRaises(pdf.PDFTextError):
+                list(pdf.pdf_pages(f.name))
+
+    def test_cached_pages(self):
+        # A form feed in the text of a page doesn't split it
+        pages = ['Side 1\f', 'Side 2']
+        self.assertEqual(pdf._cached_pages(json.dumps(pages)), pages)
+        self.assertIsNone(pdf._cached_pages('Side 1\fSide 2'))
+
+    def test_failed_image_extraction(self):
+        from unittest import mock
+        item = mock.Mock(file_path=self.test_dir + 'missing.pdf')
+        item.url.scan.do_ocr = True
+        pdf_processor = pdf.PDFProcessor()
+        with mock.patch.object(pdf.settings, 'PDF_EXTRACT_TEXT', True), \
+                mock.patch.object(pdf_processor, 'extract_pages'), \
+                mock.patch.object(pdf_processor, 'process_pages'), \
+                mock.patch.object(pdf_processor, 'extract_images',
+                                  return_value=False):
+            # The text is done, but its matches are incomplete
+            self.assertTrue(pdf_processor.handle_queue_item(item))
+        item.url.set_matches_incomplete.assert_called_once_with()
+
+    def test_ocr_page_no(self):
+        self.assertEqual(processor.get_ocr_page_no('pdfimage-012-003.png'),
+                         12)
+        self.assertEqual(processor.get_ocr_page_no('some_file-3_1.png'), 3)
+        self.assertIsNone(processor.get_ocr_page_no('picture.png'))
+
+
 class LibreofficeTest(unittest.TestCase):
 
     test_dir = base_dir + '/scrapy-webscanner/tests/data/'
@@ -286,6 +742,104 @@ class LibreofficeTest(unittest.TestCase):
         self.assertEqual(result, True)
 
 
+class OfficeTest(unittest.TestCase):
+
+    """Test the text extraction of the office processor."""
+
+    def make_archive(self, parts):
+        data = io.BytesIO()
+        with zipfile.ZipFile(data, 'w') as archive:
+            for part_name, content in parts.items():
+                archive.writestr(part_name, content)
+        return zipfile.ZipFile(io.BytesIO(data.getvalue()))
+
+    def test_wordprocessing(self):
+        archive = self.make_archive({
+            'word/document.xml':
+                '<w:document xmlns:w="http://schemas.openxmlformats.org/'
+                'wordprocessingml/2006/main"><w:body>'
+                '<w:p><w:r><w:t>CPR 010101</w:t></w:r>'
+                '<w:r><w:t>-1234</w:t><w:tab/><w:t>Jens</w:t></w:r></w:p>'
+                '<w:p><w:r><w:t>Hansen</w:t></w:r></w:p>'
+                '</w:body></w:document>'
+        })
+        self.assertEqual(''.join(office.extract_text(archive)),
+                         'CPR 010101-1234\tJens\nHansen\n')
+
+    def test_spreadsheet(self):
+        ns = 'xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"'
+        archive = self.make_archive({
+            'xl/workbook.xml': '<workbook %s/>' % ns,
+            'xl/sharedStrings.xml':
+                '<sst %s><si><t>Navn</t></si>'
+                '<si><r><t>Jens </t></r><r><t>Hansen</t></r></si></sst>' % ns,
+            'xl/worksheets/sheet1.xml':
+                '<worksheet %s><sheetData>'
+                '<row><c t="s"><v>0</v></c><c><v>42</v></c></row>'
+                '<row><c t="s"><v>1</v></c>'
+                '<c t="inlineStr"><is><t>010101-1234</t></is></c></row>'
+                '</sheetData></worksheet>' % ns
+        })
+        self.assertTrue(office.is_spreadsheet(archive))
+        self.assertEqual(''.join(office.extract_text(archive)),
+                         'Navn;42\nJens Hansen;010101-1234\n')
+
+    def test_spreadsheet_number_formats(self):
+        ns = 'xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"'
+        archive = self.make_archive({
+            'xl/workbook.xml': '<workbook %s/>' % ns,
+            'xl/styles.xml':
+                '<styleSheet %s><numFmts>'
+                '<numFmt numFmtId="164" formatCode="000000\\-0000"/>'
+                '<numFmt numFmtId="165" formatCode="yyyy&quot;.&quot;mm"/>'
+                '</numFmts><cellXfs><xf numFmtId="0"/><xf numFmtId="164"/>'
+                '<xf numFmtId="14"/><xf numFmtId="165"/></cellXfs>'
+                '</styleSheet>' % ns,
+            'xl/worksheets/sheet1.xml':
+                '<worksheet %s><sheetData><row>'
+                '<c s="1"><v>101011234</v></c><c s="2"><v>44197</v></c>'
+                '<c s="3"><v>44197.5</v></c><c><v>42</v></c>'
+                '<c s="2"><v>3000000</v></c>'
+                '</row></sheetData></worksheet>' % ns
+        })
+        self.assertEqual(''.join(office.extract_text(archive)),
+                         '010101-1234;01-01-2021;2021.01;42;3000000\n')
+
+    def test_doctype_is_refused(self):
+        archive = self.make_archive({
+            'word/document.xml':
+                '<!DOCTYPE w:document [<!ENTITY a "CPR">]>'
+                '<w:document xmlns:w="http://schemas.openxmlformats.org/'
+                'wordprocessingml/2006/main"><w:body>'
+                '<w:p><w:r><w:t>&a;</w:t></w:r></w:p>'
+                '</w:body></w:document>'
+        })
+        with self.assertRaises(office.ExtractionError):
+            list(office.extract_text(archive))
+
+    def test_opendocument(self):
+        archive = self.make_archive({
+            'mimetype': 'application/vnd.oasis.opendocument.text',
+            'content.xml':
+                '<office:document-content '
+                'xmlns:office="urn:oasis:names:tc:opendocument:xmlns:'
+                'office:1.0" '
+                'xmlns:text="urn:oasis:names:tc:opendocument:xmlns:text:1.0">'
+                '<office:body><office:text>'
+                '<text:h>Titel</text:h>'
+                '<text:p>Jens<text:s/><text:span>Hansen</text:span></text:p>'
+                '</office:text></office:body></office:document-content>'
+        })
+        self.assertFalse(office.is_spreadsheet(archive))
+        self.assertEqual(''.join(office.extract_text(archive)),
+                         'Titel\nJens Hansen\n')
+
+    def test_unknown_document(self):
+        archive = self.make_archive({'readme.txt': 'Hello'})
+        with self.assertRaises(office.ExtractionError):
+            list(office.extract_text(archive))
+
+
 class HTMLTest(unittest.TestCase):
 
     test_dir = base_dir + '/scrapy-webscanner/tests/data/'
@@ -358,6 +912,211 @@ class ZIPTest(unittest.TestCase):
             return
         self.assertEqual(result, True)
 
+    def test_zip_bomb(self):
+        url = Url(scan=Scan(), url='http://example.com/bomb.zip')
+        with tempfile.TemporaryDirectory(dir=self.test_dir + 'tmp/') as temp_dir:
+            file_path = os.path.join(temp_dir, 'bomb.zip')
+            with zipfile.ZipFile(file_path, 'w', zipfile.ZIP_DEFLATED) as f:
+                f.writestr('zeros.txt', b'\0' * 32 * 1024 * 1024)
+            item = ConversionQueueItem(url=url, file=file_path,
+                                       type=zip.ZipProcessor,
+                                       status=ConversionQueueItem.NEW)
+            tmp_dir = os.path.join(temp_dir, 'tmp')
+            os.makedirs(tmp_dir)
+            result = zip.ZipProcessor().convert(item, tmp_dir)
+        self.assertEqual(result, False)
+
+    def test_can_process_inline(self):
+        url = Url(scan=Scan(), url='http://example.com/test.zip')
+        zip_processor = zip.ZipProcessor()
+        data = io.BytesIO()
+        with zipfile.ZipFile(data, 'w') as archive:
+            archive.writestr('test.txt', 'Some text')
+        self.assertTrue(zip_processor.can_process_inline(data.getvalue(),
+                                                         url))
+        self.assertFalse(zip_processor.can_process_inline(b'Not a zip',
+                                                          url))
+
+    def test_inline_members_of_nested_zip(self):
+        url = Url(scan=Scan(), url='http://example.com/test.zip')
+        inner = io.BytesIO()
+        with zipfile.ZipFile(inner, 'w') as archive:
+            archive.writestr('inner.txt', 'Inner text')
+        data = io.BytesIO()
+        with zipfile.ZipFile(data, 'w') as archive:
+            archive.writestr('outer.txt', 'Outer text')
+            archive.writestr('inner.zip', inner.getvalue())
+        members = zip.ZipProcessor().inline_members(data.getvalue(), url)
+        self.assertEqual([(member_name, member_data)
+                          for p, member_name, member_data in members],
+                         [('outer.txt', b'Outer text'),
+                          ('inner.txt', b'Inner text')])
+
+    def test_inline_failure_queues_the_rest(self):
+        url = Url(scan=Scan(), url='http://example.com/test.zip')
+        zip_processor = zip.ZipProcessor()
+        data = io.BytesIO()
+        with zipfile.ZipFile(data, 'w') as archive:
+            for file_name in ('a.txt', 'b.txt', 'c.txt'):
+                archive.writestr(file_name, 'Some text')
+        text_processor = processor.Processor.processor_by_type('text')
+        processed = []
+
+        def process_inline(member_data, url_object):
+            processed.append(member_data)
+            return len(processed) != 2
+        text_processor.process_inline = process_inline
+        queued = []
+        zip_processor.queue_members = lambda members, url_object: (
+            queued.extend(member_name for p, member_name, d in members))
+        try:
+            self.assertTrue(zip_processor.process_inline(data.getvalue(),
+                                                         url))
+        finally:
+            del text_processor.process_inline
+        self.assertEqual(len(processed), 2)
+        self.assertEqual(queued, ['b.txt', 'c.txt'])
+
+
+class GenericArchiveTest(unittest.TestCase):
+
+    """Test reading the members of tar files and compressed files."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.processor = generic_archive.GenericArchiveProcessor()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def members(self, file_path):
+        return [(member_name, f.read())
+                for member_name, f in self.processor.members(file_path)]
+
+    def test_tar_members(self):
+        file_path = os.path.join(self.temp_dir, 'test.tar.gz')
+        with tarfile.open(file_path, 'w:gz') as archive:
+            for member_name, data in [('a.txt', b'Alpha'),
+                                      ('dir/b.txt', b'Bravo')]:
+                info = tarfile.TarInfo(member_name)
+                info.size = len(data)
+                archive.addfile(info, io.BytesIO(data))
+        self.assertEqual(self.members(file_path),
+                         [('a.txt', b'Alpha'), ('dir/b.txt', b'Bravo')])
+
+    def test_compressed_file_members(self):
+        file_path = os.path.join(self.temp_dir, 'test.txt.gz')
+        with gzip.open(file_path, 'wb') as f:
+            f.write(b'Some text')
+        self.assertEqual(self.members(file_path),
+                         [('test.txt', b'Some text')])
+        self.assertEqual(processor.guess_mime_type(file_path),
+                         'application/gzip')
+
+    def test_libarchive_formats_need_libarchive(self):
+        expected = 'archive' if generic_archive.libarchive else None
+        for mime_type in generic_archive.LIBARCHIVE_MIME_TYPES:
+            self.assertEqual(
+                processor.Processor.mimetype_to_processor_type(mime_type),
+                expected)
+
+
+class ConversionCacheTest(unittest.TestCase):
+
+    """Test the cache of text extracted from files."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache = conversion_cache.ConversionCache(self.temp_dir, 1000)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_get_and_put(self):
+        key = conversion_cache.content_key(b'Some content')
+        self.assertIsNone(self.cache.get_text('pdf', key))
+        self.cache.put_text('pdf', key, 'Extracted text \u00e6\u00f8\u00e5')
+        self.assertEqual(self.cache.get_text('pdf', key),
+                         'Extracted text \u00e6\u00f8\u00e5')
+        self.assertIsNone(self.cache.get_text('ocr', key))
+
+        file_path = os.path.join(self.temp_dir, 'content')
+        with open(file_path, 'wb') as f:
+            f.write(b'Some content')
+        self.assertEqual(conversion_cache.file_content_key(file_path), key)
+
+    def test_evict_least_recently_used(self):
+        for i in range(10):
+            self.cache.put_text('text', str(i) * 4, 'x' * 200)
+            # Make the order of use unambiguous
+            path = self.cache._path('text', str(i) * 4)
+            os.utime(path, (i, i))
+        self.cache.evict()
+        remaining = [i for i in range(10)
+                     if self.cache.get_text('text', str(i) * 4) is not None]
+        self.assertEqual(remaining, [6, 7, 8, 9])
+
+    def test_evict_when_due(self):
+        for i in range(10):
+            self.cache.put_text('text', str(i) * 4, 'x' * 200)
+        # Another process checked the size too recently
+        self.assertIsNotNone(self.cache.get_text('text', '0000'))
+
+        stamp_path = os.path.join(self.temp_dir,
+                                  conversion_cache.EVICTION_STAMP)
+        os.utime(stamp_path, (0, 0))
+        directory = os.path.dirname(self.cache._path('text', '0000'))
+        stale_path = os.path.join(directory, '.stale')
+        written_path = os.path.join(directory, '.written')
+        for path in (stale_path, written_path):
+            with open(path, 'w'):
+                pass
+        os.utime(stale_path, (0, 0))
+
+        conversion_cache.ConversionCache(self.temp_dir, 1000)
+        remaining = [i for i in range(10)
+                     if self.cache.get_text('text', str(i) * 4) is not None]
+        self.assertEqual(len(remaining), 4)
+        self.assertFalse(os.path.exists(stale_path))
+        self.assertTrue(os.path.exists(written_path))
+
+
+class InlinePoolTest(unittest.TestCase):
+
+    """Test the pool processing small spider items in the spider."""
+
+    def test_bounded(self):
+        pool = processor.InlinePool(1)
+        event = threading.Event()
+        self.assertTrue(pool.submit(event.wait))
+        self.assertTrue(pool.submit(event.wait))
+        self.assertFalse(pool.submit(event.wait))
+        self.assertFalse(pool.is_idle())
+        event.set()
+        pool.executor.shutdown()
+        self.assertTrue(pool.is_idle())
+
+
+class ContentMatchesTest(unittest.TestCase):
+
+    """Test the matches recorded for reuse by later scans."""
+
+    def test_set_and_get_matches(self):
+        from os2webscanner.models.contentmatches_model import ContentMatches
+        content_matches = ContentMatches(content_hash='abc',
+                                         rule_fingerprint='def')
+        content_matches.set_matches([
+            {'url': 1, 'matched_data': '1111111118', 'matched_rule': 'cpr',
+             'sensitivity': 2, 'match_context': 'CPR 1111111118',
+             'page_no': None}
+        ])
+        self.assertEqual(content_matches.get_matches(), [
+            {'matched_data': '1111111118', 'matched_rule': 'cpr',
+             'sensitivity': 2, 'match_context': 'CPR 1111111118',
+             'page_no': None}
+        ])
+
+
 class StoreStatsTest(unittest.TestCase):
 
     def test_store_stats(self):
@@ -573,6 +1332,111 @@ class RegexRuleIsAllMatchTest(unittest.TestCase):
         result = regex_rule.is_all_match(matches)
         self.assertEqual(result, True)
 
+    def test_name_something_rule_only_names(self):
+        text = """
+        Bacon ipsum dolor amet turducken Danni Als alcatra boudin
+        filet mignon shankle Hans Hansen
+        """
+        rule = self.create_regexrule('name_something_rule',
+                                     'Finds name and the word Something.',
+                                     False, False)
+
+        pattern_objects = PatternMockObjects()
+        regex_pattern1 = PatternMockObject()
+        regex_pattern2 = PatternMockObject()
+
+        regex_pattern2.pattern_string = 'Something'
+
+        pattern_objects.add_pattern_string(regex_pattern1)
+        pattern_objects.add_pattern_string(regex_pattern2)
+
+        regex_rule = self.create_scanner_regexrule(pattern_objects, rule)
+        matches = regex_rule.execute(text)
+        result = regex_rule.is_all_match(matches)
+        self.assertEqual(result, False)
+
+    def test_patterns_on_separate_pages(self):
+        pages = ["Something bacon ipsum dolor amet turducken",
+                 "tail Danni Als alcatra boudin filet mignon shankle"]
+        rule = self.create_regexrule('name_something_rule',
+                                     'Finds name and the word Something.',
+                                     False, False)
+
+        pattern_objects = PatternMockObjects()
+        regex_pattern1 = PatternMockObject()
+        regex_pattern2 = PatternMockObject()
+
+        regex_pattern2.pattern_string = 'Something'
+
+        pattern_objects.add_pattern_string(regex_pattern1)
+        pattern_objects.add_pattern_string(regex_pattern2)
+
+        scanner = Scanner.__new__(Scanner)
+        scanner.rules = [self.create_scanner_regexrule(pattern_objects, rule)]
+        # Neither page matches the rule on its own
+        for page in pages:
+            self.assertEqual(scanner.execute_rules(page), [])
+
+        matches = scanner.execute_rules_pages(pages)
+        self.assertEqual(len(matches), 1)
+        self.assertIn('Something', matches[0]['matched_data'])
+        self.assertIn('Danni Als', matches[0]['matched_data'])
+        self.assertIn(matches[0]['page_no'], (1, 2))
+
+    def test_backreference_pattern(self):
+        text = "Kode: abcabc og 77"
+        rule = self.create_regexrule('backreference_rule',
+                                     'Finds repeated letters and digits.',
+                                     False, False)
+
+        pattern_objects = PatternMockObjects()
+        regex_pattern1 = PatternMockObject()
+        regex_pattern2 = PatternMockObject()
+
+        regex_pattern1.pattern_string = '\\b([a-z]{3})\\1\\b'
+        regex_pattern2.pattern_string = '\\b([0-9])\\1\\b'
+
+        pattern_objects.add_pattern_string(regex_pattern1)
+        pattern_objects.add_pattern_string(regex_pattern2)
+
+        regex_rule = self.create_scanner_regexrule(pattern_objects, rule)
+        matches = regex_rule.execute(text)
+        self.assertEqual(
+            {(match['matched_data'], match['matched_pattern'])
+             for match in matches},
+            {('abcabc', regex_pattern1), ('77', regex_pattern2)}
+        )
+
+    def test_long_match_of_pattern_without_groups(self):
+        text = "foo" + "x" * 2000 + "bar baz1"
+        rule = self.create_regexrule('long_match_rule',
+                                     'Finds long matches.',
+                                     False, False)
+
+        pattern_objects = PatternMockObjects()
+        regex_pattern1 = PatternMockObject()
+        regex_pattern2 = PatternMockObject()
+
+        regex_pattern1.pattern_string = 'foo.*bar'
+        regex_pattern2.pattern_string = 'baz(\\d)'
+
+        pattern_objects.add_pattern_string(regex_pattern1)
+        pattern_objects.add_pattern_string(regex_pattern2)
+
+        regex_rule = self.create_scanner_regexrule(pattern_objects, rule)
+        matches = regex_rule.execute(text)
+        self.assertEqual(
+            {(match['matched_data'], match['matched_pattern'])
+             for match in matches},
+            {(text[:regexrule.MAX_MATCH_LENGTH], regex_pattern1),
+             ('baz1', regex_pattern2)}
+        )
+        self.assertTrue(regex_rule.is_all_match(matches))
+
+    def test_compiled_patterns_are_shared(self):
+        self.assertIs(regexrule.compile_pattern('Something'),
+                      regexrule.compile_pattern('Something'))
+
 
 class PatternMockObjects(object):
     """
@@ -191,6 +191,56 @@ PAUSE_NON_OCR_ITEMS_THRESHOLD = 2000
 # PAUSE_NON_OCR_ITEMS_THRESHOLD.
 RESUME_NON_OCR_ITEMS_THRESHOLD = PAUSE_NON_OCR_ITEMS_THRESHOLD - 1000
 
+# The size in bytes above which text files are scanned in overlapping windows
+# instead of being read into memory as a whole. This keeps the memory usage
+# of processors flat for e.g. large CSV files exported by LibreOffice.
+TEXT_WINDOW_THRESHOLD = 16 * 1024 * 1024
+
+# The number of characters of text in each window when scanning in windows.
+TEXT_WINDOW_SIZE = 1024 * 1024
+
+# Whether the PDF processor extracts the text of PDFs page by page and
+# executes the rules on it directly. Otherwise PDFs are converted to HTML
+# with pdftohtml, which is queued for the HTML processor.
+PDF_EXTRACT_TEXT = True
+
+# The OCR engine: "tesserocr" to keep a tesseract API handle per OCR thread,
+# so the language models are only loaded once, or "tesseract" to run a
+# tesseract process per image. "tesserocr" requires the tesserocr package.
+OCR_ENGINE = 'tesserocr'
+
+# Number of threads recognizing images in each OCR processor, and number of
+# images each OCR processor claims at once, when OCR_ENGINE is "tesserocr".
+OCR_THREADS = 4
+OCR_BATCH_SIZE = 8
+
+# The size in bytes below which spider items which would be queued for
+# conversion, like PDF and zip files, are converted in the spider process
+# where possible. The items are processed by SPIDER_INLINE_THREADS threads.
+SPIDER_INLINE_MAX_BYTES = 256 * 1024
+SPIDER_INLINE_THREADS = 2
+
+# Archives in archives are processed down to ARCHIVE_MAX_DEPTH levels of
+# nesting. An archive may expand to at most ARCHIVE_MAX_RATIO times its size,
+# to stop archive bombs.
+ARCHIVE_MAX_DEPTH = 5
+ARCHIVE_MAX_RATIO = 100
+
+# The text extracted from PDF, Office and image files is cached by the hash
+# of the files' content in CONVERSION_CACHE_DIR, so copies of a file are
+# only converted once. The least recently used text is evicted when the
+# cache grows larger than CONVERSION_CACHE_MAX_BYTES; 0 disables the cache.
+CONVERSION_CACHE_DIR = os.path.join(VAR_DIR, 'conversion_cache')
+CONVERSION_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+
+# Record the matches of each scanned content by the hash of the content and
+# a fingerprint of the rules. Later scans with the same rules copy these
+# matches for unchanged content instead of converting and scanning it again.
+REUSE_CONTENT_MATCHES = True
+# Recorded matches are reused for at most this many days, after which the
+# content is scanned and recorded again.
+CONTENT_MATCHES_MAX_AGE_DAYS = 30
+
 # Directory to store files transmitted by RPC
 RPC_TMP_PREFIX = '/tmp/os2webscanner'
 